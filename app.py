@@ -1,80 +1,220 @@
-from flask import Flask, request, redirect, jsonify, render_template_string
-import json
+import time
+# Start of the import phase in the startup report (see warm_up)
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, request, redirect, jsonify
 import os
-from datetime import datetime
-import qrcode
-import io
-import base64
+import atexit
+import threading
 from dotenv import load_dotenv
+from storage import clean_ip, create_storage, without_bots
+from scan_export import stream_export, parse_page_size, parse_exclude_bots, with_ua_fields, EXPORT_MIMETYPES
+from campaign_cache import CampaignCache
+from scan_analytics import create_analytics
+from scan_dedup import DedupWindow, suppression_rate
+from scan_ingest import ingest_ndjson
+from bulk_stats import ResultCache, parse_bulk_stats_query
+from hll import visitor_hash
+from qr_render import render_qr, parse_render_options, render_cache
+from scan_fastpath import ScanFastPath
+from qr_batch import stream_qr_zip, parse_batch_request, check_batch_size, shutdown_executor
+from metrics import instrument_app, register_stats_gauges
+from ua_classifier import cache_stats as ua_cache_stats
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key')
+instrument_app(app)
 
-# Data storage paths
-CAMPAIGNS_FILE = 'data/campaigns.json'
-SCANS_FILE = 'data/scans.json'
+# Campaigns and scans live in the backend picked by STORAGE_BACKEND
+# (json, sqlite or postgres; see storage.py). Nothing is opened until
+# warm_up() runs.
+storage = create_storage()
 
-# Ensure data directory exists
-os.makedirs('data', exist_ok=True)
+# Repeat hits from the same visitor within SCAN_DEDUP_WINDOW seconds are
+# counted instead of written (off by default; see scan_dedup.py)
+scan_dedup = DedupWindow(storage.record_suppressed)
 
-def load_json_file(filepath):
-    """Load data from JSON file, return empty dict if file doesn't exist"""
-    try:
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+def shutdown():
+    """Flush storage and stop background work (prefork workers call this directly)"""
+    shutdown_executor()
+    scan_dedup.close()
+    storage.close()
+
+atexit.register(shutdown)
+
+# Campaign lookups for redirects, so steady-state scans skip the backend
+campaign_cache = CampaignCache(storage.get_campaign, watch_path=storage.watch_path)
+
+# Recent /campaigns/stats pages, so polling dashboards share one query
+bulk_stats_cache = ResultCache()
+
+# Columnar copy of the scans for timeseries analytics, created (and NumPy
+# imported) by the first timeseries request; None without NumPy
+analytics = None
+_analytics_loaded = False
+_analytics_lock = threading.Lock()
+
+def get_analytics():
+    """The analytics store (or None), created on first use"""
+    global analytics, _analytics_loaded
+    with _analytics_lock:
+        if not _analytics_loaded:
+            analytics = create_analytics(storage)
+            _analytics_loaded = True
+            if analytics:
+                register_stats_gauges('analytics', 'Columnar scan analytics store sizes', analytics.stats)
+    return analytics
+
+# Seconds spent in each startup phase, printed and exported by warm_up()
+startup_seconds = {'imports': time.perf_counter() - _import_started}
+_warm_lock = threading.Lock()
+_warmed = False
+
+def warm_up():
+    """Open storage and fill caches before the process accepts traffic
+    
+    Every entry point (run.py, prefork workers, app.py/app_db.py) calls
+    this before serving; an embedding server that doesn't gets it on the
+    first request instead. Connects the backend (PostgreSQL only checks
+    that the schema is current, it runs no DDL), preloads the campaign
+    cache and the scan fast path, and prints how long each phase took.
+    """
+    global _warmed
+    with _warm_lock:
+        if _warmed:
+            return
+        try:
+            _warm_up()
+        finally:
+            _warmed = True
+
+def _warm_up():
+    started = time.perf_counter()
+    if not storage.start():
+        print(f"❌ {storage.name} storage failed to start")
+        return
+    startup_seconds['storage'] = time.perf_counter() - started
+    
+    phase = time.perf_counter()
+    campaigns = storage.list_campaigns()
+    campaign_cache.preload(campaigns)
+    startup_seconds['campaign_cache'] = time.perf_counter() - phase
+    
+    # SCAN_FAST_PATH=1 answers known /scan/<id> redirects before Flask (see scan_fastpath.py)
+    if os.getenv('SCAN_FAST_PATH', '0') == '1':
+        phase = time.perf_counter()
+        fast_path = ScanFastPath(app.wsgi_app, record_fast_path_scan, campaign_cache)
+        fast_path.build(campaigns)
+        register_stats_gauges('scan_fast_path', 'WSGI scan redirect fast path counters', fast_path.stats)
+        app.wsgi_app = fast_path
+        startup_seconds['fast_path'] = time.perf_counter() - phase
+    
+    startup_seconds['warm_up'] = time.perf_counter() - started
+    startup_seconds['total'] = startup_seconds['imports'] + startup_seconds['warm_up']
+    phases = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in startup_seconds.items()
+                       if name not in ('warm_up', 'total'))
+    print(f"⏱️  Ready in {startup_seconds['total']:.3f}s ({phases}; {len(campaigns)} campaigns cached)")
+
+# Cache and storage gauges for /metrics
+register_stats_gauges('campaign_cache', 'Campaign lookup cache counters', campaign_cache.stats)
+register_stats_gauges('render_cache', 'Rendered QR image cache counters', render_cache.stats)
+register_stats_gauges('storage', 'Storage backend counters', storage.stats)
+register_stats_gauges('ua_cache', 'User-agent classifier memo cache counters', ua_cache_stats)
+register_stats_gauges('scan_dedup', 'Duplicate scan suppression counters', scan_dedup.stats)
+register_stats_gauges('bulk_stats_cache', 'Multi-campaign stats cache counters', bulk_stats_cache.stats)
+register_stats_gauges('startup', 'Startup phase durations in seconds', lambda: startup_seconds)
+
+def tracking_url_for(campaign_id):
+    base_url = os.getenv('BASE_URL', 'http://localhost:5000')
+    return f"{base_url}/scan/{campaign_id}"
 
-def save_json_file(filepath, data):
-    """Save data to JSON file"""
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2, default=str)
+@app.before_request
+def begin_storage_request():
+    if not _warmed:
+        warm_up()
+    storage.begin_request()
+
+@app.teardown_request
+def end_storage_request(exc):
+    storage.end_request()
 
 @app.route('/')
 def home():
     """Simple home page to test server"""
-    return """
+    return f"""
     <h1>QR Tracking Server</h1>
     <p>Server is running! 🚀</p>
-    <p>Ready to track QR code scans.</p>
+    <p>Ready to track QR code scans ({storage.name} storage).</p>
     """
 
+@app.route('/migrate')
+def migrate_data():
+    """Migrate existing JSON data into the database backend"""
+    try:
+        storage.migrate_json_data()
+        return "✅ Data migration completed successfully!"
+    except NotImplementedError:
+        return f"Migration is not supported by the {storage.name} backend", 501
+    except Exception as e:
+        return f"❌ Migration failed: {e}", 500
+
 @app.route('/scan/<campaign_id>')
 def scan_qr(campaign_id):
     """Handle QR code scans - log data and redirect to target URL"""
     
-    # Load campaigns to find target URL
-    campaigns = load_json_file(CAMPAIGNS_FILE)
+    # Look up the campaign to find target URL
+    campaign = campaign_cache.get(campaign_id)
     
-    if campaign_id not in campaigns:
+    if not campaign:
         return f"Campaign {campaign_id} not found", 404
     
-    # Get campaign details
-    campaign = campaigns[campaign_id]
-    target_url = campaign['target_url']
-    
-    # Collect scan data
-    scan_data = {
-        'campaign_id': campaign_id,
-        'timestamp': datetime.now().isoformat(),
-        'ip_address': request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
-        'user_agent': request.headers.get('User-Agent', ''),
-        'referrer': request.headers.get('Referer', ''),
-        'method': request.method
-    }
-    
     # Log the scan
-    scans = load_json_file(SCANS_FILE)
-    if 'scans' not in scans:
-        scans['scans'] = []
-    
-    scans['scans'].append(scan_data)
-    save_json_file(SCANS_FILE, scans)
+    record_scan_hit(
+        campaign_id,
+        request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
+        request.headers.get('User-Agent', ''),
+        request.headers.get('Referer', '')
+    )
     
     # Redirect to target URL
-    return redirect(target_url)
+    return redirect(campaign['target_url'])
+
+def record_scan_hit(campaign_id, ip_address, user_agent, referrer):
+    """Store one redirect's scan (shared by the route and the WSGI fast path)"""
+    # X-Forwarded-For may list proxies too; only the client address is kept
+    ip_address = clean_ip(ip_address)
+    # A prefetch or retry of a scan we just recorded is only counted
+    if scan_dedup.enabled and scan_dedup.is_duplicate(campaign_id, visitor_hash(ip_address, user_agent)):
+        return
+    storage.record_scan(campaign_id, ip_address, user_agent, referrer)
+
+def record_fast_path_scan(campaign_id, ip_address, user_agent, referrer):
+    """record_scan_hit() scoped like a Flask request (the fast path skips the hooks)"""
+    storage.begin_request()
+    try:
+        record_scan_hit(campaign_id, ip_address, user_agent, referrer)
+    finally:
+        storage.end_request()
+
+@app.route('/scans/batch', methods=['POST'])
+def ingest_scans():
+    """Store NDJSON scan events buffered by edge collectors (see scan_ingest.py)
+    
+    Each line needs an event_id, campaign_id and original timestamp.
+    Resending a batch is safe: events already stored are counted as
+    duplicates. Returns accepted/duplicates/rejected counts.
+    """
+    try:
+        result = ingest_ndjson(
+            request.stream,
+            storage.log_scans,
+            lambda campaign_id: campaign_cache.get(campaign_id) is not None
+        )
+    except Exception as e:
+        return jsonify({'error': str(e), **getattr(e, 'result', {})}), 500
+    return jsonify(result)
 
 @app.route('/create_campaign', methods=['POST'])
 def create_campaign():
@@ -84,85 +224,216 @@ def create_campaign():
     if not data or 'business_name' not in data or 'target_url' not in data:
         return jsonify({'error': 'Missing required fields: business_name, target_url'}), 400
     
-    # Generate campaign ID (simple approach for MVP)
-    campaigns = load_json_file(CAMPAIGNS_FILE)
-    campaign_count = len(campaigns)
-    campaign_id = f"camp_{campaign_count + 1:04d}"
-    
-    # Create campaign
-    campaign = {
-        'campaign_id': campaign_id,
-        'business_name': data['business_name'],
-        'target_url': data['target_url'],
-        'description': data.get('description', ''),
-        'created_date': datetime.now().isoformat(),
-        'status': 'active'
-    }
-    
-    campaigns[campaign_id] = campaign
-    save_json_file(CAMPAIGNS_FILE, campaigns)
-    
-    # Generate tracking URL
-    base_url = os.getenv('BASE_URL', 'http://localhost:5000')
-    tracking_url = f"{base_url}/scan/{campaign_id}"
+    # The backend allocates the ID, so concurrent creates can't collide
+    try:
+        campaign = storage.create_campaign(
+            data['business_name'],
+            data['target_url'],
+            data.get('description', '')
+        )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    campaign_id = campaign['campaign_id']
+    campaign_cache.invalidate(campaign_id)
     
     return jsonify({
         'success': True,
         'campaign_id': campaign_id,
-        'tracking_url': tracking_url,
+        'tracking_url': tracking_url_for(campaign_id),
         'campaign': campaign
     })
 
 @app.route('/campaigns')
 def list_campaigns():
     """List all campaigns"""
-    campaigns = load_json_file(CAMPAIGNS_FILE)
-    return jsonify(campaigns)
+    campaigns = storage.list_campaigns()
+    return jsonify({campaign['campaign_id']: campaign for campaign in campaigns})
+
+@app.route('/campaigns/stats')
+def list_campaign_stats():
+    """Totals for many campaigns in one call (see bulk_stats.py)
+    
+    Select with ?ids=a,b,... and/or ?status= and ?business=; pass
+    ?limit= and the returned next_cursor as ?cursor= to page through.
+    ?exclude_bots=1 leaves bot scans out of each total_scans.
+    """
+    try:
+        query = parse_bulk_stats_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    key = tuple((name, tuple(value) if isinstance(value, list) else value) for name, value in query.items())
+    page = bulk_stats_cache.get(key)
+    if page is None:
+        try:
+            page = storage.list_campaign_stats(**query)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        bulk_stats_cache.put(key, page)
+    
+    entries, next_cursor = page
+    exclude_bots = parse_exclude_bots(request.args)
+    campaigns = []
+    for entry in entries:
+        entry = dict(entry, suppression_rate=suppression_rate(entry))
+        campaigns.append(without_bots(entry) if exclude_bots else entry)
+    return jsonify({'campaigns': campaigns, 'next_cursor': next_cursor})
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Campaign lookup cache counters"""
+    return jsonify(campaign_cache.stats())
+
+@app.route('/storage/stats')
+def storage_stats():
+    """Storage backend counters (scan queue, pool, log size...)"""
+    return jsonify({'backend': storage.name, **storage.stats()})
 
 @app.route('/campaign/<campaign_id>/stats')
 def campaign_stats(campaign_id):
-    """Get statistics for a specific campaign"""
-    scans = load_json_file(SCANS_FILE)
-    campaign_scans = [scan for scan in scans.get('scans', []) if scan['campaign_id'] == campaign_id]
+    """Get statistics for a specific campaign
     
-    stats = {
-        'campaign_id': campaign_id,
-        'total_scans': len(campaign_scans),
-        'scans': campaign_scans
-    }
+    Raw scans are paginated: pass ?limit= and the returned next_cursor as
+    ?cursor= to fetch the following page. ?exclude_bots=1 leaves bot scans
+    out of total_scans. suppression_rate is the share of hits dropped by
+    the duplicate-scan window.
+    """
+    try:
+        limit = parse_page_size(request.args)
+        stats = storage.get_campaign_stats(campaign_id)
+        stats['suppression_rate'] = suppression_rate(stats)
+        if parse_exclude_bots(request.args):
+            stats = without_bots(stats)
+        scans, stats['next_cursor'] = storage.get_campaign_scans(
+            campaign_id,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            since=request.args.get('since')
+        )
+        stats['scans'] = [with_ua_fields(dict(scan)) for scan in scans]
+        return jsonify(stats)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/campaign/<campaign_id>/export.<any(ndjson, csv):fmt>')
+def export_scans(campaign_id, fmt):
+    """Stream every scan for a campaign as NDJSON or CSV"""
+    scans = storage.iter_campaign_scans(campaign_id, since=request.args.get('since'))
+    response = Response(stream_export(scans, fmt), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{campaign_id}_scans.{fmt}"'
+    return response
+
+@app.route('/campaign/<campaign_id>/timeseries')
+def campaign_timeseries(campaign_id):
+    """Hourly or daily scans/unique visitors (?exclude_bots=1 drops bot scans)
     
-    return jsonify(stats)
+    With the analytics engine enabled the response also carries
+    top_referrers (?top=N) and peak_hour, and unique visitors are exact.
+    """
+    exclude_bots = parse_exclude_bots(request.args)
+    extra = {}
+    try:
+        analytics = get_analytics()
+        # None until the analytics store has finished its first load
+        result = analytics.campaign_timeseries(
+            campaign_id,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            granularity=request.args.get('granularity', 'hour'),
+            exclude_bots=exclude_bots,
+            top=request.args.get('top', 10, type=int)
+        ) if analytics else None
+        if result is not None:
+            series = result.pop('series')
+            extra = result
+        else:
+            series = storage.get_campaign_timeseries(
+                campaign_id,
+                start=request.args.get('start'),
+                end=request.args.get('end'),
+                granularity=request.args.get('granularity', 'hour')
+            )
+        if exclude_bots:
+            series = [without_bots(entry, 'scans') for entry in series]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'campaign_id': campaign_id, 'series': series, **extra})
 
 @app.route('/generate_qr/<campaign_id>')
 def generate_qr(campaign_id):
     """Generate QR code for a campaign"""
-    campaigns = load_json_file(CAMPAIGNS_FILE)
+    campaign = campaign_cache.get(campaign_id)
     
-    if campaign_id not in campaigns:
+    if not campaign:
         return f"Campaign {campaign_id} not found", 404
     
-    base_url = os.getenv('BASE_URL', 'http://localhost:5000')
-    tracking_url = f"{base_url}/scan/{campaign_id}"
-    
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(tracking_url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convert to base64 for display
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format='PNG')
-    img_str = base64.b64encode(img_buffer.getvalue()).decode()
+    stats = storage.get_campaign_stats(campaign_id)
     
+    # The image itself is served (and cached) by /qr/<campaign_id>.png
     return f"""
     <h2>QR Code for Campaign: {campaign_id}</h2>
-    <p>Business: {campaigns[campaign_id]['business_name']}</p>
-    <p>Tracking URL: {tracking_url}</p>
-    <p>Target URL: {campaigns[campaign_id]['target_url']}</p>
-    <img src="data:image/png;base64,{img_str}" alt="QR Code">
+    <p>Business: {campaign['business_name']}</p>
+    <p>Tracking URL: {tracking_url_for(campaign_id)}</p>
+    <p>Target URL: {campaign['target_url']}</p>
+    <p>Total Scans: {stats['total_scans']} | Unique Visitors: {stats['unique_visitors']}</p>
+    <img src="/qr/{campaign_id}.png" alt="QR Code">
+    <p><a href="/qr/{campaign_id}.svg">Download SVG</a></p>
     """
 
+@app.route('/generate_qr/batch', methods=['POST'])
+def generate_qr_batch():
+    """Render many campaigns' QR codes in parallel and stream them back as a ZIP"""
+    data = request.get_json(silent=True)
+    try:
+        campaign_ids, fmt = parse_batch_request(data)
+        options = parse_render_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if campaign_ids is None:
+        campaign_ids = [c['campaign_id'] for c in storage.list_campaigns(status='active')]
+        try:
+            check_batch_size(len(campaign_ids))
+        except ValueError as e:
+            return jsonify({'error': f"{e}; {len(campaign_ids)} campaigns are active, list them in campaign_ids"}), 400
+    found = [cid for cid in campaign_ids if campaign_cache.get(cid)]
+    missing = [cid for cid in campaign_ids if cid not in found]
+    items = [(campaign_id, tracking_url_for(campaign_id)) for campaign_id in found]
+    
+    response = Response(stream_qr_zip(items, fmt, options, missing), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="qr_codes_{fmt}.zip"'
+    return response
+
+@app.route('/qr/<campaign_id>.<any(png, svg):fmt>')
+def qr_image(campaign_id, fmt):
+    """Raw QR image for a campaign, cached and served with an ETag"""
+    campaign = campaign_cache.get(campaign_id)
+    
+    if not campaign:
+        return f"Campaign {campaign_id} not found", 404
+    
+    try:
+        options = parse_render_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rendered = render_qr(tracking_url_for(campaign_id), fmt, **options)
+    
+    response = Response(rendered.body, content_type=rendered.content_type)
+    response.set_etag(rendered.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = int(os.getenv('QR_CACHE_MAX_AGE', '86400'))
+    return response.make_conditional(request)
+
+@app.route('/qr_cache/stats')
+def qr_cache_stats():
+    return jsonify(render_cache.stats())
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server; use `python run.py --serve` in production
+    warm_up()
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Load-test and benchmark harness for the QR tracking server
+
+Starts app.py with the chosen storage backend (json, sqlite or postgres)
+in a scratch directory, seeds campaigns and historical scans, then drives a concurrent
+mix of scan / stats / generate_qr traffic and reports throughput and
+p50/p95/p99 latency per operation.
+
+Examples:
+    python benchmark.py --backend json --duration 20 --concurrency 16
+    python benchmark.py --backend sqlite --rate 300
+    python benchmark.py --backend postgres --database-url postgresql://localhost/qr_bench
+    python benchmark.py --rate 500 --output results.json --baseline benchmarks/baseline.json
+    python benchmark.py --workers 4 --concurrency 32   # prefork server (run.py --serve)
+    python benchmark.py --compare-fast-path --mix scan=1   # Flask route vs WSGI fast path
+
+Any PostgreSQL reachable through --database-url works, so a throwaway
+local instance (e.g. a container or a temporary initdb cluster) can stand
+in for production. Results are printed and optionally written as JSON;
+--baseline compares against a stored run and exits non-zero when p95
+latency or throughput regresses beyond --tolerance.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = 'scan=80,stats=15,qr=5'
+
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('scan', 'stats', 'qr'):
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Server:
+    """Runs one of the apps in a subprocess with its own data directory"""
+
+    def __init__(self, backend, port, workdir, env_overrides, workers=0):
+        self.backend = backend
+        self.port = port
+        self.workdir = workdir
+        self.workers = workers
+        self.env = dict(os.environ, **env_overrides)
+        self.env['PYTHONPATH'] = REPO_DIR + os.pathsep + self.env.get('PYTHONPATH', '')
+        self.env['BASE_URL'] = f"http://127.0.0.1:{port}"
+        self.env['STORAGE_BACKEND'] = backend
+        self.process = None
+
+    def start(self, timeout=30):
+        if self.workers:
+            command = [sys.executable, os.path.join(REPO_DIR, 'run.py'), '--serve', '--workers', str(self.workers),
+                       '--host', '127.0.0.1', '--port', str(self.port)]
+        else:
+            bootstrap = (
+                "from app import app, warm_up; warm_up(); "
+                f"app.run(host='127.0.0.1', port={self.port}, threaded=True, debug=False)"
+            )
+            command = [sys.executable, '-c', bootstrap]
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            command,
+            cwd=self.workdir, env=self.env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited early; see {self.log.name}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                conn.request('GET', '/')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("Server did not start in time")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.process:
+            self.log.close()
+
+
+def seed_json_scans(workdir, campaign_ids, count):
+    """Append historical scans to the JSON backend's segmented scan log (server stopped)
+
+    The server's counters replay the appended tail on their next start.
+    """
+    sys.path.insert(0, REPO_DIR)
+    from scan_log import ScanLog
+
+    data_dir = os.path.join(workdir, 'data')
+    scan_log = ScanLog(os.path.join(data_dir, 'scan_segments'), legacy_path=os.path.join(data_dir, 'scans.json'),
+                       legacy_log_path=os.path.join(data_dir, 'scans.log'), durability='periodic', compact_interval=0)
+    seed_storage_scans(scan_log, campaign_ids, count, log_scans=scan_log.append_many)
+    scan_log.close()
+
+
+def seed_storage_scans(storage, campaign_ids, count, log_scans=None):
+    """Bulk-insert historical scans through a backend's log_scans"""
+    log_scans = log_scans or storage.log_scans
+    start = datetime.now() - timedelta(days=30)
+    batch = []
+    for i in range(count):
+        batch.append({
+            'campaign_id': campaign_ids[i % len(campaign_ids)],
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            'ip_address': f"10.{i % 250}.{(i // 250) % 250}.1",
+            'user_agent': USER_AGENTS[i % len(USER_AGENTS)],
+            'referrer': ''
+        })
+        if len(batch) >= 5000:
+            log_scans(batch)
+            batch = []
+    if batch:
+        log_scans(batch)
+
+
+def count_scans(port, campaign_ids):
+    """Total scans the server reports across campaign_ids"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    total = 0
+    for i in range(0, len(campaign_ids), 1000):
+        conn.request('GET', '/campaigns/stats?limit=1000&ids=' + ','.join(campaign_ids[i:i + 1000]))
+        response = conn.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"Stats request failed: {data}")
+        total += sum(entry['total_scans'] for entry in data['campaigns'])
+    conn.close()
+    return total
+
+
+def seed_sqlite_scans(workdir, campaign_ids, count):
+    sys.path.insert(0, REPO_DIR)
+    from storage_sqlite import SQLiteStorage
+
+    storage = SQLiteStorage(path=os.path.join(workdir, 'data', 'qr_tracker.db'))
+    storage.start()
+    seed_storage_scans(storage, campaign_ids, count)
+    storage.close()
+
+
+def setup_postgres_schema(database_url):
+    """Create the tables the server expects (it only verifies them at startup)"""
+    sys.path.insert(0, REPO_DIR)
+    os.environ['DATABASE_URL'] = database_url
+    from database import Database
+
+    db = Database()
+    if not db.connect():
+        raise RuntimeError("Could not connect to PostgreSQL")
+    db.create_tables()
+    db.close()
+
+
+def seed_postgres_scans(database_url, campaign_ids, count):
+    sys.path.insert(0, REPO_DIR)
+    os.environ['DATABASE_URL'] = database_url
+    from database import Database
+
+    db = Database()
+    if not db.connect():
+        raise RuntimeError("Could not connect to PostgreSQL for seeding")
+    seed_storage_scans(db, campaign_ids, count)
+    db.close()
+
+
+def create_campaigns(port, count):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    campaign_ids = []
+    for i in range(count):
+        body = json.dumps({'business_name': f"Bench {i}", 'target_url': f"https://example.com/{i}"})
+        conn.request('POST', '/create_campaign', body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"Campaign creation failed: {data}")
+        campaign_ids.append(data['campaign_id'])
+    conn.close()
+    return campaign_ids
+
+
+class LoadGenerator:
+    def __init__(self, port, campaign_ids, mix, concurrency, duration, rate, warmup, seed=1):
+        self.port = port
+        self.seed = seed
+        self.campaign_ids = campaign_ids
+        self.operations = list(mix)
+        self.weights = [mix[op] for op in self.operations]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.rate = rate
+        self.warmup = warmup
+        self.samples = {op: [] for op in self.operations}
+        self.errors = {op: 0 for op in self.operations}
+        self._lock = threading.Lock()
+
+    def _path(self, op, rng):
+        campaign_id = rng.choice(self.campaign_ids)
+        if op == 'scan':
+            return f"/scan/{campaign_id}", {'User-Agent': rng.choice(USER_AGENTS)}
+        if op == 'stats':
+            return f"/campaign/{campaign_id}/stats?limit=20", {}
+        return f"/generate_qr/{campaign_id}", {}
+
+    def _worker(self, index, start, end):
+        # Same --seed, same request sequence per worker
+        rng = random.Random(f"{self.seed}:{index}")
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        # Open-loop pacing: each worker owns every concurrency-th slot of the
+        # target rate, and latency is measured from the scheduled send time
+        # so a stalled server is not hidden (coordinated omission)
+        interval = self.concurrency / self.rate if self.rate else 0
+        scheduled = start + (index / self.rate if self.rate else 0)
+        local = {op: [] for op in self.operations}
+        errors = {op: 0 for op in self.operations}
+
+        while True:
+            now = time.monotonic()
+            if self.rate:
+                if scheduled > now:
+                    time.sleep(scheduled - now)
+                sent = scheduled
+                scheduled += interval
+            else:
+                sent = now
+            if sent >= end:
+                break
+
+            op = rng.choices(self.operations, self.weights)[0]
+            path, headers = self._path(op, rng)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            latency = time.monotonic() - sent
+
+            if sent >= start + self.warmup:
+                if ok:
+                    local[op].append(latency)
+                else:
+                    errors[op] += 1
+        conn.close()
+
+        with self._lock:
+            for op in self.operations:
+                self.samples[op].extend(local[op])
+                self.errors[op] += errors[op]
+
+    def run(self):
+        start = time.monotonic() + 0.2
+        end = start + self.warmup + self.duration
+        threads = [
+            threading.Thread(target=self._worker, args=(i, start, end), daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report()
+
+    def report(self):
+        operations = {}
+        total = 0
+        for op in self.operations:
+            latencies = sorted(self.samples[op])
+            total += len(latencies)
+            operations[op] = {
+                'requests': len(latencies),
+                'errors': self.errors[op],
+                'throughput_rps': round(len(latencies) / self.duration, 2),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+                'max_ms': round((latencies[-1] if latencies else 0) * 1000, 3)
+            }
+        return {'total_rps': round(total / self.duration, 2), 'operations': operations}
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions versus a baseline run"""
+    regressions = []
+    if results['total_rps'] < baseline['total_rps'] * (1 - tolerance):
+        regressions.append(f"total throughput {results['total_rps']} rps < baseline {baseline['total_rps']} rps")
+    for op, current in results['operations'].items():
+        previous = baseline.get('operations', {}).get(op)
+        if not previous or not previous['requests']:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{op} p95 {current['p95_ms']}ms > baseline {previous['p95_ms']}ms")
+        if current['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{op} throughput {current['throughput_rps']} rps < baseline {previous['throughput_rps']} rps")
+    return regressions
+
+
+def run_benchmark(args, env_overrides):
+    """Start a fresh server, seed it and drive the load; returns LoadGenerator.report()"""
+    workdir = tempfile.mkdtemp(prefix='qr-bench-')
+    port = free_port()
+    server = Server(args.backend, port, workdir, env_overrides, workers=args.workers)
+    try:
+        if args.backend == 'postgres':
+            setup_postgres_schema(args.database_url)
+        print(f"🚀 Starting {args.backend} backend on port {port} ({workdir})")
+        server.start()
+        campaign_ids = create_campaigns(port, args.campaigns)
+
+        if args.seed_scans:
+            print(f"🌱 Seeding {args.seed_scans} historical scans...")
+            if args.backend in ('json', 'sqlite'):
+                # Seed with the server stopped, then restart from a cold start
+                server.stop()
+                if args.backend == 'json':
+                    seed_json_scans(workdir, campaign_ids, args.seed_scans)
+                else:
+                    seed_sqlite_scans(workdir, campaign_ids, args.seed_scans)
+                server.start()
+            else:
+                seed_postgres_scans(args.database_url, campaign_ids, args.seed_scans)
+            # A benchmark against an empty history would look misleadingly fast
+            seeded = count_scans(port, campaign_ids)
+            if seeded != args.seed_scans:
+                raise RuntimeError(f"Seeded {args.seed_scans} scans but the server reports {seeded}")
+
+        print(f"📈 Running {args.duration}s at concurrency {args.concurrency}"
+              + (f", {args.rate} req/s" if args.rate else ", unthrottled"))
+        generator = LoadGenerator(
+            port, campaign_ids, parse_mix(args.mix), args.concurrency,
+            args.duration, args.rate, args.warmup, seed=args.seed
+        )
+        return generator.run()
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare_fast_path(args, env_overrides):
+    """Run the scan redirect through the Flask route, then the WSGI fast path, and print both"""
+    runs = {}
+    for label, enabled in (('flask', '0'), ('fast path', '1')):
+        print(f"\n=== /scan via {label} ===")
+        runs[label] = run_benchmark(args, dict(env_overrides, SCAN_FAST_PATH=enabled))['operations']['scan']
+
+    print(f"\n{'scan route':<12}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in runs.items():
+        print(f"{label:<12}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    flask, fast = runs['flask'], runs['fast path']
+    print(f"Fast path saves {flask['p50_ms'] - fast['p50_ms']:.3f} ms at p50 and "
+          f"{flask['p95_ms'] - fast['p95_ms']:.3f} ms at p95 per redirect")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the QR tracking server")
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'postgres'], default='json')
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help="PostgreSQL for --backend postgres (use a disposable database)")
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--seed-scans', type=int, default=10000, help="Historical scans loaded before the run")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Operation weights, e.g. scan=80,stats=15,qr=5")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15.0, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Unmeasured seconds before the run")
+    parser.add_argument('--rate', type=float, default=0, help="Target requests/sec (0 = as fast as possible)")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Extra environment for the server process (repeatable)")
+    parser.add_argument('--output', help="Write results JSON here")
+    parser.add_argument('--baseline', help="Compare against this results JSON")
+    parser.add_argument('--save-baseline', action='store_true', help="Write results to --baseline instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="Allowed regression fraction (default 0.15)")
+    parser.add_argument('--seed', type=int, default=1, help="Seeds the request mix of every load worker")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Serve with the prefork server and this many workers (0 = single-process dev server)")
+    parser.add_argument('--compare-fast-path', action='store_true',
+                        help="Benchmark /scan through Flask and through the WSGI fast path (SCAN_FAST_PATH) and compare")
+    args = parser.parse_args()
+
+    if args.compare_fast_path and 'scan' not in parse_mix(args.mix):
+        parser.error("--compare-fast-path needs scan in --mix")
+    if args.backend == 'postgres' and not args.database_url:
+        parser.error("--backend postgres needs --database-url (or BENCH_DATABASE_URL)")
+
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    if args.backend == 'postgres':
+        env_overrides['DATABASE_URL'] = args.database_url
+
+    if args.compare_fast_path:
+        compare_fast_path(args, env_overrides)
+        return
+
+    results = run_benchmark(args, env_overrides)
+    results['config'] = {
+        'backend': args.backend,
+        'campaigns': args.campaigns,
+        'seed_scans': args.seed_scans,
+        'mix': args.mix,
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'duration': args.duration,
+        'rate': args.rate,
+        'env': {k: v for k, v in env_overrides.items() if k != 'DATABASE_URL'},
+        'python': sys.version.split()[0],
+        'timestamp': datetime.now().isoformat()
+    }
+
+    print(f"\n{'operation':<10}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, stats in results['operations'].items():
+        print(f"{op:<10}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"Total: {results['total_rps']} req/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+            with open(args.baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"💾 Baseline saved to {args.baseline}")
+        else:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print("\n❌ Regressions versus baseline:")
+                for regression in regressions:
+                    print(f"   {regression}")
+                sys.exit(1)
+            print("\n✅ No regressions versus baseline")
+
+
+if __name__ == "__main__":
+    main()
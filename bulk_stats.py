@@ -0,0 +1,86 @@
+"""
+Multi-campaign stats for dashboards
+
+GET /campaigns/stats returns a whole page of campaigns' totals from one
+storage call (Storage.list_campaign_stats: a single query over the totals
+tables for the databases, one pass over the in-memory counters for JSON)
+instead of one /campaign/<id>/stats request per campaign. Pick campaigns
+with ?ids=camp_0001,camp_0002 (at most MAX_BULK_IDS) and/or filter with
+?status= and ?business=; pages are ordered by campaign_id and continue
+from ?cursor=.
+
+Dashboards poll, so each distinct query's page is kept for
+BULK_STATS_CACHE_TTL seconds (default 5, 0 disables) in a small
+per-worker cache.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from scan_export import parse_page_size
+
+MAX_BULK_IDS = 1000
+
+
+def parse_bulk_stats_query(args):
+    """Keyword arguments for Storage.list_campaign_stats from the query string; raises ValueError"""
+    campaign_ids = None
+    values = args.getlist('ids')
+    if values:
+        campaign_ids = sorted({cid.strip() for value in values for cid in value.split(',') if cid.strip()})
+        if len(campaign_ids) > MAX_BULK_IDS:
+            raise ValueError(f"at most {MAX_BULK_IDS} ids per request")
+    return {
+        'campaign_ids': campaign_ids,
+        'status': args.get('status') or None,
+        'business_name': args.get('business') or None,
+        'limit': parse_page_size(args),
+        'cursor': args.get('cursor') or None
+    }
+
+
+class ResultCache:
+    """Short-lived LRU cache of query results"""
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = float(ttl if ttl is not None else os.getenv('BULK_STATS_CACHE_TTL', '5'))
+        self.max_entries = int(max_entries or os.getenv('BULK_STATS_CACHE_SIZE', '256'))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached value, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Size and hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
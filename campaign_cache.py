@@ -0,0 +1,150 @@
+"""
+In-process campaign lookup cache for the /scan redirect hot path
+
+Campaign records almost never change once created, so each worker keeps the
+ones it has seen in memory. Entries expire after a TTL, the least recently
+used entry is evicted once the cache is full, and unknown IDs are cached too
+(for a shorter time) so junk URLs don't hit storage on every request.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel stored for campaign IDs the loader could not find
+_MISSING = object()
+
+
+class CampaignCache:
+    def __init__(self, loader, ttl=None, negative_ttl=None, max_entries=None,
+                 watch_path=None, mtime_check_interval=None):
+        """
+        loader(campaign_id) returns the campaign dict or None.
+        watch_path, if given, is a file whose mtime change clears the cache;
+        it is stat()ed at most once per mtime_check_interval seconds.
+        """
+        self.loader = loader
+        # 0 is a real setting here (no caching), not "use the default"
+        self.ttl = float(ttl if ttl is not None else os.getenv('CAMPAIGN_CACHE_TTL', '300'))
+        self.negative_ttl = float(negative_ttl if negative_ttl is not None
+                                  else os.getenv('CAMPAIGN_CACHE_NEGATIVE_TTL', '30'))
+        self.max_entries = int(max_entries or os.getenv('CAMPAIGN_CACHE_SIZE', '10000'))
+        self.watch_path = watch_path
+        self.mtime_check_interval = float(mtime_check_interval if mtime_check_interval is not None
+                                          else os.getenv('CAMPAIGN_CACHE_MTIME_CHECK', '1.0'))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a load that raced with one is dropped
+        self._generation = 0
+        self._watch_mtime = self._current_mtime()
+        self._next_mtime_check = time.monotonic() + self.mtime_check_interval
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _current_mtime(self):
+        if not self.watch_path:
+            return None
+        try:
+            return os.stat(self.watch_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check_watch_path(self, now):
+        """Clear everything if the watched file changed since the last check"""
+        if not self.watch_path or now < self._next_mtime_check:
+            return
+        self._next_mtime_check = now + self.mtime_check_interval
+        mtime = self._current_mtime()
+        if mtime != self._watch_mtime:
+            self._watch_mtime = mtime
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def get(self, campaign_id):
+        """Return the campaign dict for campaign_id, or None if it doesn't exist"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_watch_path(now)
+            entry = self._entries.get(campaign_id)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(campaign_id)
+                    if value is _MISSING:
+                        self.negative_hits += 1
+                        return None
+                    self.hits += 1
+                    return value
+                del self._entries[campaign_id]
+            self.misses += 1
+            generation = self._generation
+
+        # Load outside the lock so a slow backend doesn't block cache hits
+        value = self.loader(campaign_id)
+        self.put(campaign_id, value, generation)
+        return value
+
+    def peek(self, campaign_id):
+        """Return the cached campaign dict, or None if it isn't cached (never loads)"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_watch_path(now)
+            entry = self._entries.get(campaign_id)
+            if entry is None or entry[0] is _MISSING or entry[1] <= now:
+                return None
+            self._entries.move_to_end(campaign_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, campaign_id, campaign, generation=None):
+        """Store a campaign (or None for an unknown ID) in the cache"""
+        if campaign is None:
+            value, ttl = _MISSING, self.negative_ttl
+        else:
+            value, ttl = campaign, self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[campaign_id] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(campaign_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def preload(self, campaigns):
+        """Cache campaign dicts up front (at warm-up) so the first lookups are hits"""
+        for campaign in campaigns[:self.max_entries]:
+            self.put(campaign['campaign_id'], campaign)
+
+    def invalidate(self, campaign_id=None):
+        """Drop one campaign (or everything) so the next lookup reloads it"""
+        with self._lock:
+            if campaign_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(campaign_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0
+            }
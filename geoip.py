@@ -0,0 +1,240 @@
+"""
+Offline IP geolocation from a locally supplied range database
+
+A CSV of IP ranges is compiled once (python manage.py compile-geoip) into a
+compact sorted binary file that is memory-mapped and binary-searched, so
+lookups need no network access and almost no resident memory. Source rows
+are either
+
+    network,country,city            (CIDR, e.g. 81.2.69.0/24)
+    start_ip,end_ip,country,city    (inclusive range)
+
+with an optional header line. IPv4 addresses are stored as IPv4-mapped IPv6
+so one table covers both families.
+
+File layout (little-endian header, big-endian addresses so byte order is
+numeric order):
+
+    header      8s magic, uint32 record count, uint32 location count
+    records     16s start, 16s end, uint32 location index   (sorted by start)
+    offsets     uint32 per location, into the strings blob
+    strings     per location: uint16 length + country, uint16 length + city
+
+Scans are enriched in batches by a background GeoEnricher, never on the
+redirect path; repeat IPs are answered from an LRU cache.
+"""
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import threading
+from functools import lru_cache
+
+GEOIP_FILE = 'data/geoip.bin'
+
+MAGIC = b'QRGEO1\x00\x00'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('>16s16sI')
+OFFSET = struct.Struct('<I')
+LENGTH = struct.Struct('<H')
+
+
+def _address_bytes(address):
+    """16-byte big-endian key for an IPv4 or IPv6 address"""
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b'\x00' * 10 + b'\xff\xff' + address.packed)
+    return address.packed
+
+
+def _parse_row(row):
+    if len(row) >= 4 and '/' not in row[0]:
+        start = ipaddress.ip_address(row[0].strip())
+        end = ipaddress.ip_address(row[1].strip())
+        country, city = row[2], row[3]
+    else:
+        network = ipaddress.ip_network(row[0].strip(), strict=False)
+        start, end = network.network_address, network.broadcast_address
+        country, city = row[1], row[2] if len(row) > 2 else ''
+    if start.version != end.version or start > end:
+        raise ValueError("range start and end don't form a valid range")
+    return _address_bytes(start), _address_bytes(end), country.strip(), city.strip()
+
+
+def compile_database(source_path, output_path=GEOIP_FILE):
+    """Compile a CSV of IP ranges into the binary range file; returns (ranges, skipped)"""
+    ranges = []
+    skipped = 0
+    with open(source_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                ranges.append(_parse_row(row))
+            except ValueError:
+                # Header lines and malformed rows
+                skipped += 1
+
+    ranges.sort()
+    locations = {}
+    records = []
+    previous_end = None
+    for start, end, country, city in ranges:
+        if previous_end is not None and start <= previous_end:
+            # Overlapping ranges make binary search ambiguous; first one wins
+            skipped += 1
+            continue
+        index = locations.setdefault((country, city), len(locations))
+        records.append(RECORD.pack(start, end, index))
+        previous_end = end
+
+    strings = bytearray()
+    offsets = []
+    for country, city in locations:
+        offsets.append(OFFSET.pack(len(strings)))
+        for value in (country, city):
+            encoded = value.encode('utf-8')[:0xFFFF]
+            strings += LENGTH.pack(len(encoded)) + encoded
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records), len(locations)))
+        f.write(b''.join(records))
+        f.write(b''.join(offsets))
+        f.write(strings)
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic swap: running readers keep their mapping of the old file
+    os.replace(tmp_path, output_path)
+    return len(records), skipped
+
+
+class GeoIPDatabase:
+    def __init__(self, path=GEOIP_FILE, cache_size=None):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.record_count, self.location_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a compiled GeoIP range file")
+        self._records_at = HEADER.size
+        self._offsets_at = self._records_at + self.record_count * RECORD.size
+        self._strings_at = self._offsets_at + self.location_count * OFFSET.size
+
+        cache_size = int(cache_size or os.getenv('GEOIP_CACHE_SIZE', '65536'))
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _start(self, index):
+        at = self._records_at + index * RECORD.size
+        return self._map[at:at + 16]
+
+    def _location(self, index):
+        (offset,) = OFFSET.unpack_from(self._map, self._offsets_at + index * OFFSET.size)
+        at = self._strings_at + offset
+        values = []
+        for _ in range(2):
+            (length,) = LENGTH.unpack_from(self._map, at)
+            at += LENGTH.size
+            values.append(self._map[at:at + length].decode('utf-8'))
+            at += length
+        return tuple(values)
+
+    def _lookup(self, ip_address):
+        """(country, city) for an address string, or None if unknown"""
+        try:
+            key = _address_bytes(ipaddress.ip_address(str(ip_address).split(',')[0].strip()))
+        except ValueError:
+            return None
+
+        # Rightmost range starting at or before the key
+        low, high = 0, self.record_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._start(middle) <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        _, end, location = RECORD.unpack_from(self._map, self._records_at + (low - 1) * RECORD.size)
+        if key > end:
+            return None
+        return self._location(location)
+
+    def stats(self):
+        info = self.lookup.cache_info()
+        return {
+            'ranges': self.record_count,
+            'locations': self.location_count,
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            'cache_size': info.currsize
+        }
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def geoip_available(path=None):
+    """True if GEOIP_DATABASE (default data/geoip.bin) exists, i.e. geo enrichment is on"""
+    return os.path.exists(path or os.getenv('GEOIP_DATABASE', GEOIP_FILE))
+
+
+def load_geoip(path=None):
+    """Open GEOIP_DATABASE (default data/geoip.bin), or None if it isn't there"""
+    path = path or os.getenv('GEOIP_DATABASE', GEOIP_FILE)
+    if not geoip_available(path):
+        return None
+    try:
+        return GeoIPDatabase(path)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  GeoIP database {path} unusable: {e}")
+        return None
+
+
+def geo_fields(geoip, ip_address):
+    """country/city dict for a scan; empty strings mark "looked up, not found" """
+    location = geoip.lookup(ip_address) if ip_address else None
+    country, city = location or ('', '')
+    return {'country': country, 'city': city}
+
+
+class GeoEnricher:
+    """Background loop that fills in country/city for stored scans in batches
+
+    enrich_batch(batch_size) must resolve up to batch_size pending scans and
+    return how many it processed; the loop sleeps only once nothing is left.
+    """
+
+    def __init__(self, enrich_batch, batch_size=None, interval=None):
+        self.enrich_batch = enrich_batch
+        self.batch_size = int(batch_size or os.getenv('GEOIP_BATCH_SIZE', '500'))
+        self.interval = float(interval or os.getenv('GEOIP_ENRICH_INTERVAL', '2.0'))
+        self.enriched = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='geo-enricher', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.enrich_batch(self.batch_size)
+            except Exception as e:
+                print(f"Geo enrichment failed: {e}")
+                processed = 0
+            self.enriched += processed
+            if processed < self.batch_size:
+                self._stop.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the QR tracking server
+"""
+import argparse
+from dotenv import load_dotenv
+
+
+def compact_scans(args):
+    """Index sealed scan log segments and merge small ones (safe while the server runs)"""
+    from scan_log import ScanLog
+
+    scan_log = ScanLog(args.log, legacy_path=args.legacy, durability='fsync', compact_interval=0)
+    merged = scan_log.compact()
+    stats = scan_log.stats()
+    scan_log.close()
+    print(f"✅ Scan log compacted: {merged} segments merged, {stats['segments']} segments live")
+    if stats['retired_segments']:
+        # Running servers may still be reading them
+        print(f"ℹ️  {stats['retired_segments']} merged segments are deleted by a later pass "
+              f"after SCAN_LOG_RETIRED_GRACE seconds")
+
+
+def _connect():
+    from database import Database
+
+    db = Database()
+    if not db.connect():
+        print("❌ Failed to connect to PostgreSQL")
+        return None
+    return db
+
+
+def backfill_rollups(args):
+    """Rebuild the PostgreSQL scan rollup tables from raw scans"""
+    db = _connect()
+    if not db:
+        return
+    db.create_tables()
+    db.backfill_rollups()
+    db.close()
+    print("✅ Rollup backfill completed")
+
+
+def partition_scans(args):
+    """Convert an unpartitioned scans table to monthly partitions"""
+    db = _connect()
+    if not db:
+        return
+    if db.partition_scans():
+        print("✅ scans is now partitioned by month (old rows kept in scans_legacy)")
+    db.close()
+
+
+def maintain_partitions(args):
+    """Create upcoming scan partitions and expire old ones"""
+    db = _connect()
+    if not db:
+        return
+    if not db.scans_partitioned():
+        print("⚠️  scans is not partitioned; run 'python manage.py partition-scans' first")
+        db.close()
+        return
+    db.ensure_partitions(args.months_ahead)
+    expired = db.apply_retention(args.retention_months, args.archive_dir)
+    db.close()
+    print(f"✅ Partition maintenance done ({len(expired)} expired)")
+
+
+def migrate_json(args):
+    """Bulk-load JSON backend data into PostgreSQL (resumable)"""
+    db = _connect()
+    if not db:
+        return
+    db.create_tables()
+    db.migrate_json_data(args.campaigns, args.scans, chunk_size=args.chunk_size, restart=args.restart)
+    db.close()
+    print("✅ Data migration completed")
+
+
+def compile_geoip(args):
+    """Compile a CSV of IP ranges into the memory-mapped GeoIP file"""
+    from geoip import compile_database
+
+    ranges, skipped = compile_database(args.source, args.output)
+    print(f"✅ GeoIP database written to {args.output}: {ranges} ranges ({skipped} rows skipped)")
+
+
+def enrich_geo(args):
+    """Fill in country/city for stored scans that haven't been looked up"""
+    from storage import create_storage
+
+    storage = create_storage(args.backend)
+    if not storage.start():
+        return
+    if not storage.geoip:
+        print("❌ No GeoIP database found; run 'python manage.py compile-geoip' first")
+        storage.close()
+        return
+    total = 0
+    try:
+        while True:
+            processed = storage.enrich_geo(args.batch_size)
+            total += processed
+            if processed < args.batch_size:
+                break
+    except NotImplementedError:
+        print(f"ℹ️  The {storage.name} backend resolves geo data when scans are read")
+    storage.close()
+    print(f"✅ Geo enrichment done ({total} scans updated)")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="QR tracker maintenance commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    compact = commands.add_parser('compact-scans', help="Compact the JSON backend scan log")
+    compact.add_argument('--log', default='data/scan_segments')
+    compact.add_argument('--legacy', default='data/scans.json')
+    compact.set_defaults(func=compact_scans)
+
+    backfill = commands.add_parser('backfill-rollups', help="Rebuild PostgreSQL scan rollups from raw scans")
+    backfill.set_defaults(func=backfill_rollups)
+
+    partition = commands.add_parser('partition-scans', help="Convert the scans table to monthly partitions")
+    partition.set_defaults(func=partition_scans)
+
+    maintain = commands.add_parser('maintain-partitions', help="Create upcoming partitions and apply retention")
+    maintain.add_argument('--months-ahead', type=int, default=None)
+    maintain.add_argument('--retention-months', type=int, default=None,
+                          help="Drop partitions older than this many months (default: SCANS_RETENTION_MONTHS)")
+    maintain.add_argument('--archive-dir', default=None,
+                          help="Export expired partitions here as .csv.gz before dropping")
+    maintain.set_defaults(func=maintain_partitions)
+
+    migrate = commands.add_parser('migrate-json', help="Bulk-load JSON backend data into PostgreSQL")
+    migrate.add_argument('--campaigns', default='data/campaigns.json')
+    migrate.add_argument('--scans', nargs='+', default=['data/scans.json', 'data/scans.log', 'data/scan_segments'],
+                         help="Legacy scans.json, NDJSON scan log files and/or scan segment directories")
+    migrate.add_argument('--chunk-size', type=int, default=None)
+    migrate.add_argument('--restart', action='store_true', help="Ignore saved checkpoints and load from the start")
+    migrate.set_defaults(func=migrate_json)
+
+    geoip = commands.add_parser('compile-geoip', help="Compile an IP range CSV into the GeoIP lookup file")
+    geoip.add_argument('--source', required=True,
+                       help="CSV rows of network,country,city or start_ip,end_ip,country,city")
+    geoip.add_argument('--output', default='data/geoip.bin')
+    geoip.set_defaults(func=compile_geoip)
+
+    enrich = commands.add_parser('enrich-geo', help="Backfill country/city for stored scans")
+    enrich.add_argument('--backend', default=None, help="Storage backend (default: STORAGE_BACKEND)")
+    enrich.add_argument('--batch-size', type=int, default=1000)
+    enrich.set_defaults(func=enrich_geo)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
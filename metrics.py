@@ -0,0 +1,381 @@
+"""
+Lightweight Prometheus metrics and request profiling
+
+A small in-process registry (counters, histograms and callback gauges)
+rendered in the Prometheus text exposition format on /metrics. Recording a
+sample is a dict lookup, a bisect and an increment under a per-metric lock,
+so instrumentation can stay on in production.
+
+The optional profiler samples a fraction of requests (METRICS_PROFILE_RATE,
+0 disables it): a background thread captures the stacks of sampled request
+threads every METRICS_PROFILE_INTERVAL seconds and aggregates them as
+collapsed stacks, served on /metrics/profile for flame graph tools.
+
+Stacks expose code paths and the POST changes the sampling rate, so
+/metrics/profile only exists when METRICS_PROFILE_TOKEN is set and then
+requires "Authorization: Bearer <token>". Without a token the profiler can
+still be switched on with METRICS_PROFILE_RATE, but its output is only
+reachable in-process.
+"""
+import bisect
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (last slot is +Inf), sum, count];
+        # counts are made cumulative only when rendered
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """Context manager / decorator recording elapsed seconds"""
+        return _Timer(self, labels)
+
+    def collect(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        label_names = self.labels + ('le',)
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(label_names, key + (_format_value(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.histogram.observe(time.perf_counter() - start, **self.labels)
+        return wrapper
+
+
+class CallbackGauge:
+    """Gauge whose value is read from a callback at scrape time
+
+    The callback returns either a number or a dict of label value (or tuple
+    of label values) -> number.
+    """
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception:
+            # A broken collector must not take down the whole scrape
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is None:
+                continue
+            if not isinstance(key, tuple):
+                key = (key,)
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering returns the existing metric so modules can be
+            # imported by both apps (or reloaded) without duplicates
+            existing = self._metrics.get(metric.name)
+            if existing is not None and type(existing) is type(metric) and not isinstance(metric, CallbackGauge):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback, labels=()):
+        return self._register(CallbackGauge(name, documentation, callback, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'qr_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+DB_SECONDS = REGISTRY.histogram(
+    'qr_db_operation_duration_seconds', 'Database method latency', ('operation',))
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    'qr_db_pool_wait_seconds', 'Time spent checking out a pooled connection')
+DB_ERRORS = REGISTRY.counter(
+    'qr_db_operation_errors_total', 'Database method calls that raised', ('operation',))
+FILE_SECONDS = REGISTRY.histogram(
+    'qr_json_file_duration_seconds', 'JSON backend file load/save latency', ('operation',))
+QR_RENDER_SECONDS = REGISTRY.histogram(
+    'qr_render_duration_seconds', 'QR image render time (cache misses only)', ('format',))
+ANALYTICS_SECONDS = REGISTRY.histogram(
+    'qr_analytics_duration_seconds', 'Columnar analytics refresh and query time', ('operation',))
+
+
+def timed_db(operation):
+    """Decorator recording a Database method's latency and errors"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                DB_SECONDS.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+
+def register_stats_gauges(prefix, documentation, stats):
+    """Expose every numeric field of a stats() dict as one labelled gauge"""
+    def collect():
+        return {field: value for field, value in stats().items() if isinstance(value, (int, float))}
+    REGISTRY.gauge(f"qr_{prefix}", documentation, collect, ('field',))
+
+
+class SamplingProfiler:
+    """Statistical stack sampler for a random fraction of requests"""
+
+    def __init__(self, rate=None, interval=None, max_stacks=5000):
+        self.rate = float(rate if rate is not None else os.getenv('METRICS_PROFILE_RATE', '0'))
+        self.interval = float(interval or os.getenv('METRICS_PROFILE_INTERVAL', '0.005'))
+        self.max_stacks = max_stacks
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.profiled_requests = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def set_rate(self, rate):
+        if not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        self.rate = rate
+
+    def begin(self, label):
+        """Start sampling the current thread for this request if chosen"""
+        if not self.rate or random.random() >= self.rate:
+            return False
+        with self._lock:
+            self._active[threading.get_ident()] = label
+            self.profiled_requests += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='metrics-profiler', daemon=True)
+                self._thread.start()
+        return True
+
+    def end(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+                if not active and not self.rate:
+                    self._thread = None
+                    return
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, label in active.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(label)
+                key = ';'.join(reversed(stack))
+                with self._lock:
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+                    self.samples += 1
+
+    def collapsed(self):
+        """Aggregated stacks in collapsed ("folded") format"""
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.profiled_requests = 0
+
+
+profiler = SamplingProfiler()
+
+REGISTRY.gauge('qr_profiler_samples', 'Stack samples collected by the request profiler', lambda: profiler.samples)
+
+
+def instrument_app(app):
+    """Time every request by route template and add /metrics endpoints"""
+    from flask import Response, g, jsonify, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_profiled = profiler.begin(f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}")
+
+    @app.teardown_request
+    def _stop_timer(exc):
+        start = g.pop('metrics_start', None)
+        if g.pop('metrics_profiled', False):
+            profiler.end()
+        if start is None:
+            return
+        # The route template (not the raw path) keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = g.pop('metrics_status', 500 if exc else 200)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route, status=status)
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    profile_token = os.getenv('METRICS_PROFILE_TOKEN', '')
+    if not profile_token:
+        return app
+
+    @app.route('/metrics/profile', methods=['GET', 'POST'])
+    def metrics_profile():
+        """GET: collapsed stacks from sampled requests; POST {"rate": 0.01} to toggle"""
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {profile_token}".encode()):
+            return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                profiler.set_rate(float(data.get('rate', 0)))
+            except (TypeError, ValueError) as e:
+                return jsonify({'error': str(e)}), 400
+            if data.get('reset'):
+                profiler.reset()
+            return jsonify({
+                'rate': profiler.rate,
+                'samples': profiler.samples,
+                'profiled_requests': profiler.profiled_requests
+            })
+        return Response(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+
+    return app
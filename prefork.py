@@ -0,0 +1,382 @@
+"""
+Prefork production server
+
+`python run.py --serve` starts a supervisor that forks WEB_WORKERS worker
+processes (default: one per CPU). Each worker imports the app after the
+fork and runs app.warm_up() before it listens, so every process has its
+own storage connections, scan writer and preloaded caches, and serves
+requests with werkzeug's threaded WSGI server on its own listening socket
+bound with SO_REUSEPORT. The kernel spreads connections
+across the workers, so throughput scales with cores instead of being capped
+by one GIL. Where SO_REUSEPORT is unavailable the supervisor binds a single
+socket before forking and the workers share it.
+
+Signals to the supervisor:
+
+    HUP         graceful reload: start a new generation of workers (which
+                re-import the code), then retire the old generation once
+                every new worker is accepting connections
+    TERM, INT   graceful shutdown
+    TTIN, TTOU  one worker more / fewer
+
+Workers are recycled after WORKER_MAX_REQUESTS requests (plus a random
+0..WORKER_MAX_REQUESTS_JITTER, so they don't all restart together): the
+worker asks to be replaced, the supervisor starts its successor, and only
+once that one is accepting is the old worker told to stop. A stopping worker
+stops listening, serves the connections already queued on its socket and
+any in-flight requests, flushes its storage and exits; workers still busy
+after WORKER_GRACEFUL_TIMEOUT seconds are killed. (Connections that reach a
+socket in the instant between its last accept and close are reset unless
+the kernel migrates them: sysctl net.ipv4.tcp_migrate_req=1, Linux 5.14+.)
+
+With the JSON backend every worker appends to the same scan log: each
+worker buffers its scans and writes them with one O_APPEND write under an
+exclusive flock (scan_log.py), and reads other workers' appends from the
+files when answering stats.
+"""
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+LISTEN_BACKLOG = 2048
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+# Worker -> supervisor messages on the status pipe
+READY = b'R'
+RECYCLE = b'C'
+
+
+def listen_socket(host, port, reuse_port=REUSE_PORT, listen=True):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    if listen:
+        sock.listen(LISTEN_BACKLOG)
+    return sock
+
+
+class Worker:
+    """One serving process; run() returns once it has drained and shut down"""
+
+    def __init__(self, host, port, shared_socket, status_fd, max_requests, graceful_timeout):
+        self.host = host
+        self.port = port
+        self.shared_socket = shared_socket
+        self.status_fd = status_fd
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.parent_pid = os.getppid()
+        self.requests = 0
+        self.active = 0
+        self.stopping = False
+        self.server = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        # Ctrl+C reaches the whole process group; the supervisor coordinates shutdown
+        for signum in (signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        from app import app, shutdown, warm_up
+
+        # Storage is open and caches are full before this worker listens
+        warm_up()
+        sock = self.shared_socket or listen_socket(self.host, self.port)
+        self.server = make_server(self.host, self.port, self.wsgi(app), threaded=True, fd=sock.fileno())
+        self._notify(READY)
+        threading.Thread(target=self._watch_parent, name='parent-watch', daemon=True).start()
+
+        # werkzeug closes its own copy of the socket when the loop ends
+        self.server.serve_forever(poll_interval=0.5)
+        if not self.shared_socket:
+            self._accept_backlog(sock)
+        sock.close()
+        self._drain()
+        shutdown()
+
+    def wsgi(self, app):
+        """Wrap the app to count requests and close connections while stopping"""
+        def application(environ, start_response):
+            with self._lock:
+                self.requests += 1
+                self.active += 1
+                if self.max_requests and self.requests == self.max_requests:
+                    self._notify(RECYCLE)
+
+            def start(status, headers, exc_info=None):
+                if self.stopping:
+                    headers = [h for h in headers if h[0].lower() != 'connection'] + [('Connection', 'close')]
+                return start_response(status, headers, exc_info)
+
+            try:
+                return ClosingIterator(app(environ, start), self._request_done)
+            except BaseException:
+                self._request_done()
+                raise
+        return application
+
+    def _request_done(self):
+        with self._lock:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def _notify(self, message):
+        try:
+            os.write(self.status_fd, message)
+        except OSError:
+            # Supervisor gone; _watch_parent shuts us down
+            pass
+
+    def stop(self):
+        """Stop accepting; serve_forever returns and run() drains (safe from any thread)"""
+        if self.stopping:
+            return
+        self.stopping = True
+        if self.server is not None:
+            # shutdown() blocks until the serve loop exits, so never call it on that loop
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def _accept_backlog(self, sock):
+        """Serve connections already queued on our own socket; closing it would reset them"""
+        sock.setblocking(False)
+        while True:
+            try:
+                request, address = sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            request.setblocking(True)
+            self.server.process_request(request, address)
+
+    def _drain(self):
+        deadline = time.monotonic() + self.graceful_timeout
+        with self._lock:
+            while self.active and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+
+    def _watch_parent(self):
+        while not self.stopping:
+            if os.getppid() != self.parent_pid:
+                print(f"Worker {os.getpid()}: supervisor exited, shutting down")
+                self.stop()
+            time.sleep(1)
+
+
+class WorkerProcess:
+    def __init__(self, pid, generation, status_fd):
+        self.pid = pid
+        self.generation = generation
+        self.status_fd = status_fd
+        self.ready = False
+        self.recycle = False
+        self.kill_at = None
+
+    @property
+    def serving(self):
+        """Counts towards the worker total (not asked to recycle, not stopping)"""
+        return not self.recycle and self.kill_at is None
+
+
+class Supervisor:
+    def __init__(self, host='0.0.0.0', port=5000, workers=None, max_requests=None,
+                 max_requests_jitter=None, graceful_timeout=None):
+        self.host = host
+        self.port = port
+        self.worker_count = int(workers or os.getenv('WEB_WORKERS', '0')) or os.cpu_count() or 1
+        self.max_requests = int(max_requests if max_requests is not None else os.getenv('WORKER_MAX_REQUESTS', '0'))
+        self.max_requests_jitter = int(max_requests_jitter if max_requests_jitter is not None
+                                       else os.getenv('WORKER_MAX_REQUESTS_JITTER', '0'))
+        self.graceful_timeout = float(graceful_timeout if graceful_timeout is not None
+                                      else os.getenv('WORKER_GRACEFUL_TIMEOUT', '30'))
+
+        self.generation = 0
+        self.workers = {}
+        self.socket = None
+        self._signals = []
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_write, False)
+        self._respawn_after = 0.0
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+        try:
+            os.write(self._wakeup_write, b'.')
+        except OSError:
+            # Pipe full (a wakeup is already pending)
+            pass
+
+    def run(self):
+        # With SO_REUSEPORT this socket only reserves the port (bound, never
+        # listening, so it gets no connections); otherwise workers accept on it
+        self.socket = listen_socket(self.host, self.port, listen=not REUSE_PORT)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        mode = 'SO_REUSEPORT' if REUSE_PORT else 'a shared socket'
+        print(f"🚀 Supervisor {os.getpid()}: {self.worker_count} workers on {self.host}:{self.port} ({mode})")
+        try:
+            while True:
+                self._reap()
+                if self._handle_signals():
+                    break
+                self._spawn_missing()
+                self._retire()
+                self._wait()
+        finally:
+            self._stop_all()
+            self.socket.close()
+        print("👋 Supervisor stopped")
+
+    def _handle_signals(self):
+        """Apply queued signals; returns True when it's time to shut down"""
+        while self._signals:
+            signum = self._signals.pop(0)
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                return True
+            if signum == signal.SIGHUP:
+                self.generation += 1
+                print(f"🔄 Reloading: starting worker generation {self.generation}")
+            elif signum == signal.SIGTTIN:
+                self.worker_count += 1
+            elif signum == signal.SIGTTOU and self.worker_count > 1:
+                self.worker_count -= 1
+        return False
+
+    def _current(self):
+        return [w for w in self.workers.values() if w.generation == self.generation and w.serving]
+
+    def _spawn_missing(self):
+        missing = self.worker_count - len(self._current())
+        if missing > 0 and time.monotonic() >= self._respawn_after:
+            for _ in range(missing):
+                self._spawn()
+
+    def _spawn(self):
+        status_read, status_write = os.pipe()
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(status_read)
+                os.close(self._wakeup_read)
+                os.close(self._wakeup_write)
+                for worker in self.workers.values():
+                    os.close(worker.status_fd)
+                shared = None if REUSE_PORT else self.socket
+                Worker(self.host, self.port, shared, status_write, max_requests, self.graceful_timeout).run()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                # Never unwind into the supervisor's loop or run its exit handlers
+                os._exit(code)
+        os.close(status_write)
+        self.workers[pid] = WorkerProcess(pid, self.generation, status_read)
+
+    def _retire(self):
+        """Stop replaced workers once enough current workers are accepting, and any surplus"""
+        current = self._current()
+        ready = [w for w in current if w.ready]
+        if len(ready) >= self.worker_count:
+            for worker in list(self.workers.values()):
+                if worker.kill_at is None and (worker.recycle or worker.generation != self.generation):
+                    self._terminate(worker)
+        for worker in current[self.worker_count:]:
+            self._terminate(worker)
+
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.kill_at is not None and now >= worker.kill_at:
+                self._signal(worker.pid, signal.SIGKILL)
+
+    def _terminate(self, worker):
+        worker.kill_at = time.monotonic() + self.graceful_timeout
+        self._signal(worker.pid, signal.SIGTERM)
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _wait(self, timeout=1.0):
+        """Sleep until a signal or worker status message arrives, or the timeout"""
+        listening = {w.status_fd: w for w in self.workers.values() if w.kill_at is None}
+        try:
+            readable, _, _ = select.select([self._wakeup_read, *listening], [], [], timeout)
+        except InterruptedError:
+            return
+        for fd in readable:
+            if fd == self._wakeup_read:
+                os.read(fd, 512)
+                continue
+            worker = listening[fd]
+            messages = os.read(fd, 64)
+            if READY in messages:
+                worker.ready = True
+            if RECYCLE in messages:
+                worker.recycle = True
+            if not messages:
+                # Worker closed the pipe (exiting); stop selecting on it
+                worker.kill_at = worker.kill_at or time.monotonic() + self.graceful_timeout
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.status_fd)
+            code = os.waitstatus_to_exitcode(status)
+            if not worker.ready:
+                # Died while booting (e.g. an import error); don't fork-bomb
+                print(f"❌ Worker {pid} failed to start (exit {code})")
+                self._respawn_after = time.monotonic() + 1.0
+            elif worker.recycle:
+                print(f"♻️  Worker {pid} recycled")
+            elif worker.kill_at is None or code not in (0, -signal.SIGTERM):
+                print(f"⚠️  Worker {pid} exited unexpectedly (exit {code})")
+
+    def _stop_all(self):
+        for worker in list(self.workers.values()):
+            if worker.kill_at is None:
+                self._terminate(worker)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for worker in list(self.workers.values()):
+            self._signal(worker.pid, signal.SIGKILL)
+        while self.workers:
+            self._reap()
+            time.sleep(0.05)
+
+
+def serve(host='0.0.0.0', port=5000, workers=None):
+    Supervisor(host, port, workers=workers).run()
@@ -0,0 +1,167 @@
+"""
+Bulk QR generation for print runs
+
+Renders many campaigns' QR codes in parallel across a process pool and
+streams them out as a ZIP archive while they finish. Only a small window
+of renders is in flight at a time, so memory stays flat no matter how many
+campaigns are requested. A manifest.json at the end of the archive lists
+per-item errors and render timings.
+
+Workers are started with forkserver where available: a clean server process
+imports the renderer (qrcode, PIL) once and every worker forks from it, so
+the web server's threads and open connections are never forked, and
+workers start without importing the rendering stack again.
+QR_BATCH_START_METHOD overrides the start method.
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from qr_render import render_qr
+
+MAX_BATCH_SIZE = int(os.getenv('QR_BATCH_MAX', '1000'))
+# Imported once by the forkserver, inherited by every worker
+PRELOAD_MODULES = ['qr_render', 'qrcode', 'PIL.Image']
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Shared process pool, created on first use"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None:
+            _executor_workers = int(os.getenv('QR_BATCH_WORKERS', str(os.cpu_count() or 2)))
+            default_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(os.getenv('QR_BATCH_START_METHOD', default_method))
+            if context.get_start_method() == 'forkserver':
+                context.set_forkserver_preload(PRELOAD_MODULES)
+            _executor = ProcessPoolExecutor(max_workers=_executor_workers, mp_context=context)
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _render_job(campaign_id, tracking_url, fmt, options):
+    """Runs in a worker process"""
+    start = time.perf_counter()
+    rendered = render_qr(tracking_url, fmt, **options)
+    return campaign_id, rendered.body, time.perf_counter() - start
+
+
+class _ZipStream:
+    """Write-only file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_qr_zip(items, fmt='png', options=None, missing=()):
+    """
+    Yield a ZIP archive of QR images chunk by chunk.
+
+    items is a list of (campaign_id, tracking_url); missing lists requested
+    campaign IDs that don't exist and are reported in the manifest.
+    """
+    options = options or {}
+    executor = get_executor()
+    in_flight_limit = _executor_workers * 2
+    compression = zipfile.ZIP_STORED if fmt == 'png' else zipfile.ZIP_DEFLATED
+
+    stream = _ZipStream()
+    archive = zipfile.ZipFile(stream, mode='w', compression=compression)
+    manifest = {
+        'format': fmt,
+        'requested': len(items) + len(missing),
+        'rendered': 0,
+        'errors': [{'campaign_id': campaign_id, 'error': 'Campaign not found'} for campaign_id in missing],
+        'items': []
+    }
+    started = time.perf_counter()
+    render_seconds = 0.0
+
+    pending = {}
+    queue = iter(items)
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < in_flight_limit:
+            try:
+                campaign_id, tracking_url = next(queue)
+            except StopIteration:
+                exhausted = True
+                break
+            future = executor.submit(_render_job, campaign_id, tracking_url, fmt, options)
+            pending[future] = campaign_id
+
+        if not pending:
+            break
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            campaign_id = pending.pop(future)
+            try:
+                _, body, elapsed = future.result()
+            except Exception as e:
+                manifest['errors'].append({'campaign_id': campaign_id, 'error': str(e)})
+                continue
+            archive.writestr(f"{campaign_id}.{fmt}", body)
+            render_seconds += elapsed
+            manifest['rendered'] += 1
+            manifest['items'].append({'campaign_id': campaign_id, 'bytes': len(body), 'render_ms': round(elapsed * 1000, 2)})
+        yield stream.drain()
+
+    manifest['render_seconds'] = round(render_seconds, 4)
+    manifest['total_seconds'] = round(time.perf_counter() - started, 4)
+    archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+    archive.close()
+    yield stream.drain()
+
+
+def check_batch_size(count):
+    """Raise ValueError if a batch has more campaigns than MAX_BATCH_SIZE"""
+    if count > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} campaigns per batch")
+
+
+def parse_batch_request(data):
+    """Validate a batch request body; returns (campaign_ids or None for all active, fmt)"""
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+
+    fmt = data.get('format', 'png')
+    if fmt not in ('png', 'svg'):
+        raise ValueError("format must be png or svg")
+
+    if data.get('all_active'):
+        return None, fmt
+
+    campaign_ids = data.get('campaign_ids')
+    if not isinstance(campaign_ids, list) or not campaign_ids:
+        raise ValueError("Provide a non-empty campaign_ids list or all_active: true")
+    check_batch_size(len(campaign_ids))
+    # Preserve order, drop duplicates
+    return list(dict.fromkeys(str(c) for c in campaign_ids)), fmt
@@ -0,0 +1,179 @@
+"""
+Cached QR code rendering
+
+A campaign's tracking URL never changes, so rendering its QR code more than
+once is wasted work. Rendered images are kept in a byte-bounded LRU cache
+keyed by (tracking URL, box size, format, colors), and each carries a
+content hash that the image endpoints use as their ETag.
+
+qrcode (and PIL, which it loads for PNGs) is imported on the first render
+rather than at startup, so processes that never draw a code don't pay for it.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+from metrics import QR_RENDER_SECONDS
+
+FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+DEFAULT_BOX_SIZE = 10
+MAX_BOX_SIZE = 40
+BORDER = 5
+
+# Named colors or #rgb / #rrggbb; anything else could break out of SVG markup.
+# Names must also be ones PIL knows (see _check_color)
+_COLOR_RE = re.compile(r'^(#[0-9a-fA-F]{3}|#[0-9a-fA-F]{6}|[a-zA-Z]{1,20})$')
+
+RenderedQR = namedtuple('RenderedQR', ['body', 'content_type', 'etag'])
+
+
+class RenderCache:
+    """LRU cache of rendered images, bounded by total bytes rather than entries"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(max_bytes or os.getenv('QR_CACHE_BYTES', str(32 * 1024 * 1024)))
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rendered
+
+    def put(self, key, rendered):
+        size = len(rendered.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = rendered
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+render_cache = RenderCache()
+
+
+def _check_color(color):
+    """Raise ValueError unless color is safe in SVG and drawable by PIL"""
+    if not isinstance(color, str) or not _COLOR_RE.match(color):
+        raise ValueError(f"Invalid color: {color}")
+    from PIL import ImageColor
+
+    try:
+        ImageColor.getrgb(color)
+    except ValueError:
+        raise ValueError(f"Unknown color: {color}")
+
+
+def parse_render_options(args):
+    """Validate box_size/fill/back query args; raises ValueError on bad input"""
+    try:
+        box_size = int(args.get('box_size', DEFAULT_BOX_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError("box_size must be an integer")
+    if not 1 <= box_size <= MAX_BOX_SIZE:
+        raise ValueError(f"box_size must be between 1 and {MAX_BOX_SIZE}")
+
+    fill = args.get('fill', 'black')
+    back = args.get('back', 'white')
+    for color in (fill, back):
+        _check_color(color)
+
+    return {'box_size': box_size, 'fill': fill, 'back': back}
+
+
+def _build_matrix(data):
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=1, border=BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def _render_png(data, box_size, fill, back):
+    qr = _build_matrix(data)
+    qr.box_size = box_size
+    img = qr.make_image(fill_color=fill, back_color=back)
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _render_svg(data, box_size, fill, back):
+    """Single-path SVG straight from the module matrix (no PIL needed)"""
+    matrix = _build_matrix(data).get_matrix()
+    size = len(matrix) * box_size
+    parts = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            # Merge horizontal runs of dark modules into one rectangle
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            parts.append(f"M{start * box_size} {y * box_size}h{(x - start) * box_size}v{box_size}h-{(x - start) * box_size}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="{back}"/>'
+        f'<path fill="{fill}" d="{"".join(parts)}"/></svg>'
+    ).encode()
+
+
+def render_qr(data, fmt='png', box_size=DEFAULT_BOX_SIZE, fill='black', back='white'):
+    """Return a RenderedQR for data, rendering only on a cache miss"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported QR format: {fmt}")
+
+    key = (data, box_size, fmt, fill, back)
+    rendered = render_cache.get(key)
+    if rendered is not None:
+        return rendered
+
+    with QR_RENDER_SECONDS.time(format=fmt):
+        if fmt == 'png':
+            body = _render_png(data, box_size, fill, back)
+        else:
+            body = _render_svg(data, box_size, fill, back)
+
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    rendered = RenderedQR(body, FORMATS[fmt], etag)
+    render_cache.put(key, rendered)
+    return rendered
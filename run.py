@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 """
 Quick start script for the QR tracking server
+
+    python run.py                          development server (FLASK_DEBUG=1 for debug mode)
+    python run.py --serve [--workers N]    prefork production server (see prefork.py)
 """
+import argparse
 import os
 import sys
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the QR tracking server")
+    parser.add_argument('--serve', action='store_true', help="Prefork multi-process production server")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: WEB_WORKERS or CPU count)")
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    args = parser.parse_args()
+    
     print("🚀 Starting QR Tracking Server...")
     print("=" * 40)
     
@@ -14,7 +25,7 @@ def main():
         print("📁 Creating data directory...")
         os.makedirs('data')
     
-    print("🌐 Server will be available at: http://localhost:5000")
+    print(f"🌐 Server will be available at: http://localhost:{args.port}")
     print("📊 Available endpoints:")
     print("   GET  /                        - Home page")
     print("   GET  /scan/<campaign_id>      - Track QR scan")
@@ -26,9 +37,16 @@ def main():
     print("Press Ctrl+C to stop the server")
     print("=" * 40)
     
-    # Import and run the Flask app
-    from app import app
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if args.serve:
+        # Workers import the app themselves, after forking
+        from prefork import serve
+        serve(args.host, args.port, workers=args.workers)
+        return
+    
+    # Import the Flask app, open storage and fill caches, then serve
+    from app import app, warm_up
+    warm_up()
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host=args.host, port=args.port)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
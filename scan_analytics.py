@@ -0,0 +1,325 @@
+"""
+Columnar in-memory scan analytics
+
+ScanColumns keeps every scan as a few fixed-width values in NumPy arrays
+instead of a dict per scan:
+
+    ts        int64   epoch seconds of the stored (naive) timestamp
+    campaign  int32   index into the campaign ID dictionary
+    visitor   uint64  first 64 bits of the sha256 visitor_hash
+    referrer  int32   index into the referrer dictionary
+    is_bot    bool
+
+That is 25 bytes per scan plus one entry per distinct campaign and
+referrer, against well over a kilobyte for a decoded scan dict. Visitors
+are kept as their 64-bit hash prefix rather than a dictionary of hash
+strings, so memory doesn't grow with the number of distinct visitors;
+collisions are negligible at any realistic count. Hourly/daily
+histograms, unique visitors, top referrers and the peak hour of day are
+answered with np.unique / np.bincount over the selected rows.
+
+The full load (at first use and every ANALYTICS_REBUILD_INTERVAL seconds)
+runs on a background thread into a fresh set of columns that is swapped in
+when done; until the first one finishes campaign_timeseries() returns None
+and routes use the backend's own queries. Between rebuilds refresh() only
+pulls scans stored since the previous refresh (see Storage.iter_scans_after:
+a scan log position for JSON, the scan id for the databases), at most once
+per ANALYTICS_REFRESH_INTERVAL seconds, reading storage outside the lock
+queries take. Database rows that commit out of id order (e.g. spilled scans
+replayed late) are picked up by the next rebuild. Each prefork worker holds
+its own copy.
+
+NumPy is optional and only imported by create_analytics(): without it (or
+with ANALYTICS_ENABLED=0) that returns None and routes fall back to the
+backend's own queries.
+"""
+import calendar
+import hashlib
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from hll import visitor_hash
+from metrics import ANALYTICS_SECONDS
+from ua_classifier import classify_code, decode
+
+GRANULARITY_SECONDS = {'hour': 3600, 'day': 86400}
+
+# Set by create_analytics()
+np = None
+
+_INITIAL_CAPACITY = 1024
+# Rows decoded before they are copied into the arrays
+_LOAD_BATCH = 10000
+
+
+def to_epoch(timestamp):
+    """Epoch seconds for a naive datetime or ISO timestamp string"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return calendar.timegm(timestamp.timetuple())
+
+
+def from_epoch(seconds):
+    """Naive ISO timestamp (as stored) for epoch seconds"""
+    return datetime.fromtimestamp(int(seconds), timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def visitor_key(hashed):
+    """64-bit integer for a sha256 hex visitor hash (any other string is hashed first)"""
+    try:
+        return int(hashed[:16], 16)
+    except ValueError:
+        return int(hashlib.sha256(hashed.encode()).hexdigest()[:16], 16)
+
+
+def _scan_is_bot(scan):
+    if scan.get('is_bot') is not None:
+        return bool(scan['is_bot'])
+    ua_class = scan.get('ua_class')
+    if ua_class is None:
+        ua_class = classify_code(scan.get('user_agent', ''))
+    return decode(ua_class).is_bot
+
+
+class _Dictionary:
+    """Value <-> dense integer code mapping for one encoded column"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Columns:
+    """One generation of the column arrays, their dictionaries and load position"""
+
+    COLUMNS = (('ts', 'int64'), ('campaign', 'int32'), ('visitor', 'uint64'), ('referrer', 'int32'), ('is_bot', 'bool'))
+
+    def __init__(self):
+        self.columns = {name: np.empty(_INITIAL_CAPACITY, dtype) for name, dtype in self.COLUMNS}
+        self.size = 0
+        self.campaigns = _Dictionary()
+        self.referrers = _Dictionary()
+        self.position = None
+
+    def _row(self, scan):
+        try:
+            ts = to_epoch(scan['timestamp'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        hashed = scan.get('visitor_hash') or visitor_hash(scan.get('ip_address'), scan.get('user_agent', ''))
+        return (
+            ts,
+            self.campaigns.encode(scan.get('campaign_id')),
+            visitor_key(hashed),
+            self.referrers.encode(scan.get('referrer') or ''),
+            _scan_is_bot(scan)
+        )
+
+    def _append(self, rows):
+        """Append row tuples, growing every column by doubling when full"""
+        if not rows:
+            return
+        needed = self.size + len(rows)
+        capacity = len(self.columns['ts'])
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            columns = {}
+            for name, column in self.columns.items():
+                columns[name] = np.empty(capacity, column.dtype)
+                columns[name][:self.size] = column[:self.size]
+            self.columns = columns
+        # Rows below size are never modified, so queries can use views of them
+        for (name, dtype), values in zip(self.COLUMNS, zip(*rows)):
+            self.columns[name][self.size:needed] = np.array(values, dtype)
+        self.size = needed
+
+    def load(self, storage, lock=None):
+        """Read scans stored after position; lock, if given, is held only while appending"""
+        rows = []
+        for position, scan in storage.iter_scans_after(self.position):
+            row = self._row(scan)
+            if row:
+                rows.append(row)
+            self.position = position
+            if len(rows) >= _LOAD_BATCH:
+                with lock or nullcontext():
+                    self._append(rows)
+                rows = []
+        with lock or nullcontext():
+            self._append(rows)
+
+
+class ScanColumns:
+    def __init__(self, storage, refresh_interval=None, rebuild_interval=None):
+        self.storage = storage
+        self.refresh_interval = float(refresh_interval or os.getenv('ANALYTICS_REFRESH_INTERVAL', '1.0'))
+        self.rebuild_interval = float(rebuild_interval or os.getenv('ANALYTICS_REBUILD_INTERVAL', '3600'))
+        # Guards swapping _data and appending to it; never held while storage is read
+        self._lock = threading.Lock()
+        # One incremental load at a time
+        self._refresh_lock = threading.Lock()
+        self._data = None
+        self._rebuilding = False
+        self._next_refresh = 0.0
+        self._next_rebuild = 0.0
+        self.rebuilds = 0
+
+    def rebuild(self):
+        """Load every scan into fresh columns and swap them in (runs on the caller's thread)"""
+        try:
+            with ANALYTICS_SECONDS.time(operation='rebuild'):
+                data = _Columns()
+                data.load(self.storage)
+            with self._lock:
+                self._data = data
+                self._next_rebuild = time.monotonic() + self.rebuild_interval
+                self.rebuilds += 1
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            # Don't retry a failing rebuild on every request
+            self._next_rebuild = time.monotonic() + self.refresh_interval
+        threading.Thread(target=self.rebuild, name='analytics-rebuild', daemon=True).start()
+
+    @ANALYTICS_SECONDS.time(operation='refresh')
+    def refresh(self, force=False):
+        """Pick up scans stored since the last refresh (at most once per refresh interval)
+
+        Starts a background rebuild instead when none has completed yet or
+        the rebuild interval has passed. force waits for a refresh already
+        running rather than skipping.
+        """
+        now = time.monotonic()
+        if now >= self._next_rebuild:
+            self._start_rebuild()
+        data = self._data
+        if data is None or (not force and now < self._next_refresh):
+            return
+        if not self._refresh_lock.acquire(blocking=force):
+            return
+        try:
+            self._next_refresh = now + self.refresh_interval
+            data.load(self.storage, self._lock)
+        except ValueError:
+            # The position no longer exists (storage was rewritten)
+            with self._lock:
+                self._next_rebuild = now
+            self._start_rebuild()
+        finally:
+            self._refresh_lock.release()
+
+    def _select(self, campaign_id, start, end):
+        """Column views for one campaign's rows in [start, end), or None before the first load"""
+        self.refresh()
+        with self._lock:
+            data = self._data
+            if data is None:
+                return None, None
+            code = data.campaigns.codes.get(campaign_id)
+            columns = {name: column[:data.size] for name, column in data.columns.items()}
+            referrers = data.referrers.values
+        if code is None:
+            return {}, referrers
+
+        mask = columns['campaign'] == code
+        if start:
+            mask &= columns['ts'] >= to_epoch(start)
+        if end:
+            mask &= columns['ts'] < to_epoch(end)
+        return {name: column[mask] for name, column in columns.items()}, referrers
+
+    @ANALYTICS_SECONDS.time(operation='timeseries')
+    def campaign_timeseries(self, campaign_id, start=None, end=None, granularity='hour',
+                            exclude_bots=False, top=10):
+        """Histogram, top referrers and peak hour of day for one campaign
+
+        series has the same entries as Storage.get_campaign_timeseries (but
+        exact unique visitors); exclude_bots leaves bot scans out of
+        top_referrers and peak_hour. Returns None until the first load has
+        finished.
+        """
+        if granularity not in GRANULARITY_SECONDS:
+            raise ValueError("granularity must be 'hour' or 'day'")
+        rows, referrers = self._select(campaign_id, start, end)
+        if rows is None:
+            return None
+        if not rows or not len(rows['ts']):
+            return {'series': [], 'top_referrers': [], 'peak_hour': None}
+
+        width = GRANULARITY_SECONDS[granularity]
+        buckets, inverse = np.unique(rows['ts'] // width, return_inverse=True)
+        scans = np.bincount(inverse, minlength=len(buckets))
+        bots = np.bincount(inverse[rows['is_bot']], minlength=len(buckets))
+        # Distinct (bucket, visitor) pairs among people, counted per bucket
+        humans = ~rows['is_bot']
+        human_buckets, human_visitors = inverse[humans], rows['visitor'][humans]
+        order = np.lexsort((human_visitors, human_buckets))
+        human_buckets, human_visitors = human_buckets[order], human_visitors[order]
+        first = np.ones(len(order), bool)
+        first[1:] = (human_buckets[1:] != human_buckets[:-1]) | (human_visitors[1:] != human_visitors[:-1])
+        uniques = np.bincount(human_buckets[first], minlength=len(buckets))
+        series = [
+            {'bucket': from_epoch(bucket * width), 'scans': int(count), 'bot_scans': int(bot_count),
+             'unique_visitors': int(unique)}
+            for bucket, count, bot_count, unique in zip(buckets, scans, bots, uniques)
+        ]
+
+        counted = humans if exclude_bots else slice(None)
+        hour_counts = np.bincount(rows['ts'][counted] // 3600 % 24, minlength=24)
+        peak_hour = None
+        if hour_counts.any():
+            peak = int(hour_counts.argmax())
+            peak_hour = {'hour': peak, 'scans': int(hour_counts[peak])}
+
+        referrer_codes, referrer_counts = np.unique(rows['referrer'][counted], return_counts=True)
+        order = np.argsort(-referrer_counts, kind='stable')
+        top_referrers = []
+        for index in order:
+            referrer = referrers[referrer_codes[index]]
+            if referrer:
+                top_referrers.append({'referrer': referrer, 'scans': int(referrer_counts[index])})
+                if len(top_referrers) == top:
+                    break
+
+        return {'series': series, 'top_referrers': top_referrers, 'peak_hour': peak_hour}
+
+    def stats(self):
+        """Row and dictionary sizes for monitoring"""
+        with self._lock:
+            data = self._data or _Columns()
+            return {
+                'rows': data.size,
+                'campaigns': len(data.campaigns.values),
+                'referrers': len(data.referrers.values),
+                'column_bytes': sum(column.nbytes for column in data.columns.values()),
+                'rebuilds': self.rebuilds
+            }
+
+
+def create_analytics(storage):
+    """ScanColumns over storage, or None if NumPy is missing or ANALYTICS_ENABLED=0"""
+    global np
+    if os.getenv('ANALYTICS_ENABLED', '1') == '0':
+        return None
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return ScanColumns(storage)
@@ -0,0 +1,181 @@
+"""
+Incremental per-campaign counters for the JSON backend
+
+Keeps a running scan total, last scan time and a HyperLogLog sketch of
+visitor_hash for every campaign, updated as each scan is appended to the
+scan log. Bot scans (see ua_classifier.py) are counted separately and kept
+out of the sketch. Stats are then answered in constant time instead of re-reading
+every scan ever recorded.
+
+The counters are snapshotted to data/scan_counters.json together with the
+log position they cover. On startup the snapshot is loaded and only the log
+tail written after it is replayed; if that position was compacted away the
+counters are rebuilt from the whole log. unique_visitors is an estimate with
+about 2.3% standard error (see hll.py).
+"""
+import base64
+import json
+import os
+import threading
+import time
+
+from hll import HyperLogLog, visitor_hash
+from scan_log import iter_log_records, read_manifest, segment_path, split_position
+from ua_classifier import classify_code, decode
+
+COUNTERS_FILE = 'data/scan_counters.json'
+
+
+class ScanCounters:
+    def __init__(self, scan_log, path=COUNTERS_FILE, snapshot_interval=None):
+        self.scan_log = scan_log
+        self.path = path
+        self.snapshot_interval = float(snapshot_interval or os.getenv('SCAN_COUNTERS_SNAPSHOT_INTERVAL', '30'))
+
+        self._lock = threading.Lock()
+        self._campaigns = {}
+        self._offset = None
+        self._dirty = False
+        self._closed = threading.Event()
+
+        self._load_snapshot()
+        self.catch_up()
+        scan_log.add_listener(self._on_append)
+
+        self._snapshotter = threading.Thread(target=self._snapshot_loop, name='scan-counters', daemon=True)
+        self._snapshotter.start()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path, 'r') as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        # Positions in segments that were merged away (or from the old
+        # single-file log format) can't be trusted; start over
+        if 'log_position' not in snapshot:
+            return
+        segment_id, offset = split_position(snapshot['log_position'])
+        if segment_id is not None:
+            manifest = read_manifest(self.scan_log.path)
+            if segment_id not in manifest['segments'] or offset > os.path.getsize(segment_path(self.scan_log.path, segment_id)):
+                return
+
+        self._offset = snapshot['log_position']
+        for campaign_id, entry in snapshot.get('campaigns', {}).items():
+            self._campaigns[campaign_id] = [
+                entry['total_scans'],
+                HyperLogLog.from_bytes(base64.b64decode(entry['sketch'])),
+                entry.get('last_scan'),
+                entry.get('bot_scans', 0)
+            ]
+
+    def _apply(self, scan):
+        campaign_id = scan['campaign_id']
+        entry = self._campaigns.get(campaign_id)
+        if entry is None:
+            entry = self._campaigns[campaign_id] = [0, HyperLogLog(), None, 0]
+        entry[0] += 1
+        ua_class = scan.get('ua_class')
+        if ua_class is None:
+            ua_class = classify_code(scan.get('user_agent', ''))
+        if decode(ua_class).is_bot:
+            entry[3] += 1
+        else:
+            entry[1].add(scan.get('visitor_hash') or visitor_hash(scan.get('ip_address'), scan.get('user_agent', '')))
+        timestamp = scan.get('timestamp')
+        if timestamp and (entry[2] is None or timestamp > entry[2]):
+            entry[2] = timestamp
+        self._dirty = True
+
+    def catch_up(self):
+        """Fold in any log lines past the current offset
+
+        Lines appended by other processes sharing the log (prefork workers)
+        only ever arrive this way.
+        """
+        self.scan_log.write_pending()
+        with self._lock:
+            try:
+                self._replay()
+            except ValueError:
+                # Our position's segment was merged by compaction; recount
+                self._campaigns = {}
+                self._offset = None
+                self._replay()
+
+    def _replay(self):
+        for _, end, scan in iter_log_records(self.scan_log.path, self._offset):
+            self._apply(scan)
+            self._offset = end
+
+    def _on_append(self, scan, start, end):
+        """ScanLog listener: called under the log's lock, in log order"""
+        with self._lock:
+            if start != self._offset:
+                # Appends we haven't seen (e.g. written before we attached);
+                # leave the offset alone so catch_up() can fill the gap
+                return
+            self._apply(scan)
+            self._offset = end
+
+    def get(self, campaign_id):
+        """Constant-time totals for one campaign (after folding in any new log tail)"""
+        return self.get_many([campaign_id])[campaign_id]
+
+    def get_many(self, campaign_ids):
+        """{campaign_id: totals} for several campaigns after a single catch-up"""
+        self.catch_up()
+        totals = {}
+        with self._lock:
+            for campaign_id in campaign_ids:
+                entry = self._campaigns.get(campaign_id)
+                if entry is None:
+                    totals[campaign_id] = {'total_scans': 0, 'bot_scans': 0, 'unique_visitors': 0, 'last_scan': None}
+                else:
+                    totals[campaign_id] = {
+                        'total_scans': entry[0],
+                        'bot_scans': entry[3],
+                        'unique_visitors': entry[1].estimate(),
+                        'last_scan': entry[2]
+                    }
+        return totals
+
+    def snapshot(self):
+        """Atomically persist counters and the log position they cover"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'log_position': self._offset,
+                'saved_at': time.time(),
+                'campaigns': {
+                    campaign_id: {
+                        'total_scans': entry[0],
+                        'sketch': base64.b64encode(entry[1].to_bytes()).decode(),
+                        'last_scan': entry[2],
+                        'bot_scans': entry[3]
+                    }
+                    for campaign_id, entry in self._campaigns.items()
+                }
+            }
+            self._dirty = False
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _snapshot_loop(self):
+        while not self._closed.wait(self.snapshot_interval):
+            # Only persist positions the log has actually made durable
+            self.scan_log.flush()
+            self.snapshot()
+
+    def close(self):
+        self._closed.set()
+        self.scan_log.flush()
+        self.snapshot()
@@ -0,0 +1,119 @@
+"""
+Duplicate-scan suppression for the /scan redirect
+
+One phone scan often arrives as several hits within a few seconds: link
+prefetches, retries and messaging-app previews. With SCAN_DEDUP_WINDOW set
+to a number of seconds (0, the default, disables it) a repeat of the same
+(campaign_id, visitor_hash) within the window is still redirected but not
+written as a scan. It is only counted in memory, and the per-campaign
+counts are added to storage every SCAN_DEDUP_FLUSH_INTERVAL seconds, so
+stats can report a suppression rate.
+
+Seen keys live in two rotating generations of a dict (key -> first seen),
+so old entries expire by dropping a whole generation rather than one at a
+time. SCAN_DEDUP_MAX_ENTRIES bounds memory: reaching it rotates early,
+which only shortens the effective window. Each prefork worker keeps its
+own window, so repeats that land on different workers are both written.
+"""
+import os
+import threading
+import time
+
+
+class DedupWindow:
+    def __init__(self, flush=None, window=None, max_entries=None, flush_interval=None):
+        """flush(counts) receives {campaign_id: suppressed scans} to add to storage"""
+        self.flush_counts = flush
+        self.window = float(window if window is not None else os.getenv('SCAN_DEDUP_WINDOW', '0'))
+        self.max_entries = int(max_entries or os.getenv('SCAN_DEDUP_MAX_ENTRIES', '200000'))
+        self.flush_interval = float(flush_interval or os.getenv('SCAN_DEDUP_FLUSH_INTERVAL', '5'))
+
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._rotate_at = time.monotonic() + self.window
+        # Suppressed scans per campaign not yet handed to flush()
+        self._pending = {}
+        self._closed = threading.Event()
+
+        self.checked = 0
+        self.suppressed = 0
+        self.rotations = 0
+
+        self._flusher = None
+        if self.enabled and flush:
+            self._flusher = threading.Thread(target=self._flush_loop, name='scan-dedup', daemon=True)
+            self._flusher.start()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _rotate(self, now):
+        self._previous = self._current
+        self._current = {}
+        self._rotate_at = now + self.window
+        self.rotations += 1
+
+    def is_duplicate(self, campaign_id, visitor):
+        """True (and counted as suppressed) if this visitor scanned this campaign within the window"""
+        if not self.enabled:
+            return False
+        key = hash((campaign_id, visitor))
+        now = time.monotonic()
+        with self._lock:
+            self.checked += 1
+            # Both generations are kept until the older one can only hold
+            # keys first seen more than a window ago
+            if now >= self._rotate_at or len(self._current) >= self.max_entries // 2:
+                self._rotate(now)
+            first_seen = self._current.get(key) or self._previous.get(key)
+            if first_seen is not None and now - first_seen < self.window:
+                self.suppressed += 1
+                self._pending[campaign_id] = self._pending.get(campaign_id, 0) + 1
+                return True
+            self._current[key] = now
+            return False
+
+    def flush(self):
+        """Hand pending suppressed counts to storage"""
+        with self._lock:
+            counts, self._pending = self._pending, {}
+        if not counts or not self.flush_counts:
+            return
+        try:
+            self.flush_counts(counts)
+        except Exception as e:
+            # Keep the counts for the next attempt
+            print(f"Failed to record suppressed scans: {e}")
+            with self._lock:
+                for campaign_id, count in counts.items():
+                    self._pending[campaign_id] = self._pending.get(campaign_id, 0) + count
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+    def stats(self):
+        """Window size and suppression counters for monitoring"""
+        with self._lock:
+            return {
+                'window_seconds': self.window,
+                'entries': len(self._current) + len(self._previous),
+                'max_entries': self.max_entries,
+                'checked': self.checked,
+                'suppressed': self.suppressed,
+                'suppression_rate': self.suppressed / self.checked if self.checked else 0.0,
+                'rotations': self.rotations
+            }
+
+
+def suppression_rate(stats):
+    """Share of a campaign's scan hits that were suppressed as duplicates"""
+    suppressed = stats.get('suppressed_scans') or 0
+    hits = (stats.get('total_scans') or 0) + suppressed
+    return suppressed / hits if hits else 0.0
@@ -0,0 +1,99 @@
+"""
+Helpers for paginated scan listings and streaming NDJSON/CSV exports
+
+Exports are written from a generator in small chunks, so a campaign with
+millions of scans streams out with flat memory use. The stored ua_class
+code is expanded into device/os/browser/is_bot on the way out.
+"""
+import csv
+import io
+import json
+import os
+
+from ua_classifier import classify_code, ua_fields
+
+EXPORT_FIELDS = [
+    'campaign_id', 'timestamp', 'ip_address', 'user_agent', 'referrer', 'visitor_hash', 'country', 'city',
+    'device', 'os', 'browser', 'is_bot'
+]
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page_size(args):
+    """Read ?limit= (default 100, capped at 1000); raises ValueError on bad input"""
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_exclude_bots(args):
+    """Read ?exclude_bots= (default STATS_EXCLUDE_BOTS, off unless set)"""
+    value = args.get('exclude_bots', os.getenv('STATS_EXCLUDE_BOTS', '0'))
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def with_ua_fields(scan):
+    """Replace a scan's ua_class code with readable device/os/browser/is_bot
+
+    Scans stored before classification existed are classified from their
+    user_agent (memoized, so this stays cheap).
+    """
+    code = scan.pop('ua_class', None)
+    if code is None:
+        code = classify_code(scan.get('user_agent') or '')
+    scan.pop('is_bot', None)
+    scan.update(ua_fields(code))
+    return scan
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _json_default(value):
+    """Datetimes as ISO strings, anything else non-JSON (e.g. INET values) as text"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_export(scans, fmt, chunk_size=64 * 1024):
+    """Yield an NDJSON or CSV document in chunks of roughly chunk_size characters
+
+    NDJSON keeps JSON types (null, true/false); CSV writes everything as
+    text, with empty cells for missing values.
+    """
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+
+    for scan in scans:
+        scan = with_ua_fields(dict(scan))
+        if fmt == 'csv':
+            writer.writerow([_csv_value(scan.get(field)) for field in EXPORT_FIELDS])
+        else:
+            row = {field: scan.get(field) for field in EXPORT_FIELDS}
+            buffer.write(json.dumps(row, default=_json_default) + '\n')
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
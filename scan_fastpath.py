@@ -0,0 +1,107 @@
+"""
+WSGI fast path for /scan redirects
+
+With SCAN_FAST_PATH=1 app.warm_up() wraps the WSGI app in ScanFastPath, which
+answers GET /scan/<campaign_id> before Flask sees the request: no routing,
+request context, before/after hooks or Response object. The campaign is
+looked up in the same CampaignCache the Flask route uses, without loading
+on a miss, and its 302 (status, headers and body) is built once per target
+URL and reused. The scan is handed to the same record function the route
+uses (which queues it on the PostgreSQL backend's writer) and the prebuilt
+response is returned.
+
+Anything the cache can't answer falls through to the wrapped app: unknown
+or expired campaigns, and everything after the cache was invalidated (a
+campaign created or edited in this worker, or campaigns.json changed on
+disk). The regular route loads the campaign into the cache, so the next
+scan of it takes the fast path again, and it also serves the 404s. Storage
+is never read on the fast path itself. Requests are still timed in
+qr_http_request_duration_seconds under the /scan/<campaign_id> route.
+"""
+import threading
+import time
+
+from werkzeug.utils import redirect
+
+from metrics import REQUEST_SECONDS
+
+SCAN_PREFIX = '/scan/'
+
+
+def build_redirect(target_url):
+    """(status, headers, body) of the 302 the Flask route would send"""
+    response = redirect(target_url)
+    return response.status, response.headers.to_wsgi_list(), response.get_data()
+
+
+class ScanFastPath:
+    def __init__(self, app, record, campaign_cache):
+        """
+        record(campaign_id, ip_address, user_agent, referrer) stores one scan;
+        campaign_cache is the CampaignCache the Flask route fills.
+        """
+        self.app = app
+        self.record = record
+        self.campaign_cache = campaign_cache
+
+        self._lock = threading.Lock()
+        # campaign_id -> (target_url, prebuilt response)
+        self._responses = {}
+
+        self.hits = 0
+        self.fallthroughs = 0
+        self.builds = 0
+
+    def build(self, campaigns):
+        """Precompile the responses for campaigns (e.g. ones already loaded at warm-up)"""
+        for campaign in campaigns[:self.campaign_cache.max_entries]:
+            self._response_for(campaign)
+
+    def _response_for(self, campaign):
+        campaign_id, target_url = campaign['campaign_id'], campaign['target_url']
+        entry = self._responses.get(campaign_id)
+        if entry is not None and entry[0] == target_url:
+            return entry[1]
+        response = build_redirect(target_url)
+        with self._lock:
+            # Bounded like the cache itself; anything dropped is rebuilt on its next hit
+            if campaign_id not in self._responses and len(self._responses) >= self.campaign_cache.max_entries:
+                self._responses.clear()
+            self._responses[campaign_id] = (target_url, response)
+            self.builds += 1
+        return response
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if environ.get('REQUEST_METHOD') != 'GET' or not path.startswith(SCAN_PREFIX):
+            return self.app(environ, start_response)
+        campaign_id = path[len(SCAN_PREFIX):]
+        started = time.perf_counter()
+        campaign = self.campaign_cache.peek(campaign_id) if campaign_id and '/' not in campaign_id else None
+        if campaign is None:
+            with self._lock:
+                self.fallthroughs += 1
+            return self.app(environ, start_response)
+        status, headers, body = self._response_for(campaign)
+
+        self.record(
+            campaign_id,
+            environ.get('HTTP_X_FORWARDED_FOR', environ.get('REMOTE_ADDR')),
+            environ.get('HTTP_USER_AGENT', ''),
+            environ.get('HTTP_REFERER', '')
+        )
+        start_response(status, list(headers))
+        with self._lock:
+            self.hits += 1
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method='GET', route='/scan/<campaign_id>', status=302)
+        return [body]
+
+    def stats(self):
+        """Prebuilt response count and hit/fallthrough counters for monitoring"""
+        with self._lock:
+            return {
+                'campaigns': len(self._responses),
+                'hits': self.hits,
+                'fallthroughs': self.fallthroughs,
+                'builds': self.builds
+            }
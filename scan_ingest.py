@@ -0,0 +1,130 @@
+"""
+Batch scan ingestion for edge collectors
+
+Redirects served by edge/CDN workers are buffered there and forwarded to
+POST /scans/batch as NDJSON, one event per line:
+
+    {"event_id": "edge-7f3a-000123", "campaign_id": "camp_0001",
+     "timestamp": "2026-10-17T09:30:00Z", "ip_address": "203.0.113.9",
+     "user_agent": "...", "referrer": "..."}
+
+The body is read as a stream and handed to Storage.log_scans in chunks of
+INGEST_BATCH_SIZE events, so a large upload never sits in memory at once.
+Events keep their original timestamps; ones with a UTC offset are
+converted to server local time and stored naive, like live scans.
+
+event_id is required and makes retries safe: every backend remembers the
+IDs it has stored and skips repeats, so a collector that timed out can
+resend the whole batch. IDs are only remembered for a bounded window
+(INGEST_EVENT_WINDOW_DAYS, default 7), so events timestamped before it
+(or more than an hour in the future) are rejected: a resend that old could
+no longer be recognised. A malformed line, an unknown campaign or a
+timestamp outside the window only rejects that event.
+"""
+import json
+import os
+from datetime import datetime
+
+from storage import EVENT_CLOCK_SKEW, clean_ip, event_window
+
+# Longest event_id accepted (the database column width)
+MAX_EVENT_ID_LENGTH = 128
+# Rejected lines described in the response; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+def parse_timestamp(value):
+    """Naive local datetime for an ISO-8601 string; raises ValueError"""
+    if not isinstance(value, str):
+        raise ValueError("timestamp must be an ISO-8601 string")
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"invalid timestamp {value!r}")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def parse_event(line, oldest=None, newest=None):
+    """Scan dict for one NDJSON line; raises ValueError saying what is wrong
+
+    oldest/newest, if given, bound the event's (naive local) timestamp.
+    """
+    try:
+        event = json.loads(line)
+    except ValueError:
+        raise ValueError("invalid JSON")
+    if not isinstance(event, dict):
+        raise ValueError("event must be a JSON object")
+
+    event_id = event.get('event_id')
+    if not isinstance(event_id, str) or not event_id:
+        raise ValueError("missing event_id")
+    if len(event_id) > MAX_EVENT_ID_LENGTH:
+        raise ValueError(f"event_id longer than {MAX_EVENT_ID_LENGTH} characters")
+    campaign_id = event.get('campaign_id')
+    if not isinstance(campaign_id, str) or not campaign_id:
+        raise ValueError("missing campaign_id")
+
+    timestamp = parse_timestamp(event.get('timestamp'))
+    if oldest is not None and timestamp < oldest:
+        raise ValueError("timestamp is older than the ingest window")
+    if newest is not None and timestamp > newest:
+        raise ValueError("timestamp is in the future")
+
+    return {
+        'event_id': event_id,
+        'campaign_id': campaign_id,
+        'timestamp': timestamp.isoformat(),
+        'ip_address': clean_ip(event.get('ip_address')),
+        'user_agent': str(event.get('user_agent') or ''),
+        'referrer': str(event.get('referrer') or '')
+    }
+
+
+def ingest_ndjson(lines, log_scans, campaign_exists, batch_size=None):
+    """Validate NDJSON lines and store the events in chunks through log_scans
+
+    log_scans(scans) returns how many were inserted (the rest were already
+    stored); campaign_exists(campaign_id) rejects events for unknown
+    campaigns. Events timestamped outside the ingest window are rejected
+    too. Returns accepted/duplicates/rejected counts and the first few
+    rejection reasons. If storing fails the exception carries the
+    counts so far as its .result.
+    """
+    batch_size = int(batch_size or os.getenv('INGEST_BATCH_SIZE', '1000'))
+    result = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+    batch = []
+    now = datetime.now()
+    oldest, newest = now - event_window(), now + EVENT_CLOCK_SKEW
+
+    def store():
+        try:
+            inserted = log_scans(batch)
+        except Exception as e:
+            e.result = result
+            raise
+        result['accepted'] += inserted
+        result['duplicates'] += len(batch) - inserted
+        batch.clear()
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            scan = parse_event(line, oldest, newest)
+            if not campaign_exists(scan['campaign_id']):
+                raise ValueError(f"unknown campaign {scan['campaign_id']!r}")
+        except ValueError as e:
+            result['rejected'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'line': number, 'error': str(e)})
+            continue
+        batch.append(scan)
+        if len(batch) >= batch_size:
+            store()
+
+    if batch:
+        store()
+    return result
@@ -0,0 +1,721 @@
+"""
+Segmented, campaign-indexed scan log for the JSON backend
+
+Each scan is one JSON object per line, appended to numbered segment files
+in data/scan_segments/. New scans go to the active (last) segment; once it
+reaches SCAN_LOG_SEGMENT_BYTES or is SCAN_LOG_SEGMENT_SECONDS old the next
+append starts a new one. MANIFEST.json lists the live segments in log order.
+
+Every sealed segment gets a sidecar index (NNNNNNNN.idx) with, per campaign,
+the scan count, first/last timestamp and the byte runs holding its lines.
+Reading one campaign only touches the runs of the segments that contain it,
+and segments whose last scan is before since= are skipped entirely.
+
+Positions (counter offsets, pagination cursors) are the segment id shifted
+left 40 bits plus a byte offset in that segment.
+
+A background compactor (every SCAN_LOG_COMPACT_INTERVAL seconds, one
+process at a time) indexes newly sealed segments and merges runs of small
+adjacent sealed segments into one new segment without torn or corrupt
+lines, swapping the manifest atomically. Positions inside merged segments
+then no longer exist; readers get ValueError and start over. The merged
+segments' files stay on disk, listed as retired in the manifest, until a
+compaction pass at least SCAN_LOG_RETIRED_GRACE seconds (default 60) later
+deletes them, whichever process runs it, so readers that picked up the old
+manifest can finish.
+
+Crash recovery on open: a missing manifest is rebuilt from the segment
+files, files not in the manifest (an interrupted rotation or compaction)
+are deleted, a torn last line in the active segment is dropped, and missing
+or stale indexes are rebuilt from their segments by the compactor (readers
+scan unindexed segments in full meanwhile).
+
+Appends are buffered and written with a single O_APPEND write per flush,
+always under an exclusive flock on the segment directory. Every writer
+checks the manifest under that lock, so any number of processes (prefork
+workers, manage.py) can share the log and none ever writes to a segment
+that was sealed or compacted away.
+
+A legacy single-file data/scans.log becomes the first segment, and a
+legacy data/scans.json is imported, the first time the log is opened.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SCAN_LOG_DIR = 'data/scan_segments'
+LEGACY_SCAN_LOG_FILE = 'data/scans.log'
+LEGACY_SCANS_FILE = 'data/scans.json'
+
+MANIFEST_FILE = 'MANIFEST.json'
+LOCK_FILE = 'LOCK'
+COMPACT_LOCK_FILE = 'COMPACT.lock'
+
+# Durability modes
+#   fsync    - flush and fsync before every append returns (safest, slowest)
+#   group    - appends wait for a shared fsync that covers every writer that
+#              arrived within the same commit window
+#   periodic - appends return after the write; a background thread fsyncs
+#              every SCAN_LOG_FLUSH_INTERVAL seconds (fastest, may lose the
+#              last interval on power loss)
+DURABILITY_MODES = ('fsync', 'group', 'periodic')
+
+# periodic mode writes early once this many bytes are buffered
+WRITE_BUFFER_BYTES = 64 * 1024
+
+POSITION_BITS = 40
+# A campaign's lines less than this far apart share one indexed run
+INDEX_GAP_BYTES = 64 * 1024
+
+
+def make_position(segment_id, offset):
+    return segment_id << POSITION_BITS | offset
+
+
+def split_position(position):
+    """(segment_id, offset) for a position; position 0 or None means the start of the log"""
+    if not position:
+        return None, 0
+    return position >> POSITION_BITS, position & ((1 << POSITION_BITS) - 1)
+
+
+def segment_path(directory, segment_id):
+    return os.path.join(directory, f"{segment_id:08d}.log")
+
+
+def index_path(directory, segment_id):
+    return os.path.join(directory, f"{segment_id:08d}.idx")
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def iter_scan_records(path, offset=0, end=None):
+    """Yield (start, end, scan) for every complete scan in [offset, end) of one file"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        position = offset
+        for line in f:
+            if end is not None and position >= end:
+                break
+            start = position
+            position += len(line)
+            # A crash can leave a torn last line; skip anything unparsable
+            if not line.endswith(b'\n'):
+                break
+            try:
+                scan = json.loads(line)
+            except ValueError:
+                continue
+            yield start, position, scan
+
+
+def iter_scan_file(path):
+    """Yield every complete scan in a newline-delimited scan file"""
+    for _, _, scan in iter_scan_records(path):
+        yield scan
+
+
+def iter_legacy_scans(path, chunk_size=1 << 20):
+    """Stream scans out of a legacy {"scans": [...]} file without loading it whole
+
+    Yields (index, scan) for each element of the "scans" array, parsing the
+    file chunk by chunk so memory use is bounded by the largest single scan.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer = ''
+        position = 0
+        in_array = False
+        index = 0
+
+        while True:
+            if not in_array:
+                # Find the opening bracket of the "scans" array
+                key = buffer.find('"scans"', position)
+                bracket = buffer.find('[', key) if key != -1 else -1
+                if bracket != -1:
+                    position = bracket + 1
+                    in_array = True
+                    continue
+            else:
+                # Skip separators, then decode one element if it is complete
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position < len(buffer):
+                    if buffer[position] == ']':
+                        return
+                    try:
+                        scan, end = decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError:
+                        pass  # Element continues in the next chunk
+                    else:
+                        yield index, scan
+                        index += 1
+                        position = end
+                        continue
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer = buffer[position:] + chunk if in_array else buffer[max(0, position - 16):] + chunk
+            position = 0 if in_array else min(position, 16)
+
+
+def read_manifest(directory):
+    """The segment directory's manifest dict, or None if it has none"""
+    return _load_json(os.path.join(directory, MANIFEST_FILE))
+
+
+def build_index(directory, segment_id):
+    """Per-campaign counts, time range and byte runs for one segment file"""
+    path = segment_path(directory, segment_id)
+    campaigns = {}
+    for start, end, scan in iter_scan_records(path):
+        entry = campaigns.get(scan.get('campaign_id'))
+        if entry is None:
+            entry = campaigns[scan.get('campaign_id')] = {'count': 0, 'first': None, 'last': None, 'runs': []}
+        entry['count'] += 1
+        timestamp = scan.get('timestamp')
+        if isinstance(timestamp, str):
+            if entry['first'] is None or timestamp < entry['first']:
+                entry['first'] = timestamp
+            if entry['last'] is None or timestamp > entry['last']:
+                entry['last'] = timestamp
+        runs = entry['runs']
+        if runs and start - runs[-1][1] <= INDEX_GAP_BYTES:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return {'segment': segment_id, 'size': os.path.getsize(path), 'campaigns': campaigns}
+
+
+def iter_log_records(directory, position=None, manifest=None):
+    """Yield (start, end, scan) positions and scans for the whole log from position on
+
+    Raises ValueError if position is inside a segment that no longer exists.
+    """
+    manifest = manifest or read_manifest(directory)
+    segments = manifest['segments'] if manifest else []
+    first, offset = split_position(position)
+    if first is not None:
+        if first not in segments:
+            raise ValueError("Scan log position refers to a compacted segment")
+        segments = segments[segments.index(first):]
+    for segment_id in segments:
+        path = segment_path(directory, segment_id)
+        if not os.path.exists(path):
+            raise ValueError("Scan log was compacted while being read")
+        for start, end, scan in iter_scan_records(path, offset):
+            yield make_position(segment_id, start), make_position(segment_id, end), scan
+        offset = 0
+
+
+class ScanLog:
+    def __init__(self, path=SCAN_LOG_DIR, legacy_path=LEGACY_SCANS_FILE, legacy_log_path=LEGACY_SCAN_LOG_FILE,
+                 durability=None, flush_interval=None, group_window=None,
+                 segment_bytes=None, segment_seconds=None, compact_interval=None, retired_grace=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.legacy_log_path = legacy_log_path
+        self.durability = durability or os.getenv('SCAN_LOG_DURABILITY', 'group')
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown scan log durability mode: {self.durability}")
+        self.flush_interval = float(flush_interval or os.getenv('SCAN_LOG_FLUSH_INTERVAL', '1.0'))
+        self.group_window = float(group_window or os.getenv('SCAN_LOG_GROUP_WINDOW', '0.005'))
+        self.segment_bytes = int(segment_bytes or os.getenv('SCAN_LOG_SEGMENT_BYTES', str(32 << 20)))
+        self.segment_seconds = float(segment_seconds or os.getenv('SCAN_LOG_SEGMENT_SECONDS', '3600'))
+        compact_interval = os.getenv('SCAN_LOG_COMPACT_INTERVAL', '60') if compact_interval is None else compact_interval
+        self.compact_interval = float(compact_interval)
+        retired_grace = os.getenv('SCAN_LOG_RETIRED_GRACE', '60') if retired_grace is None else retired_grace
+        self.retired_grace = float(retired_grace)
+
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._closed = False
+        # Called as listener(scan, start, end) once each scan is written, in log order
+        self._listeners = []
+        # (scan, encoded line) pairs appended but not yet written
+        self._pending = []
+        self._pending_bytes = 0
+
+        # Parsed manifest, reloaded whenever the file is replaced
+        self._manifest_lock = threading.Lock()
+        self._manifest = None
+        self._manifest_stat = None
+        # Sealed segments' indexes (immutable, so cached by id)
+        self._indexes = {}
+        self._fd = None
+        self._segment = None
+        self.rotations = 0
+        self.merged_segments = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._dir_locked():
+            self._recover()
+            self.migrate_legacy()
+            self._open_active(self._current_manifest())
+
+        self._flusher = None
+        if self.durability in ('group', 'periodic'):
+            self._flusher = threading.Thread(target=self._flush_loop, name='scan-log-flusher', daemon=True)
+            self._flusher.start()
+        self._compacted = threading.Event()
+        self._compactor = None
+        if self.compact_interval > 0:
+            self._compactor = threading.Thread(target=self._compact_loop, name='scan-log-compactor', daemon=True)
+            self._compactor.start()
+
+    @contextmanager
+    def _dir_locked(self, lock_fd=None):
+        """Exclusive flock on the segment directory (excludes other processes' writers)"""
+        lock_fd = self._lock_fd if lock_fd is None else lock_fd
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST_FILE)
+
+    def _current_manifest(self):
+        """The manifest, re-read only when another writer or the compactor replaced it"""
+        try:
+            st = os.stat(self._manifest_path())
+        except FileNotFoundError:
+            return self._manifest
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._manifest_lock:
+            if key != self._manifest_stat:
+                manifest = read_manifest(self.path)
+                if manifest is not None:
+                    self._manifest, self._manifest_stat = manifest, key
+                    live = set(manifest['segments'])
+                    self._indexes = {sid: index for sid, index in self._indexes.items() if sid in live}
+            return self._manifest
+
+    def _write_manifest(self, manifest):
+        _write_json_atomic(self._manifest_path(), manifest)
+
+    def _recover(self):
+        """Bring the directory to a consistent state after a crash (dir lock held)"""
+        manifest = read_manifest(self.path)
+        on_disk = sorted(
+            int(name[:-4]) for name in os.listdir(self.path)
+            if name.endswith('.log') and name[:-4].isdigit()
+        )
+        if manifest is None:
+            if not on_disk and os.path.exists(self.legacy_log_path):
+                # The old single-file log becomes the first segment as is
+                os.replace(self.legacy_log_path, segment_path(self.path, 1))
+                on_disk = [1]
+            if not on_disk:
+                open(segment_path(self.path, 1), 'ab').close()
+                on_disk = [1]
+            manifest = {'segments': on_disk, 'next_id': on_disk[-1] + 1, 'active_since': time.time()}
+            self._write_manifest(manifest)
+        elif not os.path.exists(segment_path(self.path, manifest['segments'][-1])):
+            open(segment_path(self.path, manifest['segments'][-1]), 'ab').close()
+
+        # Leftovers of an interrupted rotation or compaction, unless a
+        # compactor in another process is still writing its output
+        with self._compaction_lock(blocking=False) as acquired:
+            if acquired:
+                self._delete_unlisted(manifest)
+        self._repair_tail(segment_path(self.path, manifest['segments'][-1]))
+
+    def _delete_unlisted(self, manifest):
+        live = set(manifest['segments']) | {segment_id for segment_id, _ in manifest.get('retired', [])}
+        for name in os.listdir(self.path):
+            stem, ext = os.path.splitext(name)
+            if ext in ('.log', '.idx') and stem.isdigit() and int(stem) not in live:
+                os.remove(os.path.join(self.path, name))
+
+    @contextmanager
+    def _compaction_lock(self, blocking=True):
+        """Only one compactor runs at a time across processes; yields whether it was acquired"""
+        fd = os.open(os.path.join(self.path, COMPACT_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def migrate_legacy(self):
+        """Import scans from the legacy scans.json file into the active segment, once"""
+        if not os.path.exists(self.legacy_path):
+            return 0
+
+        manifest = read_manifest(self.path)
+        imported = 0
+        with open(segment_path(self.path, manifest['segments'][-1]), 'ab') as log:
+            for _, scan in iter_legacy_scans(self.legacy_path):
+                log.write(self._encode(scan))
+                imported += 1
+            log.flush()
+            os.fsync(log.fileno())
+
+        # Keep the original file around instead of deleting user data
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        return imported
+
+    @staticmethod
+    def _repair_tail(path):
+        """Drop a torn final line left by a crash so new appends start clean"""
+        try:
+            f = open(path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # Walk back to the last complete line
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                idx = chunk.rfind(b'\n')
+                if idx != -1:
+                    f.truncate(pos + idx + 1)
+                    return
+            f.truncate(0)
+
+    def _open_active(self, manifest):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._segment = manifest['segments'][-1]
+        self._fd = os.open(segment_path(self.path, self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _rotate_locked(self, manifest):
+        """Seal the active segment and start the next one (dir lock held)"""
+        segment_id = manifest['next_id']
+        # File first: a crash before the manifest update leaves an orphan, never a gap
+        open(segment_path(self.path, segment_id), 'ab').close()
+        manifest = dict(manifest, segments=manifest['segments'] + [segment_id],
+                        next_id=segment_id + 1, active_since=time.time())
+        self._write_manifest(manifest)
+        self._open_active(manifest)
+        self.rotations += 1
+        return manifest
+
+    @staticmethod
+    def _encode(scan):
+        return (json.dumps(scan, separators=(',', ':'), default=str) + '\n').encode()
+
+    def append(self, scan):
+        """Append one scan to the log, honouring the durability mode"""
+        self.append_many([scan])
+
+    def append_many(self, scans):
+        """Append several scans under one lock and a single durability wait"""
+        lines = [self._encode(scan) for scan in scans]
+        if not lines:
+            return
+        with self._lock:
+            if self._closed:
+                raise ValueError("Scan log is closed")
+            self._pending.extend(zip(scans, lines))
+            self._pending_bytes += sum(len(line) for line in lines)
+            self._written_seq += 1
+            seq = self._written_seq
+
+            if self.durability == 'fsync':
+                self._sync_locked()
+            elif self.durability == 'group':
+                while self._synced_seq < seq and not self._closed:
+                    self._synced.wait()
+            elif self._pending_bytes >= WRITE_BUFFER_BYTES:
+                self._write_pending_locked()
+
+    def add_listener(self, listener):
+        """Register listener(scan, start, end), called for every written scan in log order"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    @property
+    def size(self):
+        """Bytes in all live segments, including appends not yet written"""
+        manifest = self._current_manifest()
+        total = 0
+        for segment_id in manifest['segments']:
+            try:
+                total += os.path.getsize(segment_path(self.path, segment_id))
+            except FileNotFoundError:
+                pass
+        return total + self._pending_bytes
+
+    def _write_pending_locked(self):
+        """Write every buffered line with one append and report their positions"""
+        if not self._pending:
+            return
+        data = b''.join(line for _, line in self._pending)
+        with self._dir_locked():
+            manifest = self._current_manifest()
+            if manifest['segments'][-1] != self._segment:
+                # Another process started a new segment
+                self._open_active(manifest)
+            start = os.fstat(self._fd).st_size
+            if start and (start + len(data) > self.segment_bytes
+                          or time.time() - manifest['active_since'] >= self.segment_seconds):
+                manifest = self._rotate_locked(manifest)
+                start = 0
+            self._write_all(data)
+        segment_id = self._segment
+
+        for scan, line in self._pending:
+            for listener in self._listeners:
+                listener(scan, make_position(segment_id, start), make_position(segment_id, start + len(line)))
+            start += len(line)
+        self._pending = []
+        self._pending_bytes = 0
+
+    def _write_all(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+    def _sync_locked(self):
+        self._write_pending_locked()
+        os.fsync(self._fd)
+        self._synced_seq = self._written_seq
+        self._synced.notify_all()
+
+    def _flush_loop(self):
+        interval = self.group_window if self.durability == 'group' else self.flush_interval
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if self._closed:
+                    return
+                if self._synced_seq < self._written_seq:
+                    self._sync_locked()
+
+    def write_pending(self):
+        """Write buffered appends so readers of the files see them (no fsync)"""
+        with self._lock:
+            if not self._closed:
+                self._write_pending_locked()
+
+    def flush(self):
+        """Force everything written so far to disk"""
+        with self._lock:
+            if not self._closed and self._synced_seq < self._written_seq:
+                self._sync_locked()
+
+    def _index(self, segment_id):
+        """Cached index of a sealed segment, or None if missing or stale"""
+        index = self._indexes.get(segment_id)
+        if index is None:
+            index = _load_json(index_path(self.path, segment_id))
+            try:
+                size = os.path.getsize(segment_path(self.path, segment_id))
+            except FileNotFoundError:
+                return None
+            if index is None or index.get('size') != size:
+                return None
+            self._indexes[segment_id] = index
+        return index
+
+    def iter_records(self, position=None):
+        """Yield (start, end, scan) for every complete scan after position, oldest first"""
+        self.write_pending()
+        return iter_log_records(self.path, position, self._current_manifest())
+
+    def iter_scans(self):
+        """Yield every complete scan in the log, oldest first"""
+        for _, _, scan in self.iter_records():
+            yield scan
+
+    def iter_campaign_records(self, campaign_id, position=None, since=None):
+        """Yield (start, end, scan) for one campaign's scans after position
+
+        Sealed segments are read through their index: only the runs holding
+        the campaign's lines, and none at all if its last scan there is
+        before since. The active segment is read in full.
+        """
+        self.write_pending()
+        manifest = self._current_manifest()
+        segments = manifest['segments']
+        first, offset = split_position(position)
+        if first is not None:
+            if first not in segments:
+                raise ValueError("Cursor refers to a compacted part of the scan log; start over")
+            segments = segments[segments.index(first):]
+
+        for segment_id in segments:
+            path = segment_path(self.path, segment_id)
+            index = self._index(segment_id) if segment_id != manifest['segments'][-1] else None
+            if index is None:
+                if not os.path.exists(path):
+                    raise ValueError("Scan log was compacted while being read; start over")
+                runs = [(offset, None)]
+            else:
+                entry = index['campaigns'].get(campaign_id)
+                if entry is None or (since and entry['last'] and entry['last'] < since):
+                    offset = 0
+                    continue
+                runs = [(max(start, offset), end) for start, end in entry['runs'] if end > offset]
+            for run_start, run_end in runs:
+                for start, end, scan in iter_scan_records(path, run_start, run_end):
+                    if scan.get('campaign_id') == campaign_id:
+                        yield make_position(segment_id, start), make_position(segment_id, end), scan
+            offset = 0
+
+    def compact(self):
+        """Index sealed segments and merge runs of small ones; returns how many segments were merged
+
+        Safe while other threads and processes append: only sealed segments
+        are read or replaced, and the manifest is swapped under the
+        directory lock. Returns 0 if another process is already compacting.
+        """
+        with self._compaction_lock(blocking=False) as acquired:
+            if not acquired:
+                return 0
+            manifest = read_manifest(self.path)
+            sealed = manifest['segments'][:-1]
+
+            for segment_id in sealed:
+                if self._index(segment_id) is None:
+                    _write_json_atomic(index_path(self.path, segment_id), build_index(self.path, segment_id))
+
+            self._delete_retired()
+
+            merged = 0
+            for group in self._small_runs(sealed):
+                self._merge(group)
+                merged += len(group)
+        self.merged_segments += merged
+        return merged
+
+    def _delete_retired(self):
+        """Delete merged-away segments once readers of older manifests have had the grace period"""
+        cutoff = time.time() - self.retired_grace
+        lock_fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self._dir_locked(lock_fd):
+                manifest = read_manifest(self.path)
+                retired = manifest.get('retired', [])
+                expired = [segment_id for segment_id, retired_at in retired if retired_at <= cutoff]
+                if not expired:
+                    return
+                # Manifest first: a crash before the files go leaves unlisted
+                # files, which recovery deletes
+                self._write_manifest(dict(manifest, retired=[entry for entry in retired if entry[0] not in expired]))
+        finally:
+            os.close(lock_fd)
+        for segment_id in expired:
+            for path in (segment_path(self.path, segment_id), index_path(self.path, segment_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _small_runs(self, sealed):
+        """Runs of adjacent small sealed segments that fit in one segment together"""
+        groups = []
+        group, group_bytes = [], 0
+        for segment_id in sealed:
+            size = os.path.getsize(segment_path(self.path, segment_id))
+            if size < self.segment_bytes // 4 and group_bytes + size <= self.segment_bytes:
+                group.append(segment_id)
+                group_bytes += size
+                continue
+            if len(group) > 1:
+                groups.append(group)
+            group, group_bytes = ([segment_id], size) if size < self.segment_bytes // 4 else ([], 0)
+        if len(group) > 1:
+            groups.append(group)
+        return groups
+
+    def _merge(self, group):
+        lock_fd = os.open(os.path.join(self.path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Reserve an id so a concurrent rotation can't take it
+            with self._dir_locked(lock_fd):
+                manifest = read_manifest(self.path)
+                segment_id = manifest['next_id']
+                self._write_manifest(dict(manifest, next_id=segment_id + 1))
+
+            with open(segment_path(self.path, segment_id), 'wb') as dst:
+                for source_id in group:
+                    for scan in iter_scan_file(segment_path(self.path, source_id)):
+                        dst.write(self._encode(scan))
+                dst.flush()
+                os.fsync(dst.fileno())
+            _write_json_atomic(index_path(self.path, segment_id), build_index(self.path, segment_id))
+
+            with self._dir_locked(lock_fd):
+                manifest = read_manifest(self.path)
+                segments = manifest['segments']
+                at = segments.index(group[0])
+                segments = segments[:at] + [segment_id] + segments[at + len(group):]
+                retired = manifest.get('retired', []) + [[source_id, time.time()] for source_id in group]
+                self._write_manifest(dict(manifest, segments=segments, retired=retired))
+        finally:
+            os.close(lock_fd)
+
+    def _compact_loop(self):
+        while not self._compacted.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Scan log compaction failed: {e}")
+
+    def stats(self):
+        """Segment counters for monitoring"""
+        manifest = self._current_manifest()
+        return {
+            'segments': len(manifest['segments']),
+            'active_segment': manifest['segments'][-1],
+            'retired_segments': len(manifest.get('retired', [])),
+            'rotations': self.rotations,
+            'merged_segments': self.merged_segments
+        }
+
+    def close(self):
+        """Flush pending writes and stop the background threads"""
+        self._compacted.set()
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._closed = True
+            os.close(self._fd)
+            os.close(self._lock_fd)
+            self._synced.notify_all()
@@ -0,0 +1,250 @@
+"""
+Background batched scan writer for the PostgreSQL backend
+
+Requests put scans on a bounded in-memory queue and return immediately.
+A single writer thread drains the queue and inserts scans in multi-row
+batches, flushing when a batch fills up or the flush interval passes.
+If the queue is full the request either waits briefly (backpressure) or
+the scan is spilled to an NDJSON file that is replayed once the database
+keeps up again. close() drains everything before the process exits, and
+spills whatever the writer thread can't get to in time.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+
+SPILL_FILE = 'data/scan_spill.ndjson'
+
+# Put on the queue by close() to wake the writer for a final drain
+_STOP = object()
+
+
+class ScanWriter:
+    def __init__(self, db, max_queue=None, batch_size=None, flush_interval=None,
+                 full_policy=None, block_timeout=None, spill_path=SPILL_FILE, enrich=None):
+        self.db = db
+        # Optional enrich(scan) -> dict of extra columns (e.g. geo data),
+        # applied on the writer thread so it never delays a request
+        self.enrich = enrich
+        self.max_queue = int(max_queue or os.getenv('SCAN_QUEUE_SIZE', '10000'))
+        self.batch_size = int(batch_size or os.getenv('SCAN_BATCH_SIZE', '500'))
+        self.flush_interval = float(flush_interval or os.getenv('SCAN_FLUSH_INTERVAL', '0.5'))
+        # 'spill' writes overflow to disk right away, 'block' waits up to
+        # block_timeout seconds for room before spilling
+        self.full_policy = full_policy or os.getenv('SCAN_QUEUE_FULL_POLICY', 'spill')
+        self.block_timeout = float(block_timeout or os.getenv('SCAN_QUEUE_BLOCK_TIMEOUT', '0.05'))
+        self.spill_path = spill_path
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._spill_lock = threading.Lock()
+        # Guards the counters, which request threads and the writer both update
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Only replay spilled scans while the database is accepting writes
+        self._db_ok = True
+
+        self.submitted = 0
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='scan-writer', daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, campaign_id, ip_address, user_agent, referrer=""):
+        """Queue one scan for writing; never waits on the database"""
+        scan = {
+            'campaign_id': campaign_id,
+            'timestamp': datetime.now().isoformat(),
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'referrer': referrer
+        }
+        self._count('submitted')
+
+        if self._closed:
+            # Too late for the writer thread; write it synchronously
+            self._write([scan])
+            return
+
+        try:
+            if self.full_policy == 'block':
+                self._queue.put(scan, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(scan)
+        except queue.Full:
+            self._spill([scan])
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if stopping:
+                # Drain whatever is left without waiting for more
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            if batch:
+                self._write(batch)
+            if self._closed and self._queue.empty():
+                # close() gave up waiting for _STOP and spilled the rest
+                stopping = True
+            if not stopping and self._db_ok and self._queue.empty():
+                self._replay_spill()
+
+    def _write(self, batch):
+        """Insert a batch, isolating bad rows and spilling if the database is down"""
+        if self.enrich:
+            for scan in batch:
+                if 'country' not in scan:
+                    scan.update(self.enrich(scan))
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                self.db.log_scans(chunk)
+                self._count('written', len(chunk))
+                self._db_ok = True
+            except (psycopg2.DataError, psycopg2.IntegrityError):
+                # One bad row shouldn't sink the batch; retry row by row
+                for index, scan in enumerate(chunk):
+                    try:
+                        self.db.log_scans([scan])
+                        self._count('written')
+                    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                        self._count('dropped')
+                        print(f"Dropping invalid scan for {scan['campaign_id']}: {e}")
+                    except Exception as e:
+                        # The database went away mid-retry: spill the rest
+                        # instead of waiting on it once per row
+                        self._count('failed_batches')
+                        self._db_ok = False
+                        print(f"Scan write failed, spilling {len(chunk) - index} scans: {e}")
+                        self._spill(chunk[index:])
+                        break
+            except Exception as e:
+                self._count('failed_batches')
+                self._db_ok = False
+                print(f"Scan batch write failed, spilling {len(chunk)} scans: {e}")
+                self._spill(chunk)
+
+    def _spill(self, scans):
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a') as f:
+                for scan in scans:
+                    f.write(json.dumps(scan) + '\n')
+        self._count('spilled', len(scans))
+
+    def _replay_spill(self):
+        """Move spilled scans back into the database once there is headroom"""
+        replay_path = self.spill_path + '.replay'
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+        replayed = 0
+        batch = []
+        with open(replay_path, 'r') as f:
+            for line in f:
+                try:
+                    batch.append(json.loads(line))
+                except ValueError:
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    replayed += len(batch)
+                    batch = []
+        if batch:
+            self._write(batch)
+            replayed += len(batch)
+
+        # Anything that failed again was re-spilled, so the replay file can go
+        os.remove(replay_path)
+        print(f"Replayed {replayed} spilled scans")
+
+    def close(self, timeout=30):
+        """Stop accepting queued scans and flush everything to the database
+
+        The writer thread gets timeout seconds to drain the queue; if it is
+        stuck (say on a database that stopped answering) whatever is still
+        queued is spilled, to be replayed by the next process.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            deadline = time.monotonic() + timeout
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(max(deadline - time.monotonic(), 0))
+            if self._thread.is_alive():
+                left = self._take_queued()
+                if left:
+                    print(f"Scan writer did not finish in {timeout}s, spilling {len(left)} queued scans")
+                    self._spill(left)
+        else:
+            batch = self._take_queued()
+            if batch:
+                self._write(batch)
+
+    def _take_queued(self):
+        """Remove and return every scan still on the queue"""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if item is not _STOP:
+                batch.append(item)
+
+    def stats(self):
+        """Queue depth and write counters for monitoring"""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'written': self.written,
+                'spilled': self.spilled,
+                'dropped': self.dropped,
+                'failed_batches': self.failed_batches
+            }
@@ -29,7 +29,7 @@ def main():
         print("✅ Database tables created")
         
         # Migrate existing JSON data if it exists
-        if os.path.exists('data/campaigns.json') or os.path.exists('data/scans.json'):
+        if any(os.path.exists(p) for p in ('data/campaigns.json', 'data/scans.json', 'data/scans.log', 'data/scan_segments')):
             print("📦 Migrating existing JSON data...")
             db.migrate_json_data()
             print("✅ Data migration completed")
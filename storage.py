@@ -0,0 +1,215 @@
+"""
+Storage backends for the QR tracking server
+
+The routes in app.py only talk to a Storage object, picked at startup with
+STORAGE_BACKEND:
+
+    json      campaigns.json plus an append-only scan log (default)
+    sqlite    a single SQLite database in WAL mode (SQLITE_PATH)
+    postgres  PostgreSQL through database.Database (DATABASE_URL)
+
+Backends are imported lazily so JSON and SQLite deployments don't need
+psycopg2 installed.
+
+If a compiled GeoIP range file is present (see geoip.py) scans get country
+and city: the database backends fill them in on background threads, the
+JSON backend (whose log is immutable) resolves them when scans are read.
+
+Every backend classifies user agents as scans are written (ua_classifier.py):
+bot scans are included in total_scans and reported as bot_scans, but never
+count as unique visitors.
+"""
+import ipaddress
+import os
+from datetime import datetime, timedelta
+
+BACKENDS = ('json', 'sqlite', 'postgres')
+
+# How far ahead of the server clock an ingested event's timestamp may be
+EVENT_CLOCK_SKEW = timedelta(hours=1)
+# Seconds between prunes of expired event IDs
+EVENT_PRUNE_INTERVAL = 3600
+
+
+def event_window():
+    """How far back (timedelta) batch-ingested events are accepted and deduplicated"""
+    return timedelta(days=float(os.getenv('INGEST_EVENT_WINDOW_DAYS', '7')))
+
+
+def event_id_cutoff(now=None):
+    """Event IDs stored before this (naive local) time can be forgotten
+
+    scan_ingest.py rejects events timestamped before now - event_window()
+    or after now + EVENT_CLOCK_SKEW, so an event whose ID received before
+    the cutoff is resent can no longer be accepted anyway.
+    """
+    return (now or datetime.now()) - event_window() - EVENT_CLOCK_SKEW
+
+
+def clean_ip(value):
+    """First address of an X-Forwarded-For style value, or None if unparsable
+
+    Applied by the app (and scan_ingest.py) before a scan reaches any
+    backend, so every backend stores and hashes the same client address.
+    """
+    if not value:
+        return None
+    candidate = str(value).split(',')[0].strip()
+    try:
+        return str(ipaddress.ip_address(candidate))
+    except ValueError:
+        return None
+
+
+def new_campaign(campaign_id, business_name, target_url, description=''):
+    """Campaign record as returned by every backend"""
+    return {
+        'campaign_id': campaign_id,
+        'business_name': business_name,
+        'target_url': target_url,
+        'description': description,
+        'created_date': datetime.now().isoformat(),
+        'status': 'active'
+    }
+
+
+def time_bucket(timestamp, granularity):
+    """Truncate an ISO timestamp string to its hour or day bucket"""
+    if granularity == 'hour':
+        return timestamp[:13] + ':00:00'
+    return timestamp[:10] + 'T00:00:00'
+
+
+def without_bots(counts, total_field='total_scans'):
+    """Copy of a stats or timeseries entry with bot scans taken out of the total"""
+    counts = dict(counts)
+    counts[total_field] -= counts.get('bot_scans') or 0
+    counts['bot_scans'] = 0
+    return counts
+
+
+def campaign_stats_page(entries, limit):
+    """Trim entries fetched with limit + 1 to a page and its next_cursor (the last campaign_id)"""
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, entries[-1]['campaign_id']
+    return entries, None
+
+
+class Storage:
+    """Interface used by the routes; each backend implements the operations"""
+
+    name = None
+    # File the campaign cache should watch for edits made outside the app
+    watch_path = None
+
+    def start(self):
+        """Open files/connections and start background work; returns True on success"""
+        return True
+
+    def close(self):
+        """Flush pending writes and release resources"""
+
+    def begin_request(self):
+        """Called before each request"""
+
+    def end_request(self):
+        """Called after each request, even if it failed"""
+
+    def create_campaign(self, business_name, target_url, description=''):
+        """Create a campaign under a newly allocated, unique ID and return it"""
+        raise NotImplementedError
+
+    def get_campaign(self, campaign_id):
+        """Campaign dict, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def list_campaigns(self, status=None):
+        """All campaigns, optionally only those with the given status"""
+        raise NotImplementedError
+
+    def record_scan(self, campaign_id, ip_address, user_agent, referrer=''):
+        """Record one live scan (timestamped now); ip_address has been through clean_ip()"""
+        raise NotImplementedError
+
+    def log_scans(self, scans):
+        """Bulk-insert scan dicts that already carry their timestamps; returns how many were inserted
+
+        Scans with an event_id this backend has stored before are skipped,
+        so a batch that is sent again (see scan_ingest.py) isn't counted twice.
+        Backends call prune_event_ids() about once an hour from here.
+        """
+        raise NotImplementedError
+
+    def prune_event_ids(self):
+        """Forget stored event IDs older than event_id_cutoff(); returns how many were dropped"""
+        return 0
+
+    def record_suppressed(self, counts):
+        """Add {campaign_id: count} duplicate scans suppressed by the dedup window (scan_dedup.py)"""
+        raise NotImplementedError
+
+    def get_campaign_stats(self, campaign_id):
+        """total_scans, bot_scans, unique_visitors (bots excluded), last_scan and suppressed_scans"""
+        raise NotImplementedError
+
+    def list_campaign_stats(self, campaign_ids=None, status=None, business_name=None, limit=100, cursor=None):
+        """Stats for a page of campaigns in one pass; returns (entries, next_cursor or None)
+
+        Entries are get_campaign_stats() results plus business_name and
+        status, ordered by campaign_id. campaign_ids, status and
+        business_name narrow the selection; cursor is the previous page's
+        next_cursor.
+        """
+        raise NotImplementedError
+
+    def get_campaign_scans(self, campaign_id, limit=100, cursor=None, since=None):
+        """One page of raw scans, oldest first; returns (scans, next_cursor or None)
+
+        Raises ValueError for a cursor this backend did not hand out.
+        """
+        raise NotImplementedError
+
+    def iter_campaign_scans(self, campaign_id, since=None):
+        """Stream every scan for a campaign, oldest first"""
+        raise NotImplementedError
+
+    def get_campaign_timeseries(self, campaign_id, start=None, end=None, granularity='hour'):
+        """Scans, bot scans and unique visitors per hour or day bucket"""
+        raise NotImplementedError
+
+    def iter_scans_after(self, position=None):
+        """Stream every campaign's scans stored after position as (position, scan) pairs
+
+        position is opaque (None means from the beginning) and only grows,
+        so callers can resume incrementally. Raises ValueError if it no
+        longer exists (e.g. the JSON scan log was compacted).
+        """
+        raise NotImplementedError
+
+    def enrich_geo(self, batch_size=500):
+        """Geo-enrich up to batch_size stored scans; returns how many were processed"""
+        raise NotImplementedError
+
+    def migrate_json_data(self):
+        """Import data/campaigns.json and the scan files (database backends only)"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Flat numeric counters for monitoring"""
+        return {}
+
+
+def create_storage(backend=None):
+    """Build the backend named by STORAGE_BACKEND (or the backend argument)"""
+    backend = backend or os.getenv('STORAGE_BACKEND', 'json')
+    if backend == 'json':
+        from storage_json import JSONStorage
+        return JSONStorage()
+    if backend == 'sqlite':
+        from storage_sqlite import SQLiteStorage
+        return SQLiteStorage()
+    if backend == 'postgres':
+        from storage_postgres import PostgresStorage
+        return PostgresStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,351 @@
+"""
+JSON file storage backend
+
+Campaigns live in data/campaigns.json and scans in the segmented,
+append-only scan log (data/scan_segments/, see scan_log.py), with running
+per-campaign counters for constant-time stats. Raw scan pages, exports and
+timeseries read only the campaign's parts of the log through the segment
+indexes. Campaign IDs are allocated under an exclusive file lock, so
+concurrent creates (threads or worker processes) never reuse a number.
+Event IDs of batch-ingested scans are appended to data/scan_events.log
+under the same kind of lock, with the time they were stored, and kept in
+memory to skip resent events. Once an hour IDs older than the ingest
+window are dropped and the file is rewritten with the rest.
+
+The log is never rewritten in place, so geo data (when a GeoIP file is
+available) is resolved as scans are read, through the lookup's LRU cache.
+User agents are classified as scans are recorded and the packed ua_class
+is stored on each log line.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from geoip import geo_fields, load_geoip
+from hll import HyperLogLog, visitor_hash
+from metrics import FILE_SECONDS
+from scan_counters import ScanCounters
+from scan_log import ScanLog, SCAN_LOG_DIR, LEGACY_SCAN_LOG_FILE
+from storage import (EVENT_PRUNE_INTERVAL, Storage, campaign_stats_page, event_id_cutoff, new_campaign,
+                     time_bucket)
+from ua_classifier import classify_code, decode
+
+CAMPAIGNS_FILE = 'data/campaigns.json'
+SCANS_FILE = 'data/scans.json'
+SUPPRESSED_FILE = 'data/scan_suppressed.json'
+# "<event_id>\t<stored at>" per line for scans ingested through log_scans
+EVENTS_FILE = 'data/scan_events.log'
+
+_CAMPAIGN_NUMBER_RE = re.compile(r'^camp_(\d+)$')
+
+
+@FILE_SECONDS.time(operation='load')
+def load_json_file(filepath):
+    """Load data from JSON file, return empty dict if file doesn't exist"""
+    try:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@FILE_SECONDS.time(operation='save')
+def save_json_file(filepath, data):
+    """Save data to JSON file (atomically, so readers never see a partial file)"""
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+def next_campaign_id(campaigns):
+    """camp_NNNN one past the highest number in use (not the count, which reuses IDs after deletes)"""
+    highest = 0
+    for campaign_id in campaigns:
+        match = _CAMPAIGN_NUMBER_RE.match(campaign_id)
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return f"camp_{highest + 1:04d}"
+
+
+class JSONStorage(Storage):
+    name = 'json'
+
+    def __init__(self, campaigns_path=CAMPAIGNS_FILE, scan_log_path=SCAN_LOG_DIR, legacy_scans_path=SCANS_FILE,
+                 suppressed_path=SUPPRESSED_FILE, events_path=EVENTS_FILE):
+        self.campaigns_path = campaigns_path
+        self.suppressed_path = suppressed_path
+        self.events_path = events_path
+        self.scan_log_path = scan_log_path
+        self.legacy_scans_path = legacy_scans_path
+        self.watch_path = campaigns_path
+        self.scan_log = None
+        self.counters = None
+        self.geoip = None
+        self._file_lock = threading.Lock()
+        # event_id -> stored-at time read from events_path so far, where
+        # reading stopped, and which file that was (pruning replaces it)
+        self._event_ids = {}
+        self._events_offset = 0
+        self._events_inode = None
+        self._next_event_prune = 0.0
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.campaigns_path) or '.', exist_ok=True)
+        # Segmented scan log (adopts a legacy scans.log/scans.json on first start)
+        self.scan_log = ScanLog(self.scan_log_path, legacy_path=self.legacy_scans_path,
+                                legacy_log_path=LEGACY_SCAN_LOG_FILE)
+        # Running per-campaign totals, kept in step with the scan log
+        self.counters = ScanCounters(self.scan_log)
+        self.geoip = load_geoip()
+        return True
+
+    def close(self):
+        if self.counters:
+            self.counters.close()
+        if self.scan_log:
+            self.scan_log.close()
+        if self.geoip:
+            self.geoip.close()
+
+    def _with_geo(self, scan):
+        if self.geoip and 'country' not in scan:
+            scan.update(geo_fields(self.geoip, scan.get('ip_address')))
+        return scan
+
+    @contextmanager
+    def _file_locked(self, path):
+        """Serialize a JSON file's read-modify-write across threads and processes"""
+        with self._file_lock, open(path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def create_campaign(self, business_name, target_url, description=''):
+        with self._file_locked(self.campaigns_path):
+            campaigns = load_json_file(self.campaigns_path)
+            campaign = new_campaign(next_campaign_id(campaigns), business_name, target_url, description)
+            campaigns[campaign['campaign_id']] = campaign
+            save_json_file(self.campaigns_path, campaigns)
+        return campaign
+
+    def get_campaign(self, campaign_id):
+        return load_json_file(self.campaigns_path).get(campaign_id)
+
+    def list_campaigns(self, status=None):
+        campaigns = load_json_file(self.campaigns_path).values()
+        return [c for c in campaigns if status is None or c.get('status', 'active') == status]
+
+    def record_scan(self, campaign_id, ip_address, user_agent, referrer=''):
+        scan = {
+            'campaign_id': campaign_id,
+            'timestamp': datetime.now().isoformat(),
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'referrer': referrer,
+            'method': 'GET',
+            'visitor_hash': visitor_hash(ip_address, user_agent),
+            'ua_class': classify_code(user_agent)
+        }
+        with FILE_SECONDS.time(operation='scan_append'):
+            self.scan_log.append(scan)
+
+    def log_scans(self, scans):
+        records = []
+        for scan in scans:
+            record = dict(scan)
+            if not record.get('visitor_hash'):
+                record['visitor_hash'] = visitor_hash(record.get('ip_address'), record.get('user_agent', ''))
+            if record.get('ua_class') is None:
+                record['ua_class'] = classify_code(record.get('user_agent', ''))
+            records.append(record)
+        if not any(record.get('event_id') for record in records):
+            with FILE_SECONDS.time(operation='scan_append'):
+                self.scan_log.append_many(records)
+            return len(records)
+
+        # Check and record event IDs under the file lock, so concurrent
+        # batches (threads or workers) can't both store the same event
+        with self._file_locked(self.events_path):
+            self._read_event_ids()
+            stored_at = datetime.now().isoformat(timespec='seconds')
+            fresh = []
+            new_ids = []
+            for record in records:
+                event_id = record.pop('event_id', None)
+                if event_id:
+                    if event_id in self._event_ids:
+                        continue
+                    self._event_ids[event_id] = stored_at
+                    new_ids.append(event_id)
+                fresh.append(record)
+            with FILE_SECONDS.time(operation='scan_append'):
+                self.scan_log.append_many(fresh)
+                # The scans reach disk before their IDs: a crash in between
+                # re-accepts the batch on retry rather than losing it
+                self.scan_log.flush()
+            if new_ids:
+                with open(self.events_path, 'a') as f:
+                    f.write(''.join(f"{event_id}\t{stored_at}\n" for event_id in new_ids))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._events_offset = f.tell()
+        if time.monotonic() >= self._next_event_prune:
+            self.prune_event_ids()
+        return len(fresh)
+
+    def _read_event_ids(self):
+        """Pick up event IDs other processes appended since the last read (file lock held)"""
+        try:
+            with open(self.events_path, 'rb+') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self._events_inode:
+                    # First read, or another process pruned the file
+                    self._event_ids.clear()
+                    self._events_offset = 0
+                    self._events_inode = inode
+                f.seek(self._events_offset)
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                # Lines written before stored-at times were recorded count as stored now
+                now = datetime.now().isoformat(timespec='seconds')
+                for line in data[:complete].decode().splitlines():
+                    event_id, _, stored_at = line.partition('\t')
+                    self._event_ids[event_id] = stored_at or now
+                self._events_offset += complete
+                if complete < len(data):
+                    # Torn last line from a crash mid-write; its batch wasn't confirmed
+                    f.truncate(self._events_offset)
+        except FileNotFoundError:
+            pass
+
+    @FILE_SECONDS.time(operation='events_prune')
+    def prune_event_ids(self):
+        self._next_event_prune = time.monotonic() + EVENT_PRUNE_INTERVAL
+        cutoff = event_id_cutoff().isoformat(timespec='seconds')
+        with self._file_locked(self.events_path):
+            self._read_event_ids()
+            expired = [event_id for event_id, stored_at in self._event_ids.items() if stored_at < cutoff]
+            if not expired:
+                return 0
+            for event_id in expired:
+                del self._event_ids[event_id]
+            # Other processes see the new inode and reread the file from the start
+            tmp_path = self.events_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(f"{event_id}\t{stored_at}\n" for event_id, stored_at in self._event_ids.items()))
+                f.flush()
+                os.fsync(f.fileno())
+                self._events_offset = f.tell()
+                self._events_inode = os.fstat(f.fileno()).st_ino
+            os.replace(tmp_path, self.events_path)
+        return len(expired)
+
+    def record_suppressed(self, counts):
+        with self._file_locked(self.suppressed_path):
+            suppressed = load_json_file(self.suppressed_path)
+            for campaign_id, count in counts.items():
+                suppressed[campaign_id] = suppressed.get(campaign_id, 0) + count
+            save_json_file(self.suppressed_path, suppressed)
+
+    def get_campaign_stats(self, campaign_id):
+        # unique_visitors is a HyperLogLog estimate (~2.3% standard error) without bots
+        return {
+            'campaign_id': campaign_id,
+            **self.counters.get(campaign_id),
+            'suppressed_scans': load_json_file(self.suppressed_path).get(campaign_id, 0)
+        }
+
+    def list_campaign_stats(self, campaign_ids=None, status=None, business_name=None, limit=100, cursor=None):
+        wanted = set(campaign_ids) if campaign_ids is not None else None
+        campaigns = sorted(
+            (campaign for campaign_id, campaign in load_json_file(self.campaigns_path).items()
+             if (wanted is None or campaign_id in wanted)
+             and (status is None or campaign.get('status', 'active') == status)
+             and (business_name is None or campaign.get('business_name') == business_name)
+             and (not cursor or campaign_id > cursor)),
+            key=lambda campaign: campaign['campaign_id']
+        )[:limit + 1]
+        totals = self.counters.get_many([campaign['campaign_id'] for campaign in campaigns])
+        suppressed = load_json_file(self.suppressed_path)
+        entries = [
+            {
+                'campaign_id': campaign['campaign_id'],
+                'business_name': campaign.get('business_name'),
+                'status': campaign.get('status', 'active'),
+                **totals[campaign['campaign_id']],
+                'suppressed_scans': suppressed.get(campaign['campaign_id'], 0)
+            }
+            for campaign in campaigns
+        ]
+        return campaign_stats_page(entries, limit)
+
+    def get_campaign_scans(self, campaign_id, limit=100, cursor=None, since=None):
+        # Cursors are scan log positions
+        try:
+            position = int(cursor or 0)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+        if position < 0:
+            raise ValueError("cursor must not be negative")
+
+        scans = []
+        for _, end, scan in self.scan_log.iter_campaign_records(campaign_id, position, since=since):
+            if since and scan.get('timestamp', '') < since:
+                continue
+            scans.append(self._with_geo(scan))
+            if len(scans) == limit:
+                return scans, str(end)
+        return scans, None
+
+    def iter_campaign_scans(self, campaign_id, since=None):
+        for _, _, scan in self.scan_log.iter_campaign_records(campaign_id, since=since):
+            if not since or scan.get('timestamp', '') >= since:
+                yield self._with_geo(scan)
+
+    def get_campaign_timeseries(self, campaign_id, start=None, end=None, granularity='hour'):
+        if granularity not in ('hour', 'day'):
+            raise ValueError("granularity must be 'hour' or 'day'")
+
+        buckets = {}
+        for scan in self.iter_campaign_scans(campaign_id, since=start):
+            timestamp = scan.get('timestamp', '')
+            if end and timestamp >= end:
+                continue
+            bucket = time_bucket(timestamp, granularity)
+            entry = buckets.get(bucket)
+            if entry is None:
+                entry = buckets[bucket] = [0, HyperLogLog(), 0]
+            entry[0] += 1
+            ua_class = scan.get('ua_class')
+            if ua_class is None:
+                ua_class = classify_code(scan.get('user_agent', ''))
+            if decode(ua_class).is_bot:
+                entry[2] += 1
+            else:
+                entry[1].add(scan.get('visitor_hash') or visitor_hash(scan.get('ip_address'), scan.get('user_agent', '')))
+
+        return [
+            {'bucket': bucket, 'scans': count, 'bot_scans': bots, 'unique_visitors': sketch.estimate()}
+            for bucket, (count, sketch, bots) in sorted(buckets.items())
+        ]
+
+    def iter_scans_after(self, position=None):
+        for _, end, scan in self.scan_log.iter_records(position):
+            yield end, scan
+
+    def stats(self):
+        stats = {'scan_log_bytes': self.scan_log.size}
+        stats.update({f"scan_log_{key}": value for key, value in self.scan_log.stats().items()})
+        if self.geoip:
+            stats.update({f"geoip_{key}": value for key, value in self.geoip.stats().items()})
+        return stats
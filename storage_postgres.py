@@ -0,0 +1,122 @@
+"""
+PostgreSQL storage backend
+
+Thin adapter over database.Database: reads go through the connection pool
+and live scans are queued on a ScanWriter and inserted in batches. start()
+only checks that the schema is current; setup_db.py creates and upgrades it. With a
+GeoIP file the writer thread resolves country/city for each batch, and a
+GeoEnricher backfills rows stored before it was available.
+"""
+from database import Database
+from geoip import GeoEnricher, geo_fields, load_geoip
+from scan_writer import ScanWriter
+from storage import Storage, campaign_stats_page
+
+
+class PostgresStorage(Storage):
+    name = 'postgres'
+
+    def __init__(self, db=None):
+        self.db = db or Database()
+        # Scans are queued and inserted in batches off the request thread
+        self.scan_writer = ScanWriter(self.db)
+        self.geoip = None
+        self.geo_enricher = None
+
+    def start(self):
+        if not self.db.connect():
+            print("❌ Database connection failed")
+            return False
+        # Schema changes are applied by setup_db.py, not by every worker
+        missing = self.db.verify_schema()
+        if missing:
+            print(f"❌ Database schema is out of date (missing {', '.join(missing)}); run 'python setup_db.py'")
+            return False
+        if self.db.scans_partitioned():
+            self.db.start_maintenance()
+        # Visitor sketches are merged into the rollups off the write path
+        self.db.start_sketch_folding()
+        self.geoip = load_geoip()
+        if self.geoip:
+            if not self.db.geo_pending_index_exists():
+                print("⚠️  Geo enrichment has no pending-scan index; run 'python setup_db.py' to create it")
+            self.scan_writer.enrich = lambda scan: geo_fields(self.geoip, scan['ip_address'])
+            self.geo_enricher = GeoEnricher(self.enrich_geo).start()
+        self.scan_writer.start()
+        print("✅ Database connected and schema verified")
+        return True
+
+    def close(self):
+        if self.geo_enricher:
+            self.geo_enricher.close()
+        self.scan_writer.close()
+        if self.db.pool:
+            self.db.close()
+
+    def begin_request(self):
+        # Scope pooled connection use to this request (checked out lazily)
+        self.db.begin_request()
+
+    def end_request(self):
+        if self.db.pool:
+            self.db.end_request()
+
+    def create_campaign(self, business_name, target_url, description=''):
+        return self.db.add_campaign(business_name, target_url, description)
+
+    def get_campaign(self, campaign_id):
+        return self.db.get_campaign(campaign_id)
+
+    def list_campaigns(self, status=None):
+        return self.db.list_campaigns(status=status)
+
+    def record_scan(self, campaign_id, ip_address, user_agent, referrer=''):
+        self.scan_writer.submit(campaign_id, ip_address, user_agent, referrer)
+
+    def log_scans(self, scans):
+        return self.db.copy_scans(scans)
+
+    def prune_event_ids(self):
+        return self.db.prune_scan_events()
+
+    def record_suppressed(self, counts):
+        self.db.record_suppressed(counts)
+
+    def get_campaign_stats(self, campaign_id):
+        stats = self.db.get_campaign_stats(campaign_id, recent_limit=0)
+        stats.pop('recent_scans', None)
+        return stats
+
+    def list_campaign_stats(self, campaign_ids=None, status=None, business_name=None, limit=100, cursor=None):
+        entries = self.db.list_campaign_stats(campaign_ids, status=status, business_name=business_name,
+                                              limit=limit + 1, after=cursor)
+        return campaign_stats_page(entries, limit)
+
+    def get_campaign_scans(self, campaign_id, limit=100, cursor=None, since=None):
+        return self.db.get_campaign_scans(campaign_id, limit=limit, cursor=cursor, since=since)
+
+    def iter_campaign_scans(self, campaign_id, since=None):
+        return self.db.iter_campaign_scans(campaign_id, since=since)
+
+    def get_campaign_timeseries(self, campaign_id, start=None, end=None, granularity='hour'):
+        return self.db.get_campaign_timeseries(campaign_id, start=start, end=end, granularity=granularity)
+
+    def iter_scans_after(self, position=None):
+        return self.db.iter_scans_after(position or 0)
+
+    def enrich_geo(self, batch_size=500):
+        if not self.geoip:
+            return 0
+        return self.db.enrich_geo(self.geoip.lookup, batch_size)
+
+    def migrate_json_data(self):
+        return self.db.migrate_json_data()
+
+    def stats(self):
+        stats = {f"scan_writer_{key}": value for key, value in self.scan_writer.stats().items()}
+        if self.db.pool:
+            stats.update({f"pool_{key}": value for key, value in self.db.pool.stats().items()})
+        if self.geoip:
+            stats.update({f"geoip_{key}": value for key, value in self.geoip.stats().items()})
+            stats['geoip_enriched'] = self.geo_enricher.enriched
+        return stats
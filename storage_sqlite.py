@@ -0,0 +1,482 @@
+"""
+Embedded SQLite storage backend
+
+One database file (SQLITE_PATH, default data/qr_tracker.db) in WAL mode:
+readers never block the writer, and with synchronous=NORMAL a commit is an
+append to the WAL without an fsync, so scans are written transactionally
+in the request at embedded speed. Connections are reused from a small
+idle pool (werkzeug serves each request on a fresh thread).
+
+Per-campaign totals are maintained in the same transaction as each insert:
+scan_totals holds the running count and last scan, and scan_visitors holds
+one row per distinct visitor, so stats are exact and never count raw scans.
+
+country/city start out NULL and are filled in by a background GeoEnricher
+when a GeoIP file is available ('' means looked up but unknown).
+
+Each scan's user agent is classified on insert (ua_class/is_bot, see
+ua_classifier.py); bot scans are counted in scan_totals.bot_scans and never
+added to scan_visitors.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from geoip import GeoEnricher, load_geoip
+from hll import visitor_hash
+from metrics import DB_SECONDS
+from storage import (EVENT_PRUNE_INTERVAL, Storage, campaign_stats_page, event_id_cutoff, new_campaign,
+                     time_bucket)
+from ua_classifier import classify_code, decode
+
+SQLITE_FILE = 'data/qr_tracker.db'
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id TEXT UNIQUE NOT NULL,
+        business_name TEXT NOT NULL,
+        target_url TEXT NOT NULL,
+        description TEXT DEFAULT '',
+        created_date TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'active'
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY,
+        campaign_id TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        ip_address TEXT,
+        user_agent TEXT,
+        referrer TEXT,
+        visitor_hash TEXT,
+        country TEXT,
+        city TEXT,
+        ua_class INTEGER,
+        is_bot INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_scans_campaign_time ON scans (campaign_id, timestamp, id)",
+    """
+    CREATE TABLE IF NOT EXISTS scan_totals (
+        campaign_id TEXT PRIMARY KEY,
+        total_scans INTEGER NOT NULL DEFAULT 0,
+        unique_visitors INTEGER NOT NULL DEFAULT 0,
+        last_scan TEXT,
+        bot_scans INTEGER NOT NULL DEFAULT 0,
+        suppressed_scans INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS scan_visitors (
+        campaign_id TEXT NOT NULL,
+        visitor_hash TEXT NOT NULL,
+        PRIMARY KEY (campaign_id, visitor_hash)
+    ) WITHOUT ROWID
+    """,
+    # Event IDs of batch-ingested scans, so resent events are skipped;
+    # pruned once they are older than the ingest window
+    """
+    CREATE TABLE IF NOT EXISTS scan_events (
+        event_id TEXT PRIMARY KEY,
+        received_at TEXT
+    ) WITHOUT ROWID
+    """
+]
+
+SCAN_COLUMNS = 'campaign_id, timestamp, ip_address, user_agent, referrer, visitor_hash, ua_class, is_bot'
+SCAN_SELECT = 'campaign_id, timestamp, ip_address, user_agent, referrer, visitor_hash, country, city, ua_class'
+
+# Columns added after the first release: (table, column, type)
+ADDED_COLUMNS = [
+    ('scans', 'country', 'TEXT'),
+    ('scans', 'city', 'TEXT'),
+    ('scans', 'ua_class', 'INTEGER'),
+    ('scans', 'is_bot', 'INTEGER'),
+    ('scan_totals', 'bot_scans', 'INTEGER NOT NULL DEFAULT 0'),
+    ('scan_totals', 'suppressed_scans', 'INTEGER NOT NULL DEFAULT 0'),
+    ('scan_events', 'received_at', 'TEXT'),
+]
+
+# Run after ADDED_COLUMNS, since older scan_events tables lack received_at
+EVENTS_RECEIVED_INDEX = "CREATE INDEX IF NOT EXISTS idx_scan_events_received ON scan_events (received_at)"
+
+# Run after SCHEMA, once databases created without the columns are upgraded.
+# Only kept while geo enrichment is on: without a GeoIP database every scan
+# stays pending and the index would cover the whole table
+GEO_PENDING_INDEX = "CREATE INDEX IF NOT EXISTS idx_scans_geo_pending ON scans (id) WHERE country IS NULL"
+DROP_GEO_PENDING_INDEX = "DROP INDEX IF EXISTS idx_scans_geo_pending"
+
+
+def _iso(timestamp):
+    """Timestamps are stored as ISO-8601 text so they sort lexically"""
+    return timestamp.isoformat() if hasattr(timestamp, 'isoformat') else timestamp
+
+
+class SQLiteStorage(Storage):
+    name = 'sqlite'
+
+    def __init__(self, path=None, synchronous=None, busy_timeout=None, max_idle=None):
+        self.path = path or os.getenv('SQLITE_PATH', SQLITE_FILE)
+        self.synchronous = synchronous or os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+        self.busy_timeout = float(busy_timeout or os.getenv('SQLITE_BUSY_TIMEOUT', '5'))
+        self.max_idle = int(max_idle or os.getenv('SQLITE_POOL_SIZE', '8'))
+        self._idle = []
+        self._opened = 0
+        self._lock = threading.Lock()
+        self.geoip = None
+        self.geo_enricher = None
+        self._next_event_prune = 0.0
+
+    def _open(self):
+        # Autocommit mode: transactions are opened explicitly (BEGIN IMMEDIATE
+        # for writes, so two writers never deadlock upgrading read locks)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open()
+            with self._lock:
+                self._opened += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def _write(self, operation):
+        with self._connection() as conn, DB_SECONDS.time(operation=operation):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _read(self, operation, query, params=()):
+        with self._connection() as conn, DB_SECONDS.time(operation=operation):
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.geoip = load_geoip()
+        with self._write('create_tables') as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            for table, column, column_type in ADDED_COLUMNS:
+                columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            # IDs stored before received_at existed start their window now
+            conn.execute("UPDATE scan_events SET received_at = ? WHERE received_at IS NULL",
+                         (datetime.now().isoformat(),))
+            conn.execute(EVENTS_RECEIVED_INDEX)
+            conn.execute(GEO_PENDING_INDEX if self.geoip else DROP_GEO_PENDING_INDEX)
+        print(f"✅ SQLite database ready at {self.path}")
+
+        if self.geoip:
+            self.geo_enricher = GeoEnricher(self.enrich_geo).start()
+        return True
+
+    def close(self):
+        if self.geo_enricher:
+            self.geo_enricher.close()
+        if self.geoip:
+            self.geoip.close()
+        with self._lock:
+            connections, self._idle = self._idle, []
+        for conn in connections:
+            conn.close()
+
+    def create_campaign(self, business_name, target_url, description=''):
+        with self._write('create_campaign') as conn:
+            # The write lock is held, so the number can't be taken under us;
+            # skip past IDs already used by imported campaigns
+            number = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM campaigns").fetchone()[0]
+            while conn.execute("SELECT 1 FROM campaigns WHERE campaign_id = ?", (f"camp_{number:04d}",)).fetchone():
+                number += 1
+            campaign = new_campaign(f"camp_{number:04d}", business_name, target_url, description)
+            conn.execute(
+                """INSERT INTO campaigns (campaign_id, business_name, target_url, description, created_date, status)
+                   VALUES (:campaign_id, :business_name, :target_url, :description, :created_date, :status)""",
+                campaign
+            )
+        return campaign
+
+    def get_campaign(self, campaign_id):
+        rows = self._read(
+            'get_campaign',
+            "SELECT campaign_id, business_name, target_url, description, created_date, status FROM campaigns WHERE campaign_id = ?",
+            (campaign_id,)
+        )
+        return rows[0] if rows else None
+
+    def list_campaigns(self, status=None):
+        query = "SELECT campaign_id, business_name, target_url, description, created_date, status FROM campaigns"
+        params = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        return self._read('list_campaigns', query + " ORDER BY id", params)
+
+    def _insert_scans(self, conn, scans):
+        rows = []
+        for scan in scans:
+            user_agent = scan.get('user_agent', '')
+            ua_class = classify_code(user_agent)
+            rows.append((
+                scan['campaign_id'],
+                _iso(scan['timestamp']),
+                scan.get('ip_address'),
+                user_agent,
+                scan.get('referrer', ''),
+                scan.get('visitor_hash') or visitor_hash(scan.get('ip_address'), user_agent),
+                ua_class,
+                int(decode(ua_class).is_bot)
+            ))
+        conn.executemany(f"INSERT INTO scans ({SCAN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        totals = {}
+        for campaign_id, timestamp, _, _, _, hashed, _, is_bot in rows:
+            entry = totals.get(campaign_id)
+            if entry is None:
+                entry = totals[campaign_id] = [0, 0, timestamp, 0]
+            entry[0] += 1
+            entry[2] = max(entry[2], timestamp)
+            if is_bot:
+                entry[3] += 1
+                continue
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO scan_visitors (campaign_id, visitor_hash) VALUES (?, ?)",
+                (campaign_id, hashed)
+            )
+            entry[1] += cursor.rowcount
+
+        conn.executemany(
+            """INSERT INTO scan_totals (campaign_id, total_scans, unique_visitors, last_scan, bot_scans)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (campaign_id) DO UPDATE SET
+                   total_scans = total_scans + excluded.total_scans,
+                   unique_visitors = unique_visitors + excluded.unique_visitors,
+                   bot_scans = bot_scans + excluded.bot_scans,
+                   last_scan = CASE WHEN last_scan IS NULL OR excluded.last_scan > last_scan
+                                    THEN excluded.last_scan ELSE last_scan END""",
+            [(campaign_id, count, new, last, bots) for campaign_id, (count, new, last, bots) in totals.items()]
+        )
+
+    def record_scan(self, campaign_id, ip_address, user_agent, referrer=''):
+        scan = {
+            'campaign_id': campaign_id,
+            'timestamp': datetime.now().isoformat(),
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'referrer': referrer
+        }
+        with self._write('log_scan') as conn:
+            self._insert_scans(conn, [scan])
+
+    def log_scans(self, scans):
+        if not scans:
+            return 0
+        received_at = datetime.now().isoformat()
+        with self._write('log_scans') as conn:
+            fresh = []
+            for scan in scans:
+                event_id = scan.get('event_id')
+                if event_id and not conn.execute(
+                    "INSERT OR IGNORE INTO scan_events (event_id, received_at) VALUES (?, ?)", (event_id, received_at)
+                ).rowcount:
+                    continue
+                fresh.append(scan)
+            if fresh:
+                self._insert_scans(conn, fresh)
+        if time.monotonic() >= self._next_event_prune:
+            self.prune_event_ids()
+        return len(fresh)
+
+    def prune_event_ids(self):
+        self._next_event_prune = time.monotonic() + EVENT_PRUNE_INTERVAL
+        with self._write('prune_event_ids') as conn:
+            return conn.execute("DELETE FROM scan_events WHERE received_at < ?",
+                                (event_id_cutoff().isoformat(),)).rowcount
+
+    def record_suppressed(self, counts):
+        with self._write('record_suppressed') as conn:
+            conn.executemany(
+                """INSERT INTO scan_totals (campaign_id, suppressed_scans) VALUES (?, ?)
+                   ON CONFLICT (campaign_id) DO UPDATE SET suppressed_scans = suppressed_scans + excluded.suppressed_scans""",
+                list(counts.items())
+            )
+
+    def get_campaign_stats(self, campaign_id):
+        rows = self._read(
+            'get_campaign_stats',
+            """SELECT total_scans, bot_scans, unique_visitors, last_scan, suppressed_scans
+               FROM scan_totals WHERE campaign_id = ?""",
+            (campaign_id,)
+        )
+        totals = rows[0] if rows else {
+            'total_scans': 0, 'bot_scans': 0, 'unique_visitors': 0, 'last_scan': None, 'suppressed_scans': 0
+        }
+        return {'campaign_id': campaign_id, **totals}
+
+    def list_campaign_stats(self, campaign_ids=None, status=None, business_name=None, limit=100, cursor=None):
+        conditions = []
+        params = []
+        if campaign_ids is not None:
+            campaign_ids = list(campaign_ids)
+            if not campaign_ids:
+                return [], None
+            conditions.append(f"c.campaign_id IN ({', '.join('?' * len(campaign_ids))})")
+            params += campaign_ids
+        if status is not None:
+            conditions.append("c.status = ?")
+            params.append(status)
+        if business_name is not None:
+            conditions.append("c.business_name = ?")
+            params.append(business_name)
+        if cursor:
+            conditions.append("c.campaign_id > ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        entries = self._read(
+            'list_campaign_stats',
+            f"""SELECT c.campaign_id, c.business_name, c.status,
+                       COALESCE(t.total_scans, 0) AS total_scans, COALESCE(t.bot_scans, 0) AS bot_scans,
+                       COALESCE(t.unique_visitors, 0) AS unique_visitors, t.last_scan,
+                       COALESCE(t.suppressed_scans, 0) AS suppressed_scans
+                FROM campaigns c LEFT JOIN scan_totals t ON t.campaign_id = c.campaign_id
+                {where} ORDER BY c.campaign_id LIMIT ?""",
+            params + [limit + 1]
+        )
+        return campaign_stats_page(entries, limit)
+
+    def get_campaign_scans(self, campaign_id, limit=100, cursor=None, since=None):
+        # Same "<timestamp>|<id>" keyset cursor as the PostgreSQL backend
+        query = f"SELECT id, {SCAN_SELECT} FROM scans WHERE campaign_id = ?"
+        params = [campaign_id]
+        if cursor:
+            try:
+                cursor_time, cursor_id = cursor.rsplit('|', 1)
+                params += [cursor_time, int(cursor_id)]
+            except ValueError:
+                raise ValueError("Invalid cursor")
+            query += " AND (timestamp, id) > (?, ?)"
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        query += " ORDER BY timestamp, id LIMIT ?"
+        params.append(limit)
+
+        scans = self._read('get_campaign_scans', query, params)
+        next_cursor = None
+        if len(scans) == limit:
+            next_cursor = f"{scans[-1]['timestamp']}|{scans[-1]['id']}"
+        return scans, next_cursor
+
+    def iter_campaign_scans(self, campaign_id, since=None, batch_size=2000):
+        query = f"SELECT {SCAN_SELECT} FROM scans WHERE campaign_id = ?"
+        params = [campaign_id]
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        query += " ORDER BY timestamp, id"
+
+        # A private connection, held for as long as the stream is consumed
+        conn = self._open()
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+
+    def get_campaign_timeseries(self, campaign_id, start=None, end=None, granularity='hour'):
+        if granularity not in ('hour', 'day'):
+            raise ValueError("granularity must be 'hour' or 'day'")
+        width = 13 if granularity == 'hour' else 10
+
+        # is_bot is NULL for scans stored before classification; count those as people
+        query = f"""SELECT substr(timestamp, 1, {width}) AS bucket, COUNT(*) AS scans,
+                           COALESCE(SUM(is_bot), 0) AS bot_scans,
+                           COUNT(DISTINCT CASE WHEN NOT COALESCE(is_bot, 0) THEN visitor_hash END) AS unique_visitors
+                    FROM scans WHERE campaign_id = ?"""
+        params = [campaign_id]
+        if start:
+            query += " AND timestamp >= ?"
+            params.append(start)
+        if end:
+            query += " AND timestamp < ?"
+            params.append(end)
+        query += " GROUP BY bucket ORDER BY bucket"
+
+        rows = self._read('get_campaign_timeseries', query, params)
+        for row in rows:
+            row['bucket'] = time_bucket(row['bucket'], granularity)
+        return rows
+
+    def iter_scans_after(self, position=None, batch_size=5000):
+        # Positions are scan ids; each batch is a short read on a pooled connection
+        last_id = position or 0
+        while True:
+            rows = self._read(
+                'iter_scans_after',
+                """SELECT id, campaign_id, timestamp, user_agent, referrer, visitor_hash, ua_class, is_bot
+                   FROM scans WHERE id > ? ORDER BY id LIMIT ?""",
+                (last_id, batch_size)
+            )
+            for row in rows:
+                last_id = row['id']
+                yield last_id, row
+            if len(rows) < batch_size:
+                return
+
+    def enrich_geo(self, batch_size=500):
+        if not self.geoip:
+            return 0
+        # Resolve outside the write lock; only the UPDATE needs it
+        pending = self._read(
+            'enrich_geo_pending',
+            "SELECT id, ip_address FROM scans WHERE country IS NULL ORDER BY id LIMIT ?",
+            (batch_size,)
+        )
+        updates = []
+        for row in pending:
+            country, city = (self.geoip.lookup(row['ip_address']) if row['ip_address'] else None) or ('', '')
+            updates.append((country, city, row['id']))
+        if updates:
+            with self._write('enrich_geo') as conn:
+                conn.executemany("UPDATE scans SET country = ?, city = ? WHERE id = ?", updates)
+        return len(updates)
+
+    def stats(self):
+        with self._lock:
+            stats = {'idle_connections': len(self._idle), 'connections_opened': self._opened}
+        if self.geoip:
+            stats.update({f"geoip_{key}": value for key, value in self.geoip.stats().items()})
+            stats['geoip_enriched'] = self.geo_enricher.enriched
+        return stats
@@ -0,0 +1,172 @@
+import atexit
+import importlib
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+          '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def client(request, tmp_path, monkeypatch):
+    """Test client for a fresh app on the given backend, with its data in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('STORAGE_BACKEND', request.param)
+    monkeypatch.setenv('BULK_STATS_CACHE_TTL', '0')
+    for name in ('SCAN_DEDUP_WINDOW', 'SCAN_FAST_PATH', 'GEOIP_DATABASE', 'SQLITE_PATH', 'METRICS_PROFILE_TOKEN'):
+        monkeypatch.delenv(name, raising=False)
+
+    app_module = importlib.reload(sys.modules['app']) if 'app' in sys.modules else importlib.import_module('app')
+    app_module.warm_up()
+    yield app_module.app.test_client()
+    app_module.shutdown()
+    atexit.unregister(app_module.shutdown)
+
+
+def create_campaign(client, name='Joe\'s Pizza', target_url='https://example.com/promo'):
+    response = client.post('/create_campaign', json={'business_name': name, 'target_url': target_url})
+    assert response.status_code == 200
+    return response.get_json()['campaign_id']
+
+
+def test_create_and_list_campaigns(client):
+    first = create_campaign(client)
+    second = create_campaign(client, 'Corner Cafe')
+    assert first != second
+
+    campaigns = client.get('/campaigns').get_json()
+    assert set(campaigns) == {first, second}
+    assert campaigns[second]['business_name'] == 'Corner Cafe'
+    assert client.post('/create_campaign', json={'business_name': 'No URL'}).status_code == 400
+
+
+def test_scan_redirects_and_counts(client):
+    campaign_id = create_campaign(client)
+
+    response = client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE})
+    assert response.status_code == 302
+    assert response.headers['Location'] == 'https://example.com/promo'
+    client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE, 'X-Forwarded-For': '203.0.113.9, 10.0.0.1'})
+    client.get(f'/scan/{campaign_id}', headers={'User-Agent': 'curl/8.4.0'})
+    assert client.get('/scan/camp_9999').status_code == 404
+
+    stats = client.get(f'/campaign/{campaign_id}/stats').get_json()
+    assert stats['total_scans'] == 3
+    assert stats['bot_scans'] == 1
+    assert stats['unique_visitors'] == 2
+    assert len(stats['scans']) == 3
+    # Only the client address of a multi-hop X-Forwarded-For is stored
+    assert '203.0.113.9' in [scan['ip_address'] for scan in stats['scans']]
+    assert not any(',' in (scan['ip_address'] or '') for scan in stats['scans'])
+    assert client.get(f'/campaign/{campaign_id}/stats?exclude_bots=1').get_json()['total_scans'] == 2
+
+
+def test_stats_pagination(client):
+    campaign_id = create_campaign(client)
+    for n in range(5):
+        client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE, 'X-Forwarded-For': f'198.51.100.{n}'})
+
+    seen = []
+    cursor = None
+    while True:
+        url = f'/campaign/{campaign_id}/stats?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        page = client.get(url).get_json()
+        seen += [scan['ip_address'] for scan in page['scans']]
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert sorted(seen) == [f'198.51.100.{n}' for n in range(5)]
+
+
+def hours_ago(hours):
+    return (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+
+
+def test_batch_ingest_is_idempotent(client):
+    campaign_id = create_campaign(client)
+    events = [
+        {'event_id': f'edge-{n}', 'campaign_id': campaign_id, 'timestamp': hours_ago(n + 1),
+         'ip_address': f'203.0.113.{n}', 'user_agent': IPHONE}
+        for n in range(10)
+    ]
+    body = '\n'.join(json.dumps(event) for event in events) + '\n'
+    body += json.dumps({'event_id': 'edge-x', 'campaign_id': 'camp_9999', 'timestamp': hours_ago(1)}) + '\n'
+    body += json.dumps({'event_id': 'edge-old', 'campaign_id': campaign_id, 'timestamp': hours_ago(24 * 8)}) + '\n'
+    body += json.dumps({'event_id': 'edge-future', 'campaign_id': campaign_id, 'timestamp': hours_ago(-2)}) + '\n'
+    body += 'not json\n'
+
+    result = client.post('/scans/batch', data=body, content_type='application/x-ndjson').get_json()
+    assert (result['accepted'], result['duplicates'], result['rejected']) == (10, 0, 4)
+    again = client.post('/scans/batch', data=body, content_type='application/x-ndjson').get_json()
+    assert (again['accepted'], again['duplicates']) == (0, 10)
+
+    assert client.get(f'/campaign/{campaign_id}/stats').get_json()['total_scans'] == 10
+
+
+def test_expired_event_ids_are_pruned(client, monkeypatch):
+    import app
+    campaign_id = create_campaign(client)
+    scans = [{'event_id': f'edge-{n}', 'campaign_id': campaign_id, 'timestamp': datetime.now().isoformat(),
+              'ip_address': '203.0.113.9', 'user_agent': IPHONE} for n in range(3)]
+    assert app.storage.log_scans([dict(scan) for scan in scans]) == 3
+    assert app.storage.prune_event_ids() == 0
+    assert app.storage.log_scans([dict(scan) for scan in scans]) == 0
+
+    # A window ending in the future makes every stored ID expired
+    monkeypatch.setenv('INGEST_EVENT_WINDOW_DAYS', '-1')
+    assert app.storage.prune_event_ids() == 3
+    assert app.storage.prune_event_ids() == 0
+    assert app.storage.log_scans([dict(scan) for scan in scans[:1]]) == 1
+
+
+def test_bulk_campaign_stats(client):
+    ids = [create_campaign(client, f'Shop {n}') for n in range(3)]
+    for n, campaign_id in enumerate(ids):
+        for _ in range(n + 1):
+            client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE})
+
+    page = client.get('/campaigns/stats?ids=' + ','.join(ids)).get_json()
+    assert [entry['campaign_id'] for entry in page['campaigns']] == sorted(ids)
+    assert {entry['campaign_id']: entry['total_scans'] for entry in page['campaigns']} == \
+        {campaign_id: n + 1 for n, campaign_id in enumerate(ids)}
+
+    first = client.get('/campaigns/stats?limit=2').get_json()
+    rest = client.get(f"/campaigns/stats?limit=2&cursor={first['next_cursor']}").get_json()
+    assert [entry['campaign_id'] for entry in first['campaigns'] + rest['campaigns']] == sorted(ids)
+
+
+def test_export_formats(client):
+    campaign_id = create_campaign(client)
+    client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE})
+    client.get(f'/scan/{campaign_id}', headers={'User-Agent': 'curl/8.4.0'})
+
+    rows = [json.loads(line) for line in client.get(f'/campaign/{campaign_id}/export.ndjson').get_data(as_text=True).splitlines()]
+    assert [row['is_bot'] for row in rows] == [False, True]
+    assert rows[0]['device'] == 'mobile' and rows[0]['country'] is None
+
+    lines = client.get(f'/campaign/{campaign_id}/export.csv').get_data(as_text=True).splitlines()
+    assert lines[0].startswith('campaign_id,timestamp,ip_address')
+    assert len(lines) == 3
+
+
+def test_timeseries_totals(client):
+    campaign_id = create_campaign(client)
+    for n in range(4):
+        client.get(f'/scan/{campaign_id}', headers={'User-Agent': IPHONE, 'X-Forwarded-For': f'198.51.100.{n}'})
+
+    series = client.get(f'/campaign/{campaign_id}/timeseries').get_json()['series']
+    assert sum(entry['scans'] for entry in series) == 4
+
+
+def test_qr_images(client):
+    campaign_id = create_campaign(client)
+    png = client.get(f'/qr/{campaign_id}.png')
+    assert png.status_code == 200 and png.data.startswith(b'\x89PNG')
+    svg = client.get(f'/qr/{campaign_id}.svg?fill=%23336699')
+    assert svg.status_code == 200 and b'fill="#336699"' in svg.data
+    assert client.get(f'/qr/{campaign_id}.png', headers={'If-None-Match': png.headers['ETag']}).status_code == 304
+    assert client.get(f'/qr/{campaign_id}.png?fill=blurple').status_code == 400
+    assert client.get('/qr/camp_9999.png').status_code == 404
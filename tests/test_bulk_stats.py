@@ -0,0 +1,76 @@
+import types
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import bulk_stats
+from bulk_stats import MAX_BULK_IDS, ResultCache, parse_bulk_stats_query
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bulk_stats, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_query_defaults():
+    assert parse_bulk_stats_query(MultiDict()) == {
+        'campaign_ids': None, 'status': None, 'business_name': None, 'limit': 100, 'cursor': None
+    }
+
+
+def test_ids_are_merged_deduplicated_and_sorted():
+    args = MultiDict([('ids', 'camp_0003, camp_0001,,'), ('ids', 'camp_0001'), ('status', 'active')])
+    query = parse_bulk_stats_query(args)
+    assert query['campaign_ids'] == ['camp_0001', 'camp_0003']
+    assert query['status'] == 'active'
+    # Only separators is still an explicit (empty) selection
+    assert parse_bulk_stats_query(MultiDict({'ids': ' , '}))['campaign_ids'] == []
+
+
+def test_bad_queries():
+    too_many = ','.join(f'camp_{n:05d}' for n in range(MAX_BULK_IDS + 1))
+    for args in ({'ids': too_many}, {'limit': 'all'}, {'limit': '0'}):
+        with pytest.raises(ValueError):
+            parse_bulk_stats_query(MultiDict(args))
+    # Repeats don't count towards the limit
+    ids = ','.join(['camp_0001'] * (MAX_BULK_IDS + 1))
+    assert parse_bulk_stats_query(MultiDict({'ids': ids}))['campaign_ids'] == ['camp_0001']
+
+
+def test_entries_expire(clock):
+    cache = ResultCache(ttl=5)
+    cache.put('page', {'campaigns': []})
+    clock.now += 4.9
+    assert cache.get('page') == {'campaigns': []}
+    clock.now += 0.1
+    assert cache.get('page') is None
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['hit_rate']) == (0, 1, 1, 0.5)
+
+
+def test_zero_ttl_disables_caching(clock, monkeypatch):
+    monkeypatch.setenv('BULK_STATS_CACHE_TTL', '5')
+    cache = ResultCache(ttl=0)
+    cache.put('page', {'campaigns': []})
+    assert cache.get('page') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_page_is_evicted(clock):
+    cache = ResultCache(ttl=60, max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
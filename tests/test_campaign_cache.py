@@ -0,0 +1,70 @@
+import os
+
+from campaign_cache import CampaignCache
+
+
+class Loader:
+    def __init__(self, campaigns):
+        self.campaigns = campaigns
+        self.calls = 0
+
+    def __call__(self, campaign_id):
+        self.calls += 1
+        return self.campaigns.get(campaign_id)
+
+
+def test_hits_skip_the_loader():
+    loader = Loader({'camp_0001': {'campaign_id': 'camp_0001'}})
+    cache = CampaignCache(loader)
+    assert cache.get('camp_0001') == {'campaign_id': 'camp_0001'}
+    assert cache.get('camp_0001') == {'campaign_id': 'camp_0001'}
+    assert cache.get('camp_9999') is None
+    assert cache.get('camp_9999') is None
+    assert loader.calls == 2
+    assert cache.stats()['hits'] == 1 and cache.stats()['negative_hits'] == 1
+
+
+def test_zero_ttl_disables_caching():
+    loader = Loader({'camp_0001': {'campaign_id': 'camp_0001'}})
+    cache = CampaignCache(loader, ttl=0, negative_ttl=0)
+    for _ in range(3):
+        cache.get('camp_0001')
+        cache.get('camp_9999')
+    assert loader.calls == 6
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidate_reloads():
+    campaigns = {'camp_0001': {'campaign_id': 'camp_0001', 'target_url': 'https://a.example'}}
+    loader = Loader(campaigns)
+    cache = CampaignCache(loader)
+    cache.get('camp_0001')
+    campaigns['camp_0001'] = {'campaign_id': 'camp_0001', 'target_url': 'https://b.example'}
+    cache.invalidate('camp_0001')
+    assert cache.get('camp_0001')['target_url'] == 'https://b.example'
+    assert cache.invalidations == 1
+
+
+def test_watched_file_change_clears_cache(tmp_path):
+    path = tmp_path / 'campaigns.json'
+    path.write_text('{}')
+    loader = Loader({'camp_0001': {'campaign_id': 'camp_0001'}})
+    cache = CampaignCache(loader, watch_path=str(path), mtime_check_interval=0)
+    cache.get('camp_0001')
+    cache.get('camp_0001')
+    assert loader.calls == 1
+
+    path.write_text('{"changed": true}')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    cache.get('camp_0001')
+    assert loader.calls == 2
+
+
+def test_lru_eviction():
+    loader = Loader({f'camp_{n:04d}': {'campaign_id': f'camp_{n:04d}'} for n in range(5)})
+    cache = CampaignCache(loader, max_entries=2)
+    for n in range(5):
+        cache.get(f'camp_{n:04d}')
+    assert cache.stats()['size'] == 2
+    assert cache.evictions == 3
@@ -0,0 +1,68 @@
+import pytest
+
+from geoip import GeoIPDatabase, compile_database, geo_fields, load_geoip
+
+SOURCE = """network,country,city
+81.2.69.0/24,GB,London
+# comment lines are ignored
+203.0.113.0,203.0.113.127,US,Springfield
+203.0.113.128,203.0.113.255,US,Shelbyville
+2001:db8::/32,NL,Amsterdam
+198.51.100.0/24,FR,
+203.0.113.64/26,DE,Berlin
+not-an-ip,XX,Nowhere
+"""
+
+
+@pytest.fixture
+def geoip(tmp_path):
+    source = tmp_path / 'ranges.csv'
+    source.write_text(SOURCE)
+    output = tmp_path / 'geoip.bin'
+    ranges, skipped = compile_database(str(source), str(output))
+    # Header, the overlapping 203.0.113.64/26 and the malformed row
+    assert (ranges, skipped) == (5, 3)
+    database = GeoIPDatabase(str(output))
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize('address, location', [
+    ('81.2.69.0', ('GB', 'London')),
+    ('81.2.69.255', ('GB', 'London')),
+    ('203.0.113.127', ('US', 'Springfield')),
+    ('203.0.113.128', ('US', 'Shelbyville')),
+    ('2001:db8::1', ('NL', 'Amsterdam')),
+    ('198.51.100.7', ('FR', '')),
+    # Only the first address of an X-Forwarded-For value counts
+    ('81.2.69.10, 10.0.0.1', ('GB', 'London')),
+])
+def test_lookup_finds_ranges(geoip, address, location):
+    assert geoip.lookup(address) == location
+
+
+@pytest.mark.parametrize('address', ['81.2.68.255', '81.2.70.0', '8.8.8.8', '::1', 'garbage', ''])
+def test_lookup_outside_ranges(geoip, address):
+    assert geoip.lookup(address) is None
+
+
+def test_lookups_are_cached(geoip):
+    geoip.lookup('81.2.69.1')
+    geoip.lookup('81.2.69.1')
+    assert geoip.stats()['cache_hits'] >= 1
+
+
+def test_geo_fields_marks_unknown_addresses(geoip):
+    assert geo_fields(geoip, '81.2.69.1') == {'country': 'GB', 'city': 'London'}
+    assert geo_fields(geoip, '8.8.8.8') == {'country': '', 'city': ''}
+    assert geo_fields(geoip, None) == {'country': '', 'city': ''}
+
+
+def test_load_geoip_without_a_file(tmp_path):
+    assert load_geoip(str(tmp_path / 'missing.bin')) is None
+
+
+def test_load_geoip_rejects_other_files(tmp_path):
+    path = tmp_path / 'geoip.bin'
+    path.write_bytes(b'not a geoip file at all')
+    assert load_geoip(str(path)) is None
@@ -0,0 +1,71 @@
+import pytest
+
+from hll import HyperLogLog, visitor_hash
+
+
+def hashes(count, prefix='visitor'):
+    return [visitor_hash(f"{prefix}-{n}", 'Mozilla/5.0') for n in range(count)]
+
+
+def test_visitor_hash_is_stable_sha256_hex():
+    value = visitor_hash('203.0.113.9', 'Mozilla/5.0')
+    assert value == visitor_hash('203.0.113.9', 'Mozilla/5.0')
+    assert len(value) == 64 and int(value, 16) >= 0
+    assert value != visitor_hash('203.0.113.10', 'Mozilla/5.0')
+
+
+def test_empty_and_small_counts_are_near_exact():
+    sketch = HyperLogLog()
+    assert sketch.estimate() == 0
+    for value in hashes(100):
+        sketch.add(value)
+    assert abs(sketch.estimate() - 100) <= 2
+
+
+def test_duplicates_do_not_count_twice():
+    sketch = HyperLogLog()
+    for _ in range(5):
+        for value in hashes(500):
+            sketch.add(value)
+    assert abs(sketch.estimate() - 500) <= 500 * 0.05
+
+
+@pytest.mark.parametrize('count', [10_000, 50_000])
+def test_large_counts_within_error_bound(count):
+    sketch = HyperLogLog()
+    for value in hashes(count):
+        sketch.add(value)
+    # Four standard errors: fails by chance far less than once in 10,000 runs
+    assert abs(sketch.estimate() - count) <= count * sketch.error_bound * 4
+
+
+def test_merge_counts_the_union():
+    first, second, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for value in hashes(3000, 'a'):
+        first.add(value)
+        union.add(value)
+    for value in hashes(3000, 'a')[1000:] + hashes(2000, 'b'):
+        second.add(value)
+        union.add(value)
+    assert first.merge(second).registers == union.registers
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(11).merge(HyperLogLog(12))
+
+
+def test_serialization_round_trip():
+    sketch = HyperLogLog(precision=12)
+    for value in hashes(1234):
+        sketch.add(value)
+    restored = HyperLogLog.from_bytes(sketch.to_bytes())
+    assert restored.precision == 12
+    assert restored.registers == sketch.registers
+    assert HyperLogLog.from_bytes(b'').estimate() == 0
+
+
+@pytest.mark.parametrize('precision', [3, 17])
+def test_precision_bounds(precision):
+    with pytest.raises(ValueError):
+        HyperLogLog(precision)
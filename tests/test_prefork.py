@@ -0,0 +1,95 @@
+import os
+import signal
+
+import pytest
+
+from prefork import RECYCLE, Supervisor, Worker
+
+ENV = ('WEB_WORKERS', 'WORKER_MAX_REQUESTS', 'WORKER_MAX_REQUESTS_JITTER', 'WORKER_GRACEFUL_TIMEOUT')
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    for name in ENV:
+        monkeypatch.delenv(name, raising=False)
+    created = []
+
+    def make(**options):
+        created.append(Supervisor(**options))
+        return created[-1]
+    yield make
+    for instance in created:
+        os.close(instance._wakeup_read)
+        os.close(instance._wakeup_write)
+
+
+def test_defaults(supervisor):
+    instance = supervisor()
+    assert instance.worker_count == (os.cpu_count() or 1)
+    assert (instance.max_requests, instance.max_requests_jitter, instance.graceful_timeout) == (0, 0, 30.0)
+
+
+def test_environment(supervisor, monkeypatch):
+    monkeypatch.setenv('WEB_WORKERS', '3')
+    monkeypatch.setenv('WORKER_MAX_REQUESTS', '1000')
+    monkeypatch.setenv('WORKER_MAX_REQUESTS_JITTER', '50')
+    monkeypatch.setenv('WORKER_GRACEFUL_TIMEOUT', '0')
+    instance = supervisor()
+    assert instance.worker_count == 3
+    assert (instance.max_requests, instance.max_requests_jitter) == (1000, 50)
+    # 0 means "don't wait for in-flight requests", not "use the default"
+    assert instance.graceful_timeout == 0.0
+
+
+def test_arguments_override_environment(supervisor, monkeypatch):
+    monkeypatch.setenv('WEB_WORKERS', '3')
+    monkeypatch.setenv('WORKER_MAX_REQUESTS', '1000')
+    instance = supervisor(workers=5, max_requests=0, graceful_timeout=2)
+    assert instance.worker_count == 5
+    assert instance.max_requests == 0
+    assert instance.graceful_timeout == 2.0
+
+
+def test_zero_workers_means_one_per_cpu(supervisor, monkeypatch):
+    monkeypatch.setenv('WEB_WORKERS', '0')
+    assert supervisor().worker_count == (os.cpu_count() or 1)
+
+
+def test_invalid_setting_is_rejected(supervisor, monkeypatch):
+    monkeypatch.setenv('WORKER_MAX_REQUESTS', 'many')
+    with pytest.raises(ValueError):
+        supervisor()
+
+
+def test_signals_scale_and_reload(supervisor):
+    instance = supervisor(workers=2)
+    instance._signals = [signal.SIGTTIN, signal.SIGTTIN, signal.SIGTTOU, signal.SIGHUP]
+    assert not instance._handle_signals()
+    assert instance.worker_count == 3
+    assert instance.generation == 1
+
+    instance._signals = [signal.SIGTTOU, signal.SIGTTOU, signal.SIGTTOU]
+    instance._handle_signals()
+    assert instance.worker_count == 1
+    instance._signals = [signal.SIGTERM]
+    assert instance._handle_signals()
+
+
+def test_worker_asks_to_be_recycled_once():
+    status_read, status_write = os.pipe()
+    worker = Worker('127.0.0.1', 0, None, status_write, max_requests=2, graceful_timeout=1)
+
+    def app(environ, start_response):
+        start_response('200 OK', [])
+        return [b'ok']
+
+    application = worker.wsgi(app)
+    for _ in range(3):
+        # The server closes the body iterable once it's sent
+        body = application({}, lambda status, headers, exc_info=None: None)
+        assert list(body) == [b'ok']
+        body.close()
+    os.close(status_write)
+    assert os.read(status_read, 16) == RECYCLE
+    os.close(status_read)
+    assert (worker.requests, worker.active) == (3, 0)
@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip('qrcode')
+
+import qr_render
+from qr_render import RenderCache, RenderedQR, parse_render_options, render_qr
+
+URL = 'http://localhost:5000/scan/camp_0001'
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = RenderCache(max_bytes=1024 * 1024)
+    monkeypatch.setattr(qr_render, 'render_cache', cache)
+    return cache
+
+
+def rendered(size):
+    return RenderedQR(b'x' * size, 'image/png', 'etag')
+
+
+def test_render_options():
+    assert parse_render_options({}) == {'box_size': 10, 'fill': 'black', 'back': 'white'}
+    assert parse_render_options({'box_size': '4', 'fill': '#0a0', 'back': '#FFEEDD'})['fill'] == '#0a0'
+    for args in ({'box_size': 'big'}, {'box_size': '0'}, {'box_size': '41'},
+                 {'fill': '"/><script>alert(1)</script>'}, {'back': '#12345'}, {'fill': 'notacolor'}):
+        with pytest.raises(ValueError):
+            parse_render_options(args)
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    cache = RenderCache(max_bytes=100)
+    cache.put('a', rendered(40))
+    cache.put('b', rendered(40))
+    assert cache.get('a') is not None
+    cache.put('c', rendered(40))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+    # Replacing an entry doesn't double count it; oversized images aren't kept
+    cache.put('c', rendered(50))
+    cache.put('huge', rendered(101))
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (2, 90, 1)
+    assert (stats['hits'], stats['misses']) == (3, 1)
+
+
+def test_render_is_cached(cache):
+    first = render_qr(URL, 'png', box_size=4)
+    assert first.body.startswith(b'\x89PNG')
+    assert render_qr(URL, 'png', box_size=4) is first
+    assert cache.stats()['hits'] == 1
+
+    recolored = render_qr(URL, 'png', box_size=4, fill='navy')
+    assert recolored.etag != first.etag
+    assert cache.stats()['entries'] == 2
+
+
+def test_svg_uses_the_requested_colors(cache):
+    svg = render_qr(URL, 'svg', box_size=2, fill='#112233', back='ivory')
+    assert svg.content_type == 'image/svg+xml'
+    assert svg.body.startswith(b'<svg')
+    assert b'fill="#112233"' in svg.body and b'fill="ivory"' in svg.body
+
+
+def test_unknown_format(cache):
+    with pytest.raises(ValueError):
+        render_qr(URL, 'gif')
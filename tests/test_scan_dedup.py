@@ -0,0 +1,100 @@
+import types
+
+import pytest
+
+import scan_dedup
+from scan_dedup import DedupWindow, suppression_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scan_dedup, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('SCAN_DEDUP_WINDOW', raising=False)
+    window = DedupWindow()
+    assert not window.enabled
+    assert not window.is_duplicate('camp_0001', 'visitor')
+    assert not window.is_duplicate('camp_0001', 'visitor')
+
+
+def test_zero_window_argument_disables(monkeypatch):
+    monkeypatch.setenv('SCAN_DEDUP_WINDOW', '10')
+    assert not DedupWindow(window=0).enabled
+
+
+def test_repeat_within_window_is_suppressed(clock):
+    window = DedupWindow(window=10)
+    assert not window.is_duplicate('camp_0001', 'visitor')
+    clock.now += 9
+    assert window.is_duplicate('camp_0001', 'visitor')
+    assert not window.is_duplicate('camp_0002', 'visitor')
+    assert not window.is_duplicate('camp_0001', 'someone else')
+    assert window.stats()['suppressed'] == 1
+
+
+def test_repeat_after_window_is_recorded(clock):
+    window = DedupWindow(window=10)
+    assert not window.is_duplicate('camp_0001', 'visitor')
+    clock.now += 10
+    assert not window.is_duplicate('camp_0001', 'visitor')
+    # The new sighting starts a new window
+    clock.now += 5
+    assert window.is_duplicate('camp_0001', 'visitor')
+
+
+def test_old_keys_expire_with_their_generation(clock):
+    window = DedupWindow(window=10)
+    window.is_duplicate('camp_0001', 'visitor')
+    clock.now += 11
+    window.is_duplicate('camp_0001', 'other')
+    assert window.stats()['entries'] == 2
+    clock.now += 11
+    window.is_duplicate('camp_0001', 'third')
+    # Two rotations later the first key is gone, not just stale
+    assert window.stats()['entries'] == 2
+    assert window.stats()['rotations'] == 2
+
+
+def test_max_entries_rotates_early(clock):
+    window = DedupWindow(window=10, max_entries=4)
+    for n in range(5):
+        window.is_duplicate('camp_0001', f'visitor-{n}')
+    assert window.stats()['rotations'] == 2
+    assert window.stats()['entries'] <= 4
+
+
+def test_flush_hands_over_counts_and_keeps_them_on_failure(clock):
+    flushed = []
+    failing = [True]
+
+    def flush(counts):
+        if failing[0]:
+            raise RuntimeError("database unavailable")
+        flushed.append(counts)
+
+    window = DedupWindow(flush=flush, window=10, flush_interval=3600)
+    window.is_duplicate('camp_0001', 'visitor')
+    window.is_duplicate('camp_0001', 'visitor')
+    window.is_duplicate('camp_0001', 'visitor')
+    window.flush()
+    assert flushed == []
+    failing[0] = False
+    window.close()
+    assert flushed == [{'camp_0001': 2}]
+
+
+def test_suppression_rate():
+    assert suppression_rate({'total_scans': 3, 'suppressed_scans': 1}) == 0.25
+    assert suppression_rate({'total_scans': 0, 'suppressed_scans': 0}) == 0.0
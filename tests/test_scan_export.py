@@ -0,0 +1,84 @@
+import csv
+import io
+import ipaddress
+import json
+from datetime import datetime
+
+import pytest
+
+from scan_export import EXPORT_FIELDS, parse_exclude_bots, parse_page_size, stream_export, with_ua_fields
+
+IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+          '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1')
+
+
+def scan(**fields):
+    row = {'campaign_id': 'camp_0001', 'timestamp': datetime(2026, 10, 1, 9, 15), 'ip_address': '203.0.113.9',
+           'user_agent': IPHONE, 'referrer': None, 'visitor_hash': 'abc123', 'country': None, 'city': None}
+    row.update(fields)
+    return row
+
+
+def test_page_size():
+    assert parse_page_size({}) == 100
+    assert parse_page_size({'limit': '25'}) == 25
+    assert parse_page_size({'limit': '50000'}) == 1000
+    for bad in ('x', '0', '-5', None):
+        with pytest.raises(ValueError):
+            parse_page_size({'limit': bad})
+
+
+def test_exclude_bots(monkeypatch):
+    monkeypatch.delenv('STATS_EXCLUDE_BOTS', raising=False)
+    assert not parse_exclude_bots({})
+    assert parse_exclude_bots({'exclude_bots': 'TRUE'})
+    assert not parse_exclude_bots({'exclude_bots': 'no'})
+    monkeypatch.setenv('STATS_EXCLUDE_BOTS', 'yes')
+    assert parse_exclude_bots({})
+    assert not parse_exclude_bots({'exclude_bots': '0'})
+
+
+def test_legacy_scans_are_classified_from_the_user_agent():
+    # A missing user agent counts as a bot; a stale is_bot column is replaced
+    row = with_ua_fields(scan(user_agent=None, is_bot=False))
+    assert (row['device'], row['is_bot']) == ('bot', True)
+    assert with_ua_fields(scan())['device'] == 'mobile'
+    assert 'ua_class' not in with_ua_fields(scan(ua_class=0))
+
+
+def test_csv_cells_are_text():
+    rows = [scan(user_agent='curl/8.4.0, "quoted"\nsecond line', ip_address=ipaddress.ip_address('203.0.113.9'))]
+    document = ''.join(stream_export(rows, 'csv'))
+    header, row = csv.reader(io.StringIO(document))
+    assert header == EXPORT_FIELDS
+    values = dict(zip(header, row))
+    assert values['user_agent'] == 'curl/8.4.0, "quoted"\nsecond line'
+    assert values['timestamp'] == '2026-10-01T09:15:00'
+    assert values['ip_address'] == '203.0.113.9'
+    assert values['referrer'] == values['country'] == ''
+    assert values['is_bot'] == 'True'
+
+
+def test_ndjson_keeps_json_types():
+    rows = [scan(ip_address=ipaddress.ip_address('203.0.113.9')), scan(user_agent='Googlebot/2.1')]
+    lines = [json.loads(line) for line in ''.join(stream_export(rows, 'ndjson')).splitlines()]
+    assert list(lines[0]) == EXPORT_FIELDS
+    assert lines[0]['referrer'] is None
+    assert lines[0]['ip_address'] == '203.0.113.9'
+    assert lines[0]['timestamp'] == '2026-10-01T09:15:00'
+    assert (lines[0]['is_bot'], lines[1]['is_bot']) == (False, True)
+
+
+def test_export_streams_in_chunks():
+    rows = [scan(campaign_id=f'camp_{n:04d}') for n in range(50)]
+    chunks = list(stream_export(rows, 'ndjson', chunk_size=512))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == ''.join(stream_export(rows, 'ndjson'))
+    assert len(''.join(chunks).splitlines()) == 50
+    # The caller's rows are left untouched
+    assert 'device' not in rows[0]
+
+
+def test_empty_export():
+    assert list(stream_export([], 'ndjson')) == []
+    assert list(csv.reader(io.StringIO(''.join(stream_export([], 'csv'))))) == [EXPORT_FIELDS]
@@ -0,0 +1,102 @@
+import os
+
+from campaign_cache import CampaignCache
+from scan_fastpath import ScanFastPath
+
+
+def campaign(campaign_id, target_url):
+    return {'campaign_id': campaign_id, 'target_url': target_url}
+
+
+class FlaskStandIn:
+    """Wrapped WSGI app that loads through the cache the way the /scan route does"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = 0
+
+    def __call__(self, environ, start_response):
+        self.calls += 1
+        found = self.cache.get(environ['PATH_INFO'].rsplit('/', 1)[-1])
+        if found is None:
+            start_response('404 NOT FOUND', [])
+            return [b'']
+        start_response('302 FOUND', [('Location', found['target_url'])])
+        return [b'']
+
+
+def scan(fast_path, campaign_id):
+    seen = {}
+
+    def start_response(status, headers):
+        seen['status'], seen['headers'] = status, dict(headers)
+
+    fast_path({'REQUEST_METHOD': 'GET', 'PATH_INFO': f'/scan/{campaign_id}', 'REMOTE_ADDR': '203.0.113.9'},
+              start_response)
+    return seen['status'], seen['headers'].get('Location')
+
+
+def make_fast_path(campaigns, **cache_options):
+    cache = CampaignCache(campaigns.get, **cache_options)
+    recorded = []
+    app = FlaskStandIn(cache)
+    fast_path = ScanFastPath(app, lambda *scan: recorded.append(scan), cache)
+    return fast_path, app, cache, recorded
+
+
+def test_known_campaign_skips_the_app():
+    campaigns = {'camp_0001': campaign('camp_0001', 'https://a.example/')}
+    fast_path, app, cache, recorded = make_fast_path(campaigns)
+    cache.preload(list(campaigns.values()))
+    fast_path.build(list(campaigns.values()))
+
+    assert scan(fast_path, 'camp_0001') == ('302 FOUND', 'https://a.example/')
+    assert app.calls == 0
+    assert recorded == [('camp_0001', '203.0.113.9', '', '')]
+    assert fast_path.stats()['hits'] == 1
+
+
+def test_missing_campaign_falls_through():
+    fast_path, app, cache, recorded = make_fast_path({})
+    assert scan(fast_path, 'camp_9999')[0] == '404 NOT FOUND'
+    assert scan(fast_path, 'camp_9999')[0] == '404 NOT FOUND'
+    assert app.calls == 2
+    assert recorded == []
+    assert fast_path.stats()['fallthroughs'] == 2
+
+
+def test_new_campaign_is_picked_up_after_first_fallthrough():
+    campaigns = {}
+    fast_path, app, cache, recorded = make_fast_path(campaigns, negative_ttl=0)
+    assert scan(fast_path, 'camp_0002')[0] == '404 NOT FOUND'
+
+    # Created by another worker: this one only learns of it through the route
+    campaigns['camp_0002'] = campaign('camp_0002', 'https://new.example/')
+    assert scan(fast_path, 'camp_0002') == ('302 FOUND', 'https://new.example/')
+    assert scan(fast_path, 'camp_0002') == ('302 FOUND', 'https://new.example/')
+    assert app.calls == 2
+    assert len(recorded) == 1
+
+
+def test_edited_campaign_is_picked_up(tmp_path):
+    path = tmp_path / 'campaigns.json'
+    path.write_text('{}')
+    campaigns = {'camp_0001': campaign('camp_0001', 'https://a.example/')}
+    fast_path, app, cache, recorded = make_fast_path(campaigns, watch_path=str(path), mtime_check_interval=0)
+    cache.preload(list(campaigns.values()))
+    assert scan(fast_path, 'camp_0001')[1] == 'https://a.example/'
+
+    campaigns['camp_0001'] = campaign('camp_0001', 'https://b.example/')
+    path.write_text('{"edited": true}')
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert scan(fast_path, 'camp_0001')[1] == 'https://b.example/'
+    assert scan(fast_path, 'camp_0001')[1] == 'https://b.example/'
+    assert app.calls == 1
+    assert fast_path.stats()['builds'] == 2
+
+    cache.invalidate('camp_0001')
+    campaigns['camp_0001'] = campaign('camp_0001', 'https://c.example/')
+    assert scan(fast_path, 'camp_0001')[1] == 'https://c.example/'
+    assert scan(fast_path, 'camp_0001')[1] == 'https://c.example/'
+    assert app.calls == 2
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+
+from scan_counters import ScanCounters
+from scan_log import ScanLog, iter_legacy_scans, read_manifest, segment_path
+
+
+def make_scan(n, campaign_id='camp_0001'):
+    return {
+        'campaign_id': campaign_id,
+        'timestamp': f"2026-10-01T00:00:{n % 60:02d}",
+        'ip_address': f"10.0.{n // 256 % 256}.{n % 256}",
+        'user_agent': 'Mozilla/5.0',
+        'n': n
+    }
+
+
+def open_log(tmp_path, **kwargs):
+    kwargs.setdefault('durability', 'fsync')
+    kwargs.setdefault('compact_interval', 0)
+    return ScanLog(str(tmp_path / 'segments'), legacy_path=str(tmp_path / 'scans.json'),
+                   legacy_log_path=str(tmp_path / 'scans.log'), **kwargs)
+
+
+def test_torn_tail_is_dropped_on_open(tmp_path):
+    scan_log = open_log(tmp_path)
+    scan_log.append_many([make_scan(n) for n in range(3)])
+    path = segment_path(scan_log.path, scan_log.stats()['active_segment'])
+    scan_log.close()
+
+    with open(path, 'ab') as f:
+        f.write(b'{"campaign_id": "camp_0001", "n": ')
+
+    scan_log = open_log(tmp_path)
+    scan_log.append(make_scan(3))
+    assert [scan['n'] for scan in scan_log.iter_scans()] == [0, 1, 2, 3]
+    scan_log.close()
+
+
+def test_iter_legacy_scans_across_chunk_boundaries(tmp_path):
+    scans = [dict(make_scan(n), user_agent='x' * (n * 7 % 50)) for n in range(200)]
+    path = tmp_path / 'scans.json'
+    path.write_text(json.dumps({'campaigns_seen': ['[not the array]'], 'scans': scans}, indent=2))
+
+    for chunk_size in (1, 7, 64, 1 << 20):
+        assert [scan for _, scan in iter_legacy_scans(str(path), chunk_size=chunk_size)] == scans
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    scans = [make_scan(n) for n in range(5)]
+    (tmp_path / 'scans.json').write_text(json.dumps({'scans': scans}))
+
+    scan_log = open_log(tmp_path)
+    assert list(scan_log.iter_scans()) == scans
+    scan_log.close()
+    assert (tmp_path / 'scans.json.migrated').exists()
+
+    scan_log = open_log(tmp_path)
+    assert len(list(scan_log.iter_scans())) == 5
+    scan_log.close()
+
+
+def test_compaction_merges_small_segments_and_keeps_campaign_reads(tmp_path):
+    scan_log = open_log(tmp_path, segment_bytes=4096)
+    for n in range(300):
+        scan_log.append(make_scan(n, campaign_id=f"camp_{n % 3:04d}"))
+    before = scan_log.stats()['segments']
+
+    # Make every sealed segment small enough to merge
+    scan_log.segment_bytes = 1 << 20
+    merged = scan_log.compact()
+    assert merged > 1
+    assert scan_log.stats()['segments'] < before
+
+    assert [scan['n'] for scan in scan_log.iter_scans()] == list(range(300))
+    campaign = [scan['n'] for _, _, scan in scan_log.iter_campaign_records('camp_0001')]
+    assert campaign == list(range(1, 300, 3))
+    scan_log.close()
+
+
+def test_merged_segments_are_kept_for_the_grace_period(tmp_path):
+    scan_log = open_log(tmp_path, segment_bytes=2048, retired_grace=3600)
+    scan_log.append_many([make_scan(n) for n in range(20)])
+    for n in range(20, 100):
+        scan_log.append(make_scan(n))
+    old_manifest = read_manifest(scan_log.path)
+
+    scan_log.segment_bytes = 1 << 20
+    assert scan_log.compact() > 1
+    retired = [segment_id for segment_id, _ in read_manifest(scan_log.path)['retired']]
+    assert retired
+    assert all(os.path.exists(segment_path(scan_log.path, segment_id)) for segment_id in retired)
+
+    # A reader that picked up the old manifest can still finish
+    from scan_log import iter_log_records
+    assert len(list(iter_log_records(scan_log.path, manifest=old_manifest))) == 100
+
+    # Another process opening the log must not delete them either
+    other = open_log(tmp_path)
+    other.close()
+    assert all(os.path.exists(segment_path(scan_log.path, segment_id)) for segment_id in retired)
+
+    scan_log.retired_grace = 0
+    scan_log.compact()
+    assert read_manifest(scan_log.path)['retired'] == []
+    assert not any(os.path.exists(segment_path(scan_log.path, segment_id)) for segment_id in retired)
+    assert len(list(scan_log.iter_scans())) == 100
+    scan_log.close()
+
+
+def test_compaction_while_another_writer_appends(tmp_path):
+    # Two ScanLog instances on one directory take separate flocks, like a
+    # server worker and manage.py compact-scans
+    server = open_log(tmp_path, durability='periodic', segment_bytes=2048)
+    counters = ScanCounters(server, path=str(tmp_path / 'scan_counters.json'), snapshot_interval=3600)
+    compactor = open_log(tmp_path, segment_bytes=1 << 20, retired_grace=0)
+
+    done = threading.Event()
+
+    def write():
+        for n in range(2000):
+            server.append(make_scan(n, campaign_id=f"camp_{n % 5:04d}"))
+        server.flush()
+        done.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    merged = 0
+    while not done.is_set():
+        merged += compactor.compact()
+    writer.join()
+    merged += compactor.compact()
+    assert merged > 0
+
+    assert sorted(scan['n'] for scan in compactor.iter_scans()) == list(range(2000))
+    totals = counters.get_many([f"camp_{n:04d}" for n in range(5)])
+    assert sum(entry['total_scans'] for entry in totals.values()) == 2000
+
+    counters.close()
+    server.close()
+    compactor.close()
@@ -0,0 +1,123 @@
+import json
+import threading
+
+import psycopg2
+
+from scan_writer import ScanWriter
+
+
+class FakeDatabase:
+    """Stands in for database.Database: stores batches, or fails while down"""
+
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self.bad_campaigns = set()
+        self.blocked = None
+
+    def log_scans(self, scans):
+        if self.blocked:
+            self.blocked.wait()
+        if self.down:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        if any(scan['campaign_id'] in self.bad_campaigns for scan in scans):
+            raise psycopg2.DataError("value too long for type character varying(50)")
+        self.rows.extend(scans)
+
+
+def make_writer(tmp_path, db, **options):
+    options.setdefault('flush_interval', 0.01)
+    return ScanWriter(db, spill_path=str(tmp_path / 'spill.ndjson'), **options)
+
+
+def spilled_campaigns(tmp_path):
+    with open(tmp_path / 'spill.ndjson') as f:
+        return [json.loads(line)['campaign_id'] for line in f]
+
+
+def test_close_flushes_queued_scans(tmp_path):
+    db = FakeDatabase()
+    writer = make_writer(tmp_path, db).start()
+    for n in range(25):
+        writer.submit(f'camp_{n:04d}', '203.0.113.9', 'curl/8.4.0')
+    writer.close()
+    assert len(db.rows) == 25
+    assert writer.stats()['written'] == 25
+
+
+def test_failed_writes_spill_and_replay(tmp_path):
+    db = FakeDatabase()
+    db.down = True
+    writer = make_writer(tmp_path, db)
+    writer._write([{'campaign_id': 'camp_0001'}, {'campaign_id': 'camp_0002'}])
+    assert spilled_campaigns(tmp_path) == ['camp_0001', 'camp_0002']
+    assert not writer._db_ok
+
+    db.down = False
+    writer._replay_spill()
+    assert [row['campaign_id'] for row in db.rows] == ['camp_0001', 'camp_0002']
+    assert not (tmp_path / 'spill.ndjson').exists()
+    assert not (tmp_path / 'spill.ndjson.replay').exists()
+
+
+def test_bad_rows_are_dropped_individually(tmp_path):
+    db = FakeDatabase()
+    db.bad_campaigns = {'camp_bad'}
+    writer = make_writer(tmp_path, db)
+    writer._write([{'campaign_id': 'camp_0001'}, {'campaign_id': 'camp_bad'}, {'campaign_id': 'camp_0002'}])
+    assert [row['campaign_id'] for row in db.rows] == ['camp_0001', 'camp_0002']
+    assert writer.stats()['dropped'] == 1
+
+
+def test_connection_loss_during_row_retry_spills_the_rest(tmp_path):
+    db = FakeDatabase()
+    db.bad_campaigns = {'camp_bad'}
+    writer = make_writer(tmp_path, db)
+    original = db.log_scans
+
+    def log_scans(scans):
+        # The batch fails on a bad row, then the server goes away
+        if len(scans) == 1:
+            db.down = True
+        return original(scans)
+
+    db.log_scans = log_scans
+    writer._write([{'campaign_id': 'camp_bad'}, {'campaign_id': 'camp_0001'}, {'campaign_id': 'camp_0002'}])
+    assert spilled_campaigns(tmp_path) == ['camp_bad', 'camp_0001', 'camp_0002']
+    assert not writer._db_ok
+    assert writer.stats()['failed_batches'] == 1
+
+
+def test_close_spills_when_the_writer_is_stuck(tmp_path):
+    db = FakeDatabase()
+    db.blocked = threading.Event()
+    writer = make_writer(tmp_path, db, max_queue=5, batch_size=1).start()
+    for n in range(8):
+        writer.submit(f'camp_{n:04d}', '203.0.113.9', 'curl/8.4.0')
+    writer.close(timeout=0.2)
+    db.blocked.set()
+
+    spilled = spilled_campaigns(tmp_path)
+    assert spilled
+    stats = writer.stats()
+    assert stats['queued'] == 0
+    assert stats['spilled'] == len(spilled)
+
+
+def test_counters_are_consistent_across_threads(tmp_path):
+    db = FakeDatabase()
+    writer = make_writer(tmp_path, db, max_queue=100000).start()
+
+    def submit_many():
+        for _ in range(500):
+            writer.submit('camp_0001', '203.0.113.9', 'curl/8.4.0')
+
+    threads = [threading.Thread(target=submit_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    stats = writer.stats()
+    assert stats['submitted'] == 4000
+    assert stats['written'] + stats['spilled'] == 4000
@@ -0,0 +1,63 @@
+import atexit
+import importlib
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+HEAVY_MODULES = ('qrcode', 'PIL', 'numpy')
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """A freshly imported app on the JSON backend, not yet warmed up"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('STORAGE_BACKEND', 'json')
+    for name in ('SCAN_DEDUP_WINDOW', 'SCAN_FAST_PATH', 'GEOIP_DATABASE', 'SQLITE_PATH'):
+        monkeypatch.delenv(name, raising=False)
+
+    module = importlib.reload(sys.modules['app']) if 'app' in sys.modules else importlib.import_module('app')
+    yield module
+    module.shutdown()
+    atexit.unregister(module.shutdown)
+
+
+def test_import_skips_imaging_and_numpy(tmp_path):
+    script = f"import sys, app; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, STORAGE_BACKEND='json')
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+
+
+def test_warm_up_runs_once(app_module, monkeypatch):
+    starts = []
+    start = app_module.storage.start
+
+    def counting_start():
+        starts.append(threading.get_ident())
+        return start()
+
+    monkeypatch.setattr(app_module.storage, 'start', counting_start)
+    threads = [threading.Thread(target=app_module.warm_up) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    app_module.warm_up()
+    assert len(starts) == 1
+    assert {'imports', 'storage', 'campaign_cache', 'warm_up', 'total'} <= set(app_module.startup_seconds)
+
+    # Requests after warm-up don't start storage again
+    assert app_module.app.test_client().get('/campaigns').status_code == 200
+    assert len(starts) == 1
+
+
+def test_first_request_warms_up(app_module):
+    assert not app_module._warmed
+    assert app_module.app.test_client().get('/campaigns').get_json() == {}
+    assert app_module._warmed
+    assert 'storage' in app_module.startup_seconds
@@ -0,0 +1,95 @@
+import pytest
+
+from ua_classifier import classify, classify_code, decode, encode, ua_fields
+
+IPHONE_SAFARI = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+                 '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+PINTEREST_ANDROID = ('Mozilla/5.0 (Linux; Android 12; SM-G991B Build/SP1A.210812.016; wv) AppleWebKit/537.36 '
+                     '(KHTML, like Gecko) Version/4.0 Chrome/110.0.5481.153 Mobile Safari/537.36 [Pinterest/Android]')
+PINTEREST_IOS = ('Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 '
+                 '(KHTML, like Gecko) Mobile/15E148 [Pinterest/iOS]')
+TELEGRAM_ANDROID = ('Mozilla/5.0 (Linux; Android 13; SM-A525F Build/TP1A.220624.014; wv) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Version/4.0 Chrome/116.0.5845.163 Mobile Safari/537.36 '
+                    'Telegram-Android/10.0.5 (Samsung SM-A525F; Android 13; SDK 33; AVERAGE)')
+SLACK_DESKTOP = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                 'Slack/4.33.90 Chrome/114.0.5735.289 Electron/25.8.1 Safari/537.36 Sonic Slack_SSB/4.33.90')
+DISCORD_DESKTOP = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'discord/1.0.9013 Chrome/108.0.5359.215 Electron/22.3.2 Safari/537.36')
+
+
+@pytest.mark.parametrize('user_agent', [
+    IPHONE_SAFARI, PINTEREST_ANDROID, PINTEREST_IOS, TELEGRAM_ANDROID, SLACK_DESKTOP, DISCORD_DESKTOP
+])
+def test_people_are_not_bots(user_agent):
+    assert not classify(user_agent).is_bot
+
+
+@pytest.mark.parametrize('user_agent', [
+    '',
+    None,
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; Pinterestbot/1.0; +http://www.pinterest.com/bot.html)',
+    'TelegramBot (like TwitterBot)',
+    'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)',
+    'Slack-ImgProxy (+https://api.slack.com/robots)',
+    'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)',
+    'WhatsApp/2.23.20.0 A',
+    'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+    'curl/8.4.0',
+    'python-requests/2.31.0',
+    'Mozilla/5.0+(compatible; UptimeRobot/2.0; http://www.uptimerobot.com/)',
+])
+def test_crawlers_and_clients_are_bots(user_agent):
+    ua_class = classify(user_agent)
+    assert ua_class.is_bot
+    assert ua_class.device == 'bot'
+
+
+def test_in_app_browsers():
+    assert classify(PINTEREST_ANDROID) == ('mobile', 'android', 'in_app', False)
+    assert classify(TELEGRAM_ANDROID).browser == 'in_app'
+    assert classify(PINTEREST_IOS)[:2] == ('mobile', 'ios')
+
+
+def test_devices_and_browsers():
+    assert classify(IPHONE_SAFARI) == ('mobile', 'ios', 'safari', False)
+    assert classify(SLACK_DESKTOP)[:2] == ('desktop', 'macos')
+    assert classify('Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+                    '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1').device == 'tablet'
+    assert classify('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                    'Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0').browser == 'edge'
+
+
+def test_codes_round_trip():
+    for user_agent in (IPHONE_SAFARI, PINTEREST_ANDROID, 'curl/8.4.0', ''):
+        ua_class = classify(user_agent)
+        code = classify_code(user_agent)
+        assert 0 <= code < 4096
+        assert code == encode(ua_class)
+        assert decode(code) == ua_class
+        assert ua_fields(code) == ua_class._asdict()
+
+
+def test_unrecognised_user_agents():
+    assert classify('SomeKiosk/1.0') == ('other', 'other', 'other', False)
+    # Android without "Mobile" is a tablet
+    assert classify('Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) '
+                    'Chrome/120.0.0.0 Safari/537.36').device == 'tablet'
+    assert not classify('Mozilla/5.0 (iPhone) ' + 'x' * 10000).is_bot
+    assert classify('Mozilla/5.0 (Linux; Android 14) Mobile ✓ 日本語').os == 'android'
+
+
+def test_unknown_code_bits_decode_as_other():
+    ua_class = decode(0x7 | 0xF << 3 | 0xF << 7)
+    assert ua_class == ('other', 'other', 'other', False)
+    assert decode(1 << 11).is_bot
+
+
+def test_repeated_user_agents_are_memoized():
+    user_agent = IPHONE_SAFARI + ' memo-test'
+    before = classify.cache_info()
+    classify(user_agent)
+    classify(user_agent)
+    after = classify.cache_info()
+    assert after.misses - before.misses == 1
+    assert after.hits - before.hits == 1
@@ -0,0 +1,131 @@
+"""
+User-agent classification and bot detection
+
+classify() maps a raw User-Agent string to (device, os, browser, is_bot).
+Real traffic has few distinct user agents, so results are memoized in a
+bounded LRU cache (UA_CACHE_SIZE) and the regexes run once per distinct
+string rather than once per scan.
+
+For storage a classification is packed into one small integer (ua_class):
+
+    bits 0-2 device, bits 3-6 os, bits 7-10 browser, bit 11 is_bot
+
+which fits a SMALLINT column; decode() turns it back into names.
+
+Bots (crawlers, link-preview fetchers, HTTP libraries, monitors, and
+requests with no User-Agent at all) still count as scans but are tracked
+separately and never count as unique visitors.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+DEVICES = ('other', 'desktop', 'mobile', 'tablet', 'bot')
+OPERATING_SYSTEMS = ('other', 'windows', 'macos', 'ios', 'android', 'linux', 'chromeos')
+BROWSERS = ('other', 'chrome', 'safari', 'firefox', 'edge', 'opera', 'samsung', 'ie', 'in_app')
+
+UAClass = namedtuple('UAClass', ['device', 'os', 'browser', 'is_bot'])
+
+# Crawler and fetcher tokens only: in-app browsers (Pinterest, Telegram,
+# Slack, Discord) carry their app's name too and are real visitors
+_BOT_RE = re.compile(
+    r'bot\b|bot/|crawl|spider|slurp|preview|facebookexternalhit|facebookcatalog|^whatsapp/|'
+    r'slack-imgproxy|skypeuri|embedly|vkshare|^tumblr/|'
+    r'curl/|wget/|python-requests|python-urllib|aiohttp|httpx|go-http-client|java/|okhttp|'
+    r'libwww|httpclient|axios|node-fetch|headless|phantomjs|lighthouse|pingdom|uptime|'
+    r'site24x7|statuscake|newrelicpinger|datadog|zgrab|masscan|nmap|nuclei|censys|'
+    r'feedfetcher|validator|archive\.org',
+    re.IGNORECASE
+)
+
+_OS_PATTERNS = [
+    ('ios', re.compile(r'iPhone|iPad|iPod|CPU OS \d')),
+    ('android', re.compile(r'Android')),
+    ('windows', re.compile(r'Windows')),
+    ('chromeos', re.compile(r'CrOS')),
+    ('macos', re.compile(r'Macintosh|Mac OS X')),
+    ('linux', re.compile(r'Linux|X11')),
+]
+
+# Order matters: most engines also claim Chrome and/or Safari
+_BROWSER_PATTERNS = [
+    ('in_app', re.compile(r'FBAN|FBAV|Instagram|Line/|Snapchat|GSA/|Pinterest/|Telegram-')),
+    ('edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('opera', re.compile(r'OPR/|Opera')),
+    ('samsung', re.compile(r'SamsungBrowser')),
+    ('firefox', re.compile(r'Firefox/|FxiOS')),
+    ('chrome', re.compile(r'Chrome/|CriOS')),
+    ('safari', re.compile(r'Safari/')),
+    ('ie', re.compile(r'MSIE|Trident/')),
+]
+
+_TABLET_RE = re.compile(r'iPad|Tablet|Kindle|Silk/|PlayBook')
+_MOBILE_RE = re.compile(r'Mobi|iPhone|iPod|Windows Phone')
+
+
+def _first_match(patterns, user_agent):
+    for name, pattern in patterns:
+        if pattern.search(user_agent):
+            return name
+    return 'other'
+
+
+def _classify(user_agent):
+    if not user_agent or _BOT_RE.search(user_agent):
+        return UAClass('bot', _first_match(_OS_PATTERNS, user_agent or ''), 'other', True)
+
+    operating_system = _first_match(_OS_PATTERNS, user_agent)
+    browser = _first_match(_BROWSER_PATTERNS, user_agent)
+    if _TABLET_RE.search(user_agent) or (operating_system == 'android' and 'Mobile' not in user_agent):
+        device = 'tablet'
+    elif _MOBILE_RE.search(user_agent):
+        device = 'mobile'
+    elif operating_system in ('windows', 'macos', 'linux', 'chromeos'):
+        device = 'desktop'
+    else:
+        device = 'other'
+    return UAClass(device, operating_system, browser, False)
+
+
+classify = lru_cache(maxsize=int(os.getenv('UA_CACHE_SIZE', '4096')))(_classify)
+
+
+def encode(ua_class):
+    """Pack a UAClass into the 12-bit ua_class integer"""
+    return (
+        DEVICES.index(ua_class.device)
+        | OPERATING_SYSTEMS.index(ua_class.os) << 3
+        | BROWSERS.index(ua_class.browser) << 7
+        | int(ua_class.is_bot) << 11
+    )
+
+
+def _name(names, index):
+    return names[index] if index < len(names) else 'other'
+
+
+@lru_cache(maxsize=None)
+def decode(code):
+    """Unpack a ua_class integer (at most 4096 distinct codes, so unbounded is fine)"""
+    return UAClass(
+        _name(DEVICES, code & 0x7),
+        _name(OPERATING_SYSTEMS, code >> 3 & 0xF),
+        _name(BROWSERS, code >> 7 & 0xF),
+        bool(code >> 11 & 1)
+    )
+
+
+def classify_code(user_agent):
+    """classify() packed for storage"""
+    return encode(classify(user_agent))
+
+
+def ua_fields(code):
+    """device/os/browser/is_bot dict for API output"""
+    return decode(code)._asdict()
+
+
+def cache_stats():
+    info = classify.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}